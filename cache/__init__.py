@@ -0,0 +1 @@
+# cache/__init__.py
@@ -0,0 +1,201 @@
+import asyncio
+import datetime
+from collections import OrderedDict
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.exc import IntegrityError
+
+from config import (
+    debug_mode, RESPONSE_CACHE_TTL_HOURS,
+    RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MEMORY_ENTRIES
+)
+from db import AsyncSessionLocal, ResponseCacheEntry, User, to_naive_utc
+
+# Версия ключа: меняем при изменении промптов, чтобы старые ответы не использовались
+_KEY_VERSION = "v1"
+
+
+def _round_to(value, step: int):
+    if value is None:
+        return None
+    return int(round(value / step) * step)
+
+
+def bucket_profile(user: User) -> dict:
+    """
+    Нормализованный профиль: близкие профили (вес ±2.5 кг, возраст в пределах
+    пятилетки) дают один и тот же ключ и, значит, один и тот же ответ.
+    """
+    return {
+        "age": (user.age // 5) * 5,
+        "sex": user.sex,
+        "weight": _round_to(user.weight, 5),
+        "height": _round_to(user.height, 5),
+        "goal": user.goal,
+        "skill": user.skill,
+    }
+
+
+def profile_cache_key(command: str, user: User) -> str:
+    p = bucket_profile(user)
+    return (
+        f"{_KEY_VERSION}|{command}|{p['sex']}|{p['age']}|{p['weight']}|"
+        f"{p['height']}|{p['goal']}|{p['skill']}"
+    )
+
+
+class ResponseCache:
+    """
+    Кэш сгенерированных планов: горячая часть — LRU в памяти,
+    источник истины — таблица response_cache (переживает перезапуск).
+    """
+
+    def __init__(self, ttl_hours: int, max_entries: int, memory_entries: int):
+        self.ttl = datetime.timedelta(hours=ttl_hours)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        # key -> (expires_at, response)
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.db_hits = 0
+        # key -> Future с ответом запроса, который сейчас генерирует этот ключ
+        self._inflight = {}
+        self.coalesced = 0
+
+    async def get(self, key: str):
+        now = self._now()
+        cached = self._memory.get(key)
+        if cached is not None:
+            expires_at, response = cached
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return response
+            del self._memory[key]
+
+        async with AsyncSessionLocal() as db_session:
+            row = (await db_session.execute(
+                select(ResponseCacheEntry).where(
+                    ResponseCacheEntry.key == key,
+                    ResponseCacheEntry.expires_at > now
+                )
+            )).scalars().first()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.db_hits += 1
+        self._remember(key, row.expires_at, row.response)
+        return row.response
+
+    async def get_or_create(self, key: str, command: str, produce):
+        """
+        Ответ из кэша, иначе — produce(), но одна генерация на ключ: одновременные
+        промахи по тому же ключу ждут уже идущий запрос к модели (single-flight).
+        produce() возвращает (ответ, можно_кэшировать). Если ведущий запрос упал
+        или его ответ нельзя кэшировать, ожидавшие вызывают produce() сами.
+        """
+        response = await self.get(key)
+        if response is not None:
+            return response
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            response = await asyncio.shield(inflight)
+            if response is not None:
+                return response
+            response, _ = await produce()
+            return response
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response, cacheable = await produce()
+            if cacheable:
+                await self.set(key, command, response)
+                future.set_result(response)
+            return response
+        finally:
+            if not future.done():
+                future.set_result(None)
+            del self._inflight[key]
+
+    async def set(self, key: str, command: str, response: str):
+        now = self._now()
+        expires_at = now + self.ttl
+        async with AsyncSessionLocal() as db_session:
+            row = (await db_session.execute(
+                select(ResponseCacheEntry).filter_by(key=key)
+            )).scalars().first()
+            if row is None:
+                row = ResponseCacheEntry(key=key, command=command)
+                db_session.add(row)
+            row.response = response
+            row.created_at = now
+            row.expires_at = expires_at
+            try:
+                await db_session.commit()
+            except IntegrityError:
+                # Тот же ключ параллельно записал другой запрос — его ответ не хуже
+                await db_session.rollback()
+        self._remember(key, expires_at, response)
+
+    async def purge(self):
+        """Удаляет просроченные записи и самые старые сверх max_entries (периодическая задача)."""
+        now = self._now()
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                delete(ResponseCacheEntry).where(ResponseCacheEntry.expires_at <= now)
+            )
+            total = (await db_session.execute(
+                select(func.count(ResponseCacheEntry.id))
+            )).scalar_one()
+            overflow = total - self.max_entries
+            if overflow > 0:
+                oldest = (
+                    select(ResponseCacheEntry.id)
+                    .order_by(ResponseCacheEntry.created_at.asc())
+                    .limit(overflow)
+                    .scalar_subquery()
+                )
+                await db_session.execute(
+                    delete(ResponseCacheEntry).where(ResponseCacheEntry.id.in_(oldest))
+                )
+            await db_session.commit()
+        for key in [k for k, (exp, _) in self._memory.items() if exp <= now]:
+            del self._memory[key]
+        if debug_mode:
+            print(f"[CACHE] Очистка кэша ответов: {self.stats()}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "db_hits": self.db_hits,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def _remember(self, key: str, expires_at, response: str):
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _now() -> datetime.datetime:
+        # В БД время хранится как naive UTC
+        return to_naive_utc(datetime.datetime.now(datetime.timezone.utc))
+
+
+response_cache = ResponseCache(
+    ttl_hours=RESPONSE_CACHE_TTL_HOURS,
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    memory_entries=RESPONSE_CACHE_MEMORY_ENTRIES
+)
@@ -0,0 +1 @@
+# cluster/__init__.py
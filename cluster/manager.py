@@ -0,0 +1,163 @@
+import asyncio
+import multiprocessing
+import queue
+
+from config import debug_mode
+from metrics.manager import registry
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping, Veach): номер воркера для ключа.
+    При изменении числа воркеров на другой воркер переезжает только ~1/N ключей.
+    """
+    key &= _MASK64
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & _MASK64
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def update_user_id(data: dict) -> int:
+    """Telegram ID пользователя, от которого пришёл апдейт (0, если его нет)."""
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user") or value.get("chat")
+        if sender and "id" in sender:
+            return sender["id"]
+    return 0
+
+
+class Supervisor:
+    """
+    Режим нескольких процессов: супервизор принимает апдейты (webhook или
+    поллинг) и раздаёт их процессам-воркерам по jump hash от ID пользователя.
+    Все апдейты одного пользователя обрабатывает один и тот же процесс, поэтому
+    его FSM (регистрация в MemoryStorage), очередь ходов и кэш истории остаются
+    в одном процессе, а разбор апдейтов и сборка промптов идут на N ядрах.
+    Упавший воркер перезапускается с новой очередью: старая могла остаться
+    с захваченной им блокировкой чтения.
+    """
+
+    def __init__(self, processes: int, queue_size: int, target):
+        self.processes = processes
+        self.queue_size = queue_size
+        # target(index, queue) — точка входа процесса-воркера
+        self.target = target
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = []
+        self._workers = []
+        self._watch_task = None
+        self.routed = [0] * processes
+        self.restarts = 0
+
+    def start(self):
+        for index in range(self.processes):
+            self._queues.append(self._context.Queue(maxsize=self.queue_size))
+            self._workers.append(self._spawn(index))
+        self._watch_task = asyncio.create_task(self._watch())
+        if debug_mode:
+            print(f"[CLUSTER] Запущено процессов-воркеров: {self.processes}")
+
+    def stop(self, timeout: float = 30):
+        """Воркеры дорабатывают уже полученные апдейты и завершаются."""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        for worker_queue in self._queues:
+            worker_queue.put(None)
+        for process in self._workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    async def route(self, data: dict):
+        index = jump_hash(update_user_id(data), self.processes)
+        self.routed[index] += 1
+        try:
+            self._queues[index].put_nowait(data)
+        except queue.Full:
+            # Воркер не успевает — ждём, не блокируя event loop супервизора
+            await asyncio.to_thread(self._queues[index].put, data)
+
+    async def poll(self, bot, allowed_updates: list, timeout: int = 30):
+        """Поллинг (для разработки): getUpdates в супервизоре, обработка — в воркерах."""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=timeout, allowed_updates=allowed_updates
+                )
+            except Exception as e:
+                print(f"[CLUSTER] Ошибка getUpdates: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await self.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+
+    def stats(self) -> dict:
+        return {
+            "processes": self.processes,
+            "alive": sum(1 for p in self._workers if p.is_alive()),
+            "routed": list(self.routed),
+            "restarts": self.restarts,
+        }
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=self.target,
+            args=(index, self._queues[index]),
+            name=f"fitai-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        return process
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(5)
+            for index, process in enumerate(self._workers):
+                if not process.is_alive():
+                    print(f"[CLUSTER] Воркер {index} завершился (код {process.exitcode}), перезапускаем")
+                    self.restarts += 1
+                    self._replace_queue(index)
+                    self._workers[index] = self._spawn(index)
+
+    def _replace_queue(self, index: int):
+        """Новая очередь воркера; апдейты из старой переносим, если её ещё можно прочитать."""
+        old = self._queues[index]
+        new = self._context.Queue(maxsize=self.queue_size)
+        self._queues[index] = new
+        moved = 0
+        while True:
+            try:
+                # Неблокирующее чтение: если блокировку держал умерший процесс, получим Empty
+                data = old.get_nowait()
+            except queue.Empty:
+                break
+            except Exception as e:
+                print(f"[CLUSTER] Очередь воркера {index} повреждена, остаток апдейтов потерян: {e}")
+                break
+            new.put_nowait(data)
+            moved += 1
+        old.close()
+        old.cancel_join_thread()
+        if debug_mode:
+            print(f"[CLUSTER] Воркер {index}: в новую очередь перенесено апдейтов: {moved}")
+
+
+def register_metrics(supervisor: Supervisor):
+    registry.gauge(
+        "fitai_cluster_workers_alive", "Живых процессов-воркеров",
+        lambda: supervisor.stats()["alive"]
+    )
+    registry.counter_from(
+        "fitai_cluster_worker_restarts_total", "Перезапусков процессов-воркеров",
+        lambda: supervisor.restarts
+    )
@@ -1,21 +1,153 @@
-# Telegram Bot token
-TELEGRAM_BOT_TOKEN = "YOUR_TELEGRAM_TOKEN" # Токен бота Telegram (получать у @BotFather)
-
-# Режим отладки (логирование)
-debug_mode = True
-
-# Параметры PostgreSQL
-POSTGRES_DB = "bot_db"
-POSTGRES_USER = "bot_user"
-POSTGRES_PASSWORD = "bot_pass"
-POSTGRES_HOST = "localhost"
-POSTGRES_PORT = 5432
-
-#  URI подключения к SQLAlchemy
-SQLALCHEMY_DATABASE_URI = (
-    f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}"
-    f"@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
-)
-
-# GigaChat API key
-GigaChatKey = "YOUR_GIGACHAT_API_KEY" # API-ключ GigaChat (получать на сайте https://developers.sber.ru/studio/workspaces/my-space/get/gigachat-api)
+# Telegram Bot token
+TELEGRAM_BOT_TOKEN = "YOUR_TELEGRAM_TOKEN" # Токен бота Telegram (получать у @BotFather)
+
+# Режим отладки (логирование)
+debug_mode = True
+
+# Параметры PostgreSQL
+POSTGRES_DB = "bot_db"
+POSTGRES_USER = "bot_user"
+POSTGRES_PASSWORD = "bot_pass"
+POSTGRES_HOST = "localhost"
+POSTGRES_PORT = 5432
+
+#  URI для асинхронного движка SQLAlchemy (драйвер asyncpg)
+SQLALCHEMY_ASYNC_DATABASE_URI = (
+    f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}"
+    f"@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+)
+
+# GigaChat API key
+GigaChatKey = "YOUR_GIGACHAT_API_KEY" # API-ключ GigaChat (получать на сайте https://developers.sber.ru/studio/workspaces/my-space/get/gigachat-api)
+
+# Кэш истории диалогов (LRU): максимум пользователей и объём в памяти
+HISTORY_CACHE_MAX_USERS = 1000
+HISTORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Кэш профилей пользователей (строк users) в памяти процесса: по tg_id и по id
+PROFILE_CACHE_MAX_USERS = 10000
+PROFILE_CACHE_TTL_SECONDS = 600
+
+# Бюджет промпта GigaChat (в токенах): system prompt + история + сообщение пользователя.
+# Всё, что не влезает в окно, сворачивается в краткое содержание (summary) в фоне.
+PROMPT_TOKEN_BUDGET = 4000
+SUMMARY_MAX_TOKENS = 500
+# Сколько токенов новых сообщений сворачивается в summary за один запрос: длинная
+# история сворачивается по частям от старых сообщений к новым
+SUMMARY_CHUNK_TOKENS = 3000
+# Пауза перед повтором после неудачного обновления summary (удваивается до MAX)
+SUMMARY_RETRY_SECONDS = 60
+SUMMARY_RETRY_MAX_SECONDS = 3600
+
+# Пул клиентов GigaChat: сколько клиентов (HTTP-соединений) держим одновременно
+GIGACHAT_POOL_SIZE = 32
+# За сколько секунд до истечения access token обновляем его в фоне
+GIGACHAT_TOKEN_REFRESH_MARGIN = 120
+# Сколько секунд держим простаивающее соединение с GigaChat (у httpx по умолчанию всего 5 с)
+GIGACHAT_KEEPALIVE_SECONDS = 60
+# Необязательные адреса API и авторизации (None — адреса по умолчанию из SDK)
+GIGACHAT_BASE_URL = None
+GIGACHAT_AUTH_URL = None
+
+# Максимум одновременных вызовов GigaChat (не зависит от пула потоков/соединений БД).
+# Фактический предел — меньшее из LLM_MAX_IN_FLIGHT и GIGACHAT_POOL_SIZE.
+LLM_MAX_IN_FLIGHT = 32
+# True — нативный асинхронный вызов (ainvoke), False — отдельный пул потоков для invoke
+LLM_USE_ASYNC = True
+# Классы приоритета запросов к GigaChat (порядок — от высшего к низшему) и предел
+# одновременных запросов каждого класса: планы и фоновые задачи не занимают все слоты,
+# так что короткие ответы в /chat не ждут за генерацией недельных планов
+LLM_PRIORITY_LIMITS = {"chat": 32, "plan": 12, "background": 4}
+# Сколько запросов каждого класса может ждать в очереди; сверх этого — сразу «занято, попробуйте позже»
+LLM_QUEUE_CAPACITY = {"chat": 200, "plan": 50, "background": 100}
+
+# Потоковые ответы: первое сообщение отправляется сразу и затем редактируется
+STREAM_REPLIES = True
+# Минимальный интервал между правками сообщения (Telegram ограничивает частоту edit)
+STREAM_EDIT_INTERVAL = 1.5
+# Сколько символов накопить перед отправкой первого сообщения
+STREAM_MIN_CHARS = 40
+
+# Кэш ответов на /meal_plan и /workout_plan по «округлённому» профилю
+RESPONSE_CACHE_TTL_HOURS = 24 * 7
+RESPONSE_CACHE_MAX_ENTRIES = 5000  # в БД
+RESPONSE_CACHE_MEMORY_ENTRIES = 500  # горячая часть в памяти процесса
+
+# Напоминание о неактивности: через сколько дней, как часто проверять и
+# как часто сбрасывать в БД накопленные отметки активности
+INACTIVITY_DAYS = 7
+INACTIVITY_SWEEP_MINUTES = 10
+ACTIVITY_FLUSH_SECONDS = 30
+
+# Восстановление уведомлений при старте читается порциями (server-side cursor)
+NOTIFICATION_RESTORE_CHUNK = 5000
+# Сколько дней храним уже отправленные уведомления
+NOTIFICATION_RETENTION_DAYS = 30
+
+# Режим планирования уведомлений:
+#   "window"      — источник истины таблица notifications, в памяти только ближайшее окно;
+#   "apscheduler" — каждое будущее уведомление отдельной задачей APScheduler (старый режим).
+NOTIFICATION_SCHEDULER_MODE = "window"
+NOTIFICATION_WINDOW_SECONDS = 300
+NOTIFICATION_REFILL_SECONDS = 60
+# Насколько опоздавшее уведомление ещё отправляем (например, после перезапуска)
+NOTIFICATION_MISFIRE_GRACE_SECONDS = 60
+
+# Outbox доставки сообщений: лимиты Telegram (~30 сообщений/с всего и ~1/с в один чат)
+OUTBOX_WORKERS = 8
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_SECONDS = 1
+# Аренда забранного сообщения: если процесс упал, не отправив его, через столько секунд
+# сообщение заберёт другой процесс
+OUTBOX_LEASE_SECONDS = 300
+
+# Function calling: "native" — функции передаются модели структурно (functions API GigaChat),
+# "json" — схемы и пример JSON в system prompt с разбором ответа (старый режим)
+FUNCTION_CALLING_MODE = "native"
+# Подтверждение create_notification: "template" — локальный шаблон без второго вызова модели,
+# "llm" — модель сама формулирует подтверждение (ещё один запрос)
+FUNCTION_CONFIRMATION_MODE = "template"
+
+# Сообщения одного пользователя обрабатываются по очереди; первое сообщение начинает ход сразу,
+# пришедшие во время хода склеиваются в следующий (после паузы DIALOG_DEBOUNCE_SECONDS,
+# но не дольше MAX от первого из них; команды плана не ждут)
+DIALOG_DEBOUNCE_SECONDS = 1.0
+DIALOG_DEBOUNCE_MAX_SECONDS = 3.0
+
+# Метрики в формате Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+
+# Режим получения апдейтов: "polling" — для разработки, "webhook" — для продакшена
+BOT_MODE = "polling"
+# Webhook: Telegram шлёт апдейты на WEBHOOK_URL + WEBHOOK_PATH (HTTPS, обычно через reverse proxy),
+# локально сервер слушает WEBHOOK_HOST:WEBHOOK_PORT
+WEBHOOK_URL = "https://example.com"
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = ""  # секрет в заголовке X-Telegram-Bot-Api-Secret-Token (пусто — не проверяем)
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+# Сколько апдейтов обрабатывается одновременно (апдейты одного пользователя — по очереди,
+# одним воркером) и сколько всего может ждать в очередях
+WEBHOOK_WORKERS = 64
+WEBHOOK_QUEUE_SIZE = 10000
+# Сколько последних update_id помним для отбрасывания повторных доставок
+WEBHOOK_DEDUP_SIZE = 100000
+
+# Число процессов-воркеров: 1 — всё в одном процессе; N > 1 — супервизор принимает апдейты
+# и раздаёт их N процессам по ID пользователя. Пул БД у каждого процесса свой, лимиты GigaChat
+# (GIGACHAT_POOL_SIZE, LLM_*) делятся между процессами поровну, outbox и общие периодические
+# задачи работают только в воркере 0
+WORKER_PROCESSES = 1
+# Сколько апдейтов может ждать в очереди одного процесса-воркера
+WORKER_QUEUE_SIZE = 10000
+
+# Хранилище FSM (шаги регистрации): "db" — таблица fsm_states (переживает перезапуск,
+# общая для всех процессов), "memory" — MemoryStorage aiogram (для разработки)
+FSM_STORAGE = "db"
+# Через сколько часов без активности незаконченное состояние считается брошенным и удаляется
+FSM_STATE_TTL_HOURS = 24
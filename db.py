@@ -1,73 +1,195 @@
-import datetime
-
-from sqlalchemy import (
-    create_engine, Column, Integer, Float, String,
-    DateTime, ForeignKey, Text
-)
-from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-from config import SQLALCHEMY_DATABASE_URI
-
-Base = declarative_base()
-
-class User(Base):
-    __tablename__ = "users"
-
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    tg_id = Column(Integer, unique=True, nullable=False)  # Telegram user ID
-    name = Column(String, nullable=False)
-    age = Column(Integer, nullable=False)
-    sex = Column(String, nullable=False)
-    weight = Column(Float, nullable=True)
-    height = Column(Float, nullable=True)
-    goal = Column(String, nullable=True)
-    skill = Column(String, nullable=True)
-    timezone = Column(String, nullable=True)  # Часовой пояс пользователя
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
-
-    messages = relationship("MessageLog", back_populates="user")
-    notifications = relationship("Notification", back_populates="user")
-
-
-class MessageLog(Base):
-    __tablename__ = "messages"
-
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-
-    # "system" / "user" / "assistant"
-    role = Column(String, nullable=False)
-
-    # Собственно контент сообщения
-    content = Column(Text, nullable=False)
-
-    # function_call, если модель решила вызвать функцию
-    function_name = Column(String, nullable=True)
-    function_args = Column(Text, nullable=True)
-
-    # Дата/время отправки сообщения (в UTC)
-    timestamp_utc = Column(DateTime, default=datetime.datetime.utcnow)
-
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
-
-    user = relationship("User", back_populates="messages")
-
-
-class Notification(Base):
-    __tablename__ = "notifications"
-
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    time_utc = Column(DateTime, nullable=False)  # Время напоминания (UTC)
-    message = Column(String, nullable=False)
-    kind = Column(String, default="regular")  # "regular" или "inactivity"
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
-
-    user = relationship("User", back_populates="notifications")
-
-
-engine = create_engine(SQLALCHEMY_DATABASE_URI, echo=False)
-SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
-
-def init_db():
-    Base.metadata.create_all(bind=engine)
+import datetime
+import time
+
+from sqlalchemy import (
+    Column, Integer, Float, String,
+    DateTime, ForeignKey, Text, Index, text, event
+)
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base, relationship
+from config import SQLALCHEMY_ASYNC_DATABASE_URI
+from migrations.manager import apply_migrations
+from metrics.manager import registry
+
+Base = declarative_base()
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tg_id = Column(Integer, unique=True, nullable=False)  # Telegram user ID
+    name = Column(String, nullable=False)
+    age = Column(Integer, nullable=False)
+    sex = Column(String, nullable=False)
+    weight = Column(Float, nullable=True)
+    height = Column(Float, nullable=True)
+    goal = Column(String, nullable=True)
+    skill = Column(String, nullable=True)
+    timezone = Column(String, nullable=True)  # Часовой пояс пользователя
+    # Последнее сообщение пользователя боту и время отправки напоминания о неактивности
+    last_active_at = Column(DateTime, nullable=True)
+    inactivity_notified_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_users_inactive", "last_active_at",
+              postgresql_where=text("inactivity_notified_at IS NULL")),
+    )
+
+    messages = relationship("MessageLog", back_populates="user")
+    notifications = relationship("Notification", back_populates="user")
+    summary = relationship("ConversationSummary", back_populates="user", uselist=False)
+
+
+class MessageLog(Base):
+    __tablename__ = "messages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    # "system" / "user" / "assistant"
+    role = Column(String, nullable=False)
+
+    # Собственно контент сообщения
+    content = Column(Text, nullable=False)
+
+    # function_call, если модель решила вызвать функцию
+    function_name = Column(String, nullable=True)
+    function_args = Column(Text, nullable=True)
+
+    # Дата/время отправки сообщения (в UTC)
+    timestamp_utc = Column(DateTime, default=datetime.datetime.utcnow)
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_messages_user_id_id", "user_id", "id"),
+    )
+
+    user = relationship("User", back_populates="messages")
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
+
+    # Краткое содержание старой части диалога (вытесненной из окна промпта)
+    content = Column(Text, nullable=False)
+
+    # id последнего сообщения из messages, вошедшего в summary
+    last_message_id = Column(Integer, nullable=False, default=0)
+
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    user = relationship("User", back_populates="summary")
+
+
+class Notification(Base):
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    time_utc = Column(DateTime, nullable=False)  # Время напоминания (UTC)
+    message = Column(String, nullable=False)
+    kind = Column(String, default="regular")  # "regular" / "recurring" ("inactivity" — устаревший тип, см. sweep_inactive_users)
+    # Правило повторения (kind="recurring"), например "FREQ=WEEKLY;BYDAY=MO,WE,FR;BYHOUR=7;BYMINUTE=0";
+    # time_utc — ближайшее срабатывание, следующее вычисляется после отправки
+    recurrence = Column(String, nullable=True)
+    sent_at = Column(DateTime, nullable=True)  # Когда уведомление было отправлено (режим "window")
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_notifications_user_id_kind", "user_id", "kind"),
+        Index("ix_notifications_due", "time_utc", postgresql_where=text("sent_at IS NULL")),
+    )
+
+    user = relationship("User", back_populates="notifications")
+
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(Integer, nullable=False)  # Telegram chat ID получателя
+    text = Column(Text, nullable=False)
+    parse_mode = Column(String, nullable=True)
+
+    # "pending" / "sending" / "delivered" / "failed"
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Колонка text скрывает здесь sqlalchemy.text, поэтому условие — выражением над колонкой
+        Index("ix_outbox_pending", "next_attempt_at", "id", postgresql_where=status == "pending"),
+        Index("ix_outbox_sending", "next_attempt_at", postgresql_where=status == "sending"),
+    )
+
+
+class FSMStateEntry(Base):
+    __tablename__ = "fsm_states"
+
+    # Ключ aiogram StorageKey: bot_id:chat_id:user_id:thread_id:business_connection_id:destiny
+    key = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=False, default="{}")  # JSON
+
+    # По нему истекают брошенные состояния (например, незаконченная регистрация)
+    updated_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+
+
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    # Нормализованный ключ: команда + «округлённый» профиль пользователя
+    key = Column(String, unique=True, nullable=False)
+    command = Column(String, nullable=False)
+    response = Column(Text, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# Асинхронный режим: используется во всех корутинах (хендлеры, FitAI, уведомления),
+# чтобы запросы к БД не блокировали event loop.
+async_engine = create_async_engine(SQLALCHEMY_ASYNC_DATABASE_URI, echo=False)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+db_query_seconds = registry.histogram("fitai_db_query_seconds", "Время выполнения SQL-запроса")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    db_query_seconds.observe(time.perf_counter() - context.query_started)
+
+
+event.listen(async_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+event.listen(async_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def to_naive_utc(dt: datetime.datetime) -> datetime.datetime:
+    """
+    Колонки DateTime у нас без часового пояса, а asyncpg не принимает aware-datetime
+    для таких колонок. Приводим время к UTC и отбрасываем tzinfo.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+async def init_db_async():
+    async with async_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.run_sync(apply_migrations, Base.metadata)
\ No newline at end of file
@@ -0,0 +1 @@
+# delivery/__init__.py
@@ -0,0 +1,363 @@
+import asyncio
+import datetime
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy import select, update, delete
+
+from config import (
+    debug_mode, OUTBOX_WORKERS, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE,
+    OUTBOX_MAX_ATTEMPTS, OUTBOX_BATCH_SIZE, OUTBOX_POLL_SECONDS, OUTBOX_LEASE_SECONDS
+)
+from db import AsyncSessionLocal, OutboxMessage, to_naive_utc
+from init_bot import bot
+from metrics.manager import registry
+
+# Сколько «персональных» token bucket держим в памяти одновременно
+_MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Token bucket: не больше rate отправок в секунду, всплеск до capacity."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        # С какого момента копятся токены; после retry_after — конец паузы
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        # Когда токен последний раз действительно использован (см. DeliveryOutbox._chat_wait)
+        self.last_used = 0.0
+
+    def reserve(self) -> float:
+        """
+        Без ожидания занимает ближайший токен и возвращает, через сколько секунд
+        им можно воспользоваться. Отрицательный запас токенов — очередь уже
+        обещанных отправок, поэтому следующие резервы получают слоты дальше.
+        """
+        now = time.monotonic()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        self.tokens -= 1
+        wait = self.updated - now
+        if self.tokens < 0:
+            wait -= self.tokens / self.rate
+        return wait
+
+    async def acquire(self):
+        wait = self.reserve()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            # Пока ждали, Telegram мог прислать retry_after
+            wait = self.blocked_until - time.monotonic()
+
+    def block(self, seconds: float):
+        """
+        Telegram прислал retry_after — ничего не отправляем это время,
+        а токены начинают копиться только после паузы.
+        """
+        now = time.monotonic()
+        until = now + seconds
+        if until <= self.blocked_until:
+            return
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.tokens = min(self.tokens, 0)
+        self.updated = max(self.updated, until)
+        self.blocked_until = until
+
+
+def _utcnow() -> datetime.datetime:
+    return to_naive_utc(datetime.datetime.now(datetime.timezone.utc))
+
+
+class DeliveryOutbox:
+    """
+    Персистентный outbox исходящих сообщений.
+    Планировщик только кладёт сообщение в таблицу outbox, а пул воркеров
+    отправляет его через общий и «по чату» token bucket, учитывая retry_after
+    и повторяя неудачные попытки с экспоненциальной задержкой.
+    Несколько процессов бота делят одну таблицу: строки забираются через
+    SELECT ... FOR UPDATE SKIP LOCKED и арендуются на lease секунд — если процесс
+    упал, не отправив сообщение, после окончания аренды его заберёт другой.
+    Воркер не ждёт лимита чата, держа строку: если ближайший слот чата ещё
+    не наступил, строка возвращается в БД до этого слота (слот за ней
+    закрепляется), а воркер берёт сообщение для другого чата.
+    """
+
+    def __init__(self, workers: int, global_rate: float, chat_rate: float,
+                 max_attempts: int, batch_size: int, poll_interval: float, lease: int):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = datetime.timedelta(seconds=lease)
+        self._next_release_at = 0.0
+        self.chat_rate = chat_rate
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = OrderedDict()
+        # id строки -> момент (monotonic) закреплённого за ней слота чата
+        self._reserved = {}
+        # Ограниченная очередь: пока воркеры не успевают, новые строки из БД не забираем
+        self._queue = asyncio.Queue(maxsize=batch_size)
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.deferred = 0
+
+    async def start(self):
+        await self._release_expired()
+        self._tasks.append(asyncio.create_task(self._fetch_loop()))
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def enqueue(self, chat_id: int, text: str, parse_mode: str = None):
+        await self.enqueue_many([(chat_id, text)], parse_mode=parse_mode)
+
+    async def enqueue_many(self, messages: list, parse_mode: str = None):
+        """messages — список пар (chat_id, text); всё пишется одним коммитом."""
+        if not messages:
+            return
+        async with AsyncSessionLocal() as db_session:
+            self.stage(db_session, messages, parse_mode=parse_mode)
+            await db_session.commit()
+        self.wakeup()
+
+    def stage(self, db_session, messages: list, parse_mode: str = None):
+        """
+        Добавляет сообщения в чужую транзакцию: они попадут в outbox только
+        вместе с её коммитом (например, вместе с отметкой «уведомление отправлено»).
+        После коммита вызывающий код должен вызвать wakeup().
+        """
+        now = _utcnow()
+        db_session.add_all([
+            OutboxMessage(chat_id=chat_id, text=text, parse_mode=parse_mode, next_attempt_at=now)
+            for chat_id, text in messages
+        ])
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    async def purge_delivered(self, days: int = 7):
+        """Удаляем давно доставленные/окончательно неудачные сообщения."""
+        threshold = _utcnow() - datetime.timedelta(days=days)
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                delete(OutboxMessage).where(
+                    OutboxMessage.status.in_(("delivered", "failed")),
+                    OutboxMessage.created_at < threshold
+                )
+            )
+            await db_session.commit()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "retried": self.retried,
+            "deferred": self.deferred,
+        }
+
+    async def _claim(self, limit: int) -> list:
+        now = _utcnow()
+        async with AsyncSessionLocal() as db_session:
+            # Строки, которые сейчас забирает другой процесс, пропускаем
+            rows = (await db_session.execute(
+                select(OutboxMessage)
+                .where(
+                    OutboxMessage.status == "pending",
+                    OutboxMessage.next_attempt_at <= now
+                )
+                .order_by(OutboxMessage.next_attempt_at.asc(), OutboxMessage.id.asc())
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )).scalars().all()
+            if rows:
+                # next_attempt_at у "sending" — окончание аренды
+                await db_session.execute(
+                    update(OutboxMessage)
+                    .where(OutboxMessage.id.in_([r.id for r in rows]))
+                    .values(status="sending", next_attempt_at=now + self.lease)
+                )
+            await db_session.commit()
+        return rows
+
+    async def _release_expired(self):
+        """Строки, аренда которых истекла (процесс упал, не отправив), возвращаем в очередь."""
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                update(OutboxMessage)
+                .where(
+                    OutboxMessage.status == "sending",
+                    OutboxMessage.next_attempt_at <= _utcnow()
+                )
+                .values(status="pending")
+            )
+            await db_session.commit()
+        self._next_release_at = time.monotonic() + self.lease.total_seconds() / 2
+        # Слоты строк, которые после аренды забрал другой процесс, больше не нужны
+        stale = time.monotonic() - self.lease.total_seconds()
+        for row_id in [i for i, slot in self._reserved.items() if slot < stale]:
+            del self._reserved[row_id]
+
+    async def _fetch_loop(self):
+        while True:
+            rows = []
+            free = self._queue.maxsize - self._queue.qsize()
+            if free > 0:
+                try:
+                    if time.monotonic() >= self._next_release_at:
+                        await self._release_expired()
+                    rows = await self._claim(free)
+                except Exception as e:
+                    print(f"[OUTBOX] Ошибка при выборке сообщений: {e}")
+            for row in rows:
+                await self._queue.put(row)
+
+            if len(rows) < free:
+                # Очередь в БД пуста — ждём новых сообщений или следующего опроса
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            elif free <= 0:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _worker(self):
+        while True:
+            row = await self._queue.get()
+            try:
+                await self._send(row)
+            except Exception as e:
+                print(f"[OUTBOX] Ошибка воркера доставки: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, row: OutboxMessage):
+        chat_bucket = self._chat_bucket(row.chat_id)
+        wait = self._chat_wait(row, chat_bucket)
+        if wait <= 0:
+            await self._global_bucket.acquire()
+            # Пока ждали общий лимит, в этот чат мог отправить другой воркер
+            wait = chat_bucket.last_used + 1 / chat_bucket.rate - time.monotonic()
+            if wait > 0:
+                self._reserved[row.id] = time.monotonic() + wait
+        if wait > 0:
+            await self._defer(row, wait)
+            return
+        chat_bucket.last_used = time.monotonic()
+        try:
+            try:
+                await bot.send_message(chat_id=row.chat_id, text=row.text, parse_mode=row.parse_mode)
+            except TelegramBadRequest:
+                if not row.parse_mode:
+                    raise
+                # Разметка не распарсилась — отправляем как обычный текст
+                await bot.send_message(chat_id=row.chat_id, text=row.text)
+        except TelegramRetryAfter as e:
+            # Флуд-контроль Telegram общий для бота: пауза и для этого чата, и для всех
+            chat_bucket.block(e.retry_after)
+            self._global_bucket.block(e.retry_after)
+            self.retried += 1
+            await self._finish(row, "pending", str(e), delay=e.retry_after, count_attempt=False)
+            return
+        except TelegramForbiddenError as e:
+            # Пользователь заблокировал бота — повторять бессмысленно
+            await self._finish(row, "failed", str(e))
+            return
+        except Exception as e:
+            if row.attempts + 1 >= self.max_attempts:
+                await self._finish(row, "failed", str(e))
+            else:
+                self.retried += 1
+                await self._finish(row, "pending", str(e), delay=2 ** (row.attempts + 1))
+            return
+
+        await self._finish(row, "delivered")
+
+    def _chat_wait(self, row: OutboxMessage, chat_bucket: TokenBucket) -> float:
+        """
+        Сколько секунд строке ждать своего слота в чате (0 и меньше — можно отправлять).
+        Слот резервируется один раз и закрепляется за строкой, пока она ждёт в БД.
+        """
+        slot = self._reserved.pop(row.id, None)
+        if slot is None or slot < chat_bucket.blocked_until:
+            slot = time.monotonic() + chat_bucket.reserve()
+        # Строка могла вернуться из БД позже своего слота — интервал держим от фактической отправки
+        slot = max(slot, chat_bucket.last_used + 1 / chat_bucket.rate)
+        wait = slot - time.monotonic()
+        if wait > 0:
+            self._reserved[row.id] = slot
+        return wait
+
+    async def _defer(self, row: OutboxMessage, delay: float):
+        """Лимит чата исчерпан: строка ждёт своего слота в БД, а не в воркере."""
+        self.deferred += 1
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                update(OutboxMessage)
+                .where(OutboxMessage.id == row.id)
+                .values(status="pending", next_attempt_at=_utcnow() + datetime.timedelta(seconds=delay))
+            )
+            await db_session.commit()
+        asyncio.get_running_loop().call_later(delay, self.wakeup)
+
+    async def _finish(self, row: OutboxMessage, status: str, error: str = None,
+                      delay: float = 0, count_attempt: bool = True):
+        now = _utcnow()
+        values = {
+            "status": status,
+            "attempts": row.attempts + (1 if count_attempt else 0),
+            "last_error": error,
+            "next_attempt_at": now + datetime.timedelta(seconds=delay),
+        }
+        if status == "delivered":
+            values["delivered_at"] = now
+            self.delivered += 1
+        elif status == "failed":
+            self.failed += 1
+            print(f"[OUTBOX] Не удалось доставить сообщение chat_id={row.chat_id}: {error}")
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                update(OutboxMessage).where(OutboxMessage.id == row.id).values(**values)
+            )
+            await db_session.commit()
+        if debug_mode and status != "delivered":
+            print(f"[OUTBOX] Сообщение id={row.id} -> {status}")
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, 1)
+            self._chat_buckets[chat_id] = bucket
+            while len(self._chat_buckets) > _MAX_CHAT_BUCKETS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+
+outbox = DeliveryOutbox(
+    workers=OUTBOX_WORKERS,
+    global_rate=TELEGRAM_GLOBAL_RATE,
+    chat_rate=TELEGRAM_CHAT_RATE,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    batch_size=OUTBOX_BATCH_SIZE,
+    poll_interval=OUTBOX_POLL_SECONDS,
+    lease=OUTBOX_LEASE_SECONDS
+)
+
+registry.gauge("fitai_outbox_queue_depth", "Сообщений в очереди воркеров доставки", lambda: outbox._queue.qsize())
+registry.counter_from("fitai_outbox_delivered_total", "Доставленных сообщений", lambda: outbox.delivered)
+registry.counter_from("fitai_outbox_failed_total", "Сообщений, которые не удалось доставить", lambda: outbox.failed)
+registry.counter_from("fitai_outbox_retried_total", "Повторных попыток доставки", lambda: outbox.retried)
+registry.counter_from(
+    "fitai_outbox_deferred_total", "Сообщений, отложенных до слота лимита чата", lambda: outbox.deferred
+)
@@ -0,0 +1 @@
+# dialog/__init__.py
@@ -0,0 +1,128 @@
+import asyncio
+import time
+
+from config import debug_mode, DIALOG_DEBOUNCE_SECONDS, DIALOG_DEBOUNCE_MAX_SECONDS
+from metrics.manager import registry
+
+
+class _UserQueue:
+    """Очередь сообщений одного пользователя и задача, которая её разбирает."""
+
+    def __init__(self):
+        # Элементы: (message, text, plan_command)
+        self.pending = []
+        self.first_at = 0.0
+        self.last_at = 0.0
+        self.task = None
+
+
+class DialogDispatcher:
+    """
+    Актор на пользователя: у каждого пользователя не больше одного хода
+    (вызова GigaChat) одновременно. Первое сообщение свободного пользователя
+    и команды плана обрабатываются сразу; сообщения, пришедшие во время хода,
+    склеиваются в следующий ход.
+    """
+
+    def __init__(self, debounce: float, debounce_max: float):
+        self.debounce = debounce
+        self.debounce_max = debounce_max
+        self._queues = {}
+        self.messages = 0
+        self.turns = 0
+        self.errors = 0
+
+    def submit(self, user_id: int, message, text: str, handler, plan_command: str = None):
+        """
+        Ставит сообщение в очередь пользователя. handler(message, text, plan_command)
+        вызывается последовательно; message — последнее сообщение склеенного хода.
+        """
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = _UserQueue()
+            self._queues[user_id] = queue
+        now = time.monotonic()
+        if not queue.pending:
+            queue.first_at = now
+        queue.last_at = now
+        queue.pending.append((message, text, plan_command))
+        self.messages += 1
+        if queue.task is None:
+            queue.task = asyncio.create_task(self._run(user_id, queue, handler))
+
+    def stats(self) -> dict:
+        return {
+            "active_users": len(self._queues),
+            "pending": sum(len(q.pending) for q in self._queues.values()),
+            "messages": self.messages,
+            "turns": self.turns,
+            "errors": self.errors,
+        }
+
+    async def _run(self, user_id: int, queue: _UserQueue, handler):
+        try:
+            # Очередь была пуста — ход начинается без ожидания
+            idle = True
+            while queue.pending:
+                if not idle and queue.pending[0][2] is None:
+                    await self._debounce(queue)
+                idle = False
+                message, text, plan_command = self._take_turn(queue)
+                self.turns += 1
+                try:
+                    await handler(message, text, plan_command)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[DIALOG] Ошибка при обработке хода user_id={user_id}: {e}")
+        finally:
+            # Новые сообщения после этой точки создадут новую задачу
+            self._queues.pop(user_id, None)
+
+    async def _debounce(self, queue: _UserQueue):
+        """
+        Сообщения пришли во время хода: ждём паузу debounce после последнего,
+        но не дольше debounce_max от первого — время хода входит в ожидание.
+        """
+        while True:
+            now = time.monotonic()
+            deadline = min(queue.last_at + self.debounce, queue.first_at + self.debounce_max)
+            if now >= deadline:
+                return
+            await asyncio.sleep(deadline - now)
+
+    def _take_turn(self, queue: _UserQueue):
+        """
+        Забирает из очереди один ход: подряд идущие обычные сообщения склеиваются,
+        команда плана (/meal_plan, /workout_plan) всегда идёт отдельным ходом.
+        """
+        message, text, plan_command = queue.pending[0]
+        taken = 1
+        if plan_command is None:
+            texts = [text]
+            for next_message, next_text, next_command in queue.pending[1:]:
+                if next_command is not None:
+                    break
+                message = next_message
+                texts.append(next_text)
+                taken += 1
+            text = "\n".join(texts)
+        del queue.pending[:taken]
+        if debug_mode and taken > 1:
+            print(f"[DIALOG] Склеено {taken} сообщений в один ход.")
+        return message, text, plan_command
+
+
+dialog_dispatcher = DialogDispatcher(
+    debounce=DIALOG_DEBOUNCE_SECONDS,
+    debounce_max=DIALOG_DEBOUNCE_MAX_SECONDS
+)
+
+registry.gauge(
+    "fitai_active_users", "Пользователей с ходом в работе или в очереди",
+    lambda: len(dialog_dispatcher._queues)
+)
+registry.gauge(
+    "fitai_dialog_pending_messages", "Сообщений, ожидающих своего хода",
+    lambda: dialog_dispatcher.stats()["pending"]
+)
+registry.counter_from("fitai_dialog_turns_total", "Ходов диалога", lambda: dialog_dispatcher.turns)
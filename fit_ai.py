@@ -1,354 +1,491 @@
-import asyncio
-import datetime
-import json
-import re
-
-from langchain.schema import SystemMessage, HumanMessage, AIMessage
-from langchain_community.chat_models import GigaChat
-
-from db import SessionLocal, User, MessageLog
-from config import GigaChatKey
-
-# Импортируем функции из function_calling
-from function_calling.manager import (
-    create_notification_fn
-)
-
-# Импортируем «неактивность» из notifications
-from notifications.manager import schedule_inactivity_job
-
-
-class FitAI:
-    """
-    Класс для общения с GigaChat и управления function calling.
-    """
-
-    def __init__(self, user_tg_id: int):
-        self.user_tg_id = user_tg_id
-        self.db_session = SessionLocal()
-        self.user = self.db_session.query(User).filter_by(tg_id=user_tg_id).first()
-
-        self.functions_schemas = [
-            {
-                "name": "create_notification",
-                "description": "Создает новое уведомление для пользователя",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "user_id": {
-                            "type": "string",
-                            "description": "ID пользователя (числовой ID)"
-                        },
-                        "message": {
-                            "type": "string",
-                            "description": "Текст уведомления"
-                        },
-                        "time": {
-                            "type": "string",
-                            "format": "date-time",
-                            "description": "Локальное время (ISO8601), например: 2025-01-18T14:00:00+03:00"
-                        }
-                    },
-                    "required": ["user_id", "message", "time"]
-                }
-            }]
-#            {
-#                "name": "list_notifications",
-#                "description": "Возвращает список всех уведомлений для пользователя",
-#                "parameters": {
-#                    "type": "object",
-#                    "properties": {
-#                        "user_id": {
-#                            "type": "string",
-#                            "description": "ID пользователя"
-#                        }
-#                    },
-#                    "required": ["user_id"]
-#                }
-#            },
-#            {
-#                "name": "update_notification",
-#                "description": "Изменяет текст или время уведомления по его ID",
-#                "parameters": {
-#                    "type": "object",
-#                    "properties": {
-#                        "user_id": {
-#                            "type": "string",
-#                            "description": "ID пользователя"
-#                        },
-#                        "notification_id": {
-#                            "type": "integer",
-#                            "description": "ID уведомления"
-#                        },
-#                        "message": {
-#                            "type": "string",
-#                            "description": "Новый текст уведомления (необязательно)",
-#                            "nullable": True
-#                        },
-#                        "time": {
-#                            "type": "string",
-#                            "format": "date-time",
-#                            "description": "Новое время (ISO8601) (необязательно)",
-#                            "nullable": True
-#                        }
-#                    },
-#                    "required": ["user_id", "notification_id"]
-#                }
-#            },
-#            {
-#                "name": "delete_notification",
-#                "description": "Удаляет уведомление по его ID",
-#                "parameters": {
-#                    "type": "object",
-#                    "properties": {
-#                        "user_id": {
-#                            "type": "string",
-#                            "description": "ID пользователя"
-#                        },
-#                        "notification_id": {
-#                            "type": "integer",
-#                            "description": "ID уведомления"
-#                        }
-#                    },
-#                    "required": ["user_id", "notification_id"]
-#                }
-#            }
-#        ]
-
-        self.llm = GigaChat(
-            model="GigaChat",
-            credentials=GigaChatKey,
-            scope="GIGACHAT_API_PERS",
-            verify_ssl_certs=False,
-            streaming=False,
-            temperature=0.5
-        )
-
-    async def chat(self, user_message: str) -> str:
-        """Основной метод диалога с моделью."""
-        if not self.user:
-            return "Пользователь не найден. Сначала пройдите регистрацию."
-
-        # При каждом новом сообщении «обнуляем» таймер неактивности
-        schedule_inactivity_job(self.user.id, days=7)
-
-        # Подготовим system prompt:
-        now_utc = datetime.datetime.now(datetime.timezone.utc).isoformat()
-        current_weekday_utc = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')[
-            datetime.datetime.now(datetime.timezone.utc).weekday()]
-        user_info = (
-            f"Имя: {self.user.name}, "
-            f"user_id: {self.user.id}, "
-            f"Возраст: {self.user.age}, "
-            f"Пол: {self.user.sex}, "
-            f"Вес: {self.user.weight}кг, Рост: {self.user.height}см, "
-            f"Цель: {self.user.goal}, Уровень: {self.user.skill}, "
-            f"Часовой пояс: {self.user.timezone}, "
-            f"Текущее время и день недели (UTC): {now_utc, current_weekday_utc} "
-        )
-        current_weekday = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')[
-            datetime.datetime.now().weekday()]
-        user_message += f'\n Сообщение отправлено в: {datetime.datetime.now().isoformat()} {current_weekday}\n'
-
-        system_text = (
-            "Вы — FitAI, профессиональный фитнес-тренер и диетолог. "
-            "Отвечайте на русском, кратко и структурировано. "
-            "Составляете планы тренировок и питания, даете советы и отвечаете на вопросы связанные с фитнесом и диетой. "
-            "Умеете вызывать функцию create_notification. "
-            "Если используете функцию, верните ТОЛЬКО JSON, без дополнительного текста. "
-            "После выполнения функции сможете продолжить ответ.\n\n"
-            f"Данные о пользователе:\n{user_info}\n"
-            f"Схемы функций:\n{self.functions_schemas}"
-            "\n\n"
-            "Примеры использования функции:\n"
-            "   {\n"
-            "       \"name\": \"create_notification\",\n"
-            "       \"parameters\": {\n"
-            "           \"user_id\": \"1\",\n"
-            "           \"message\": \"Напоминание: время тренировки подошло!\",\n"
-            "           \"time\": \"2025-01-17T09:00:00+03:00\"\n"
-            "       }\n"
-            "   }\n\n"
-            "Если нужно вызвать функцию, вы должны вернуть JSON, как в примере."
-            "Обязательно учитывайте timezone пользователя при планировании уведомлений."
-        )
-
-        # Превращаем историю диалога в LangChain-месседжи
-        conversation = await self._load_history_as_langchain_messages()
-        conversation.insert(0, SystemMessage(content=system_text))
-        conversation.append(HumanMessage(content=user_message))
-
-        # Вызываем GigaChat
-        assistant_response = await asyncio.to_thread(self.llm.invoke, conversation)
-        assistant_text = assistant_response.content
-
-        # Сохраняем входящее сообщение пользователя (role="user")
-        user_message += '\n Сообщение отправлено в ' + datetime.datetime.now().isoformat()
-        await self._save_message(role="user", content=user_message)
-
-        final_answer = ""
-        while True:
-            # Ищем JSON-функции
-            function_calls = self._extract_multiple_json_objects(assistant_text)
-
-            if not function_calls:
-                # Нет функций — обычный ответ от ассистента
-                await self._save_message(role="assistant", content=assistant_text)
-                final_answer = assistant_text
-                break
-
-            # Сохраняем ответ ассистента (как он есть, без отправки юзеру)
-            await self._save_message(role="assistant", content=assistant_text)
-
-            # Выполняем каждую функцию
-            for fc in function_calls:
-                fname = fc.get("name")
-                fargs = fc.get("parameters", {})
-
-                # Сохраняем отдельным сообщением запись о вызове функции
-                await self._save_message(
-                    role="user",
-                    content=f"Функция была вызвана успешно. Теперь ты сообщишь об этом пользователю! Сказав, что все прошло успешно! Текущее время: {datetime.datetime.now().isoformat()}",
-                    function_name=fname,
-                    function_args=json.dumps(fargs, ensure_ascii=False)
-                )
-
-                if fname == "create_notification":
-                    create_notification_fn(
-                        user_id_str=fargs.get("user_id", ""),
-                        msg_text=fargs.get("message", ""),
-                        time_str=fargs.get("time", "")
-                    )
-                """
-                Далее функции для работы с уведомлениями (CRUD) в БД,
-                которые убрали из functions_calling и промпта т.к.
-                GigaChat ими все равно не пользуется, но они захламляют его помять.
-                """
-                ### elif fname == "list_notifications":
-                ###     notifs = list_notifications_fn(fargs.get("user_id", ""))
-                ###     # Чтобы модель могла «увидеть» результат,
-                ###     # добавляем новое HumanMessage со списком
-                ###     conversation.append(HumanMessage(
-                ###         content=f"NOTIFICATION_LIST={json.dumps(notifs, ensure_ascii=False)}"
-                ###     ))
-
-                ### elif fname == "update_notification":
-                ###     update_notification_fn(
-                ###         user_id_str=fargs.get("user_id", ""),
-                ###         notification_id=fargs.get("notification_id", None),
-                ###         new_msg=fargs.get("message", None),
-                ###         new_time=fargs.get("time", None)
-                ###     )
-
-                ### elif fname == "delete_notification":
-                ###     delete_notification_fn(
-                ###         user_id_str=fargs.get("user_id", ""),
-                ###         notification_id=fargs.get("notification_id", None)
-                ###     )
-
-            # Даем модели «переосмыслить» после выполнения функций
-            conversation = await self._load_history_as_langchain_messages()
-            # conversation.append(HumanMessage(content="Функция выполнена успешно."))
-            new_response = await asyncio.to_thread(self.llm.invoke, conversation)
-            assistant_text = new_response.content
-
-        return final_answer
-
-    async def _save_message(self, role: str, content: str,
-                            function_name: str = None, function_args: str = None):
-        now_utc = datetime.datetime.now(datetime.timezone.utc)
-        uid = self.user.id if self.user else None
-        msg = MessageLog(
-            user_id=uid,
-            role=role,
-            content=content,
-            function_name=function_name,
-            function_args=function_args,
-            timestamp_utc=now_utc
-        )
-        self.db_session.add(msg)
-        self.db_session.commit()
-
-    async def _load_history_as_langchain_messages(self):
-        if not self.user:
-            return []
-
-        msgs = (
-            self.db_session.query(MessageLog)
-            .filter_by(user_id=self.user.id)
-            .order_by(MessageLog.id.asc())
-            .all()
-        )
-        lc_messages = []
-        for m in msgs:
-            if m.role == "system":
-                lc_messages.append(SystemMessage(content=m.content))
-            elif m.role == "assistant":
-                lc_messages.append(AIMessage(content=m.content))
-            else:  # user
-                lc_messages.append(HumanMessage(content=m.content))
-
-        return lc_messages
-
-    def _extract_multiple_json_objects(self, text: str):
-        # Удаляем markdown-блоки ```json
-        clean_text = re.sub(r"```(?:json)?(.*?)```", r"\1", text, flags=re.DOTALL).strip()
-        results = []
-
-        # 1) Пробуем как единый JSON-массив
-        arr = self._try_parse_json(clean_text)
-        if isinstance(arr, list):
-            for item in arr:
-                if isinstance(item, dict):
-                    results.append(item)
-            if results:
-                return results
-
-        # 2) Пробуем искать { } { }
-        remaining = clean_text
-        while True:
-            remaining = remaining.lstrip()
-            if not remaining.startswith("{"):
-                break
-            obj, consumed_len = self._parse_first_json_object(remaining)
-            if not obj:
-                break
-            results.append(obj)
-            remaining = remaining[consumed_len:]
-
-        # 3) Может быть один объект
-        if not results:
-            single_obj = self._try_parse_json(clean_text)
-            if isinstance(single_obj, dict):
-                results.append(single_obj)
-
-        return results
-
-    def _try_parse_json(self, raw_text: str):
-        try:
-            return json.loads(raw_text)
-        except json.JSONDecodeError:
-            return None
-
-    def _parse_first_json_object(self, raw_text: str):
-        bracket_stack = 0
-        end_idx = 0
-        for i, ch in enumerate(raw_text):
-            if ch == '{':
-                bracket_stack += 1
-            elif ch == '}':
-                bracket_stack -= 1
-                if bracket_stack == 0:
-                    end_idx = i
-                    break
-        if bracket_stack != 0:
-            return None, 0
-        candidate = raw_text[:end_idx+1]
-        try:
-            obj = json.loads(candidate)
-            return (obj, end_idx+1)
-        except json.JSONDecodeError:
-            return None, 0
-
-    def __del__(self):
-        self.db_session.close()
+import contextlib
+import datetime
+import json
+
+from langchain.schema import SystemMessage, HumanMessage
+
+from db import AsyncSessionLocal, User, MessageLog, to_naive_utc
+from config import debug_mode, FUNCTION_CALLING_MODE, FUNCTION_CONFIRMATION_MODE
+from llm.manager import invoke, stream
+from history.manager import history_cache, to_langchain_message
+from history.compaction import summary_manager, history_budget, estimate_messages_tokens
+from cache.manager import response_cache, bucket_profile, profile_cache_key
+from profiles.manager import profile_cache
+from metrics.manager import registry, SIZE_BUCKETS
+
+# Импортируем функции из function_calling
+from function_calling.manager import (
+    create_notification_fn,
+    render_notification_confirmation,
+    create_recurring_notification_fn,
+    render_recurring_confirmation
+)
+from function_calling.parser import FunctionCallExtractor, extract_function_calls
+
+# Импортируем «неактивность» из notifications
+from notifications.manager import activity_tracker
+
+prompt_tokens = registry.histogram(
+    "fitai_prompt_tokens", "Оценка размера промпта FitAI.chat (токены)", buckets=SIZE_BUCKETS
+)
+response_chars = registry.histogram(
+    "fitai_response_chars", "Длина ответа пользователю (символы)", buckets=SIZE_BUCKETS
+)
+
+
+class FitAI:
+    """
+    Класс для общения с GigaChat и управления function calling.
+    """
+
+    def __init__(self, user_tg_id: int, user: User = None):
+        self.user_tg_id = user_tg_id
+        self.user = user
+        # Сообщения текущего хода, ещё не записанные в БД (unit of work)
+        self._unsaved = []
+        # finish_reason последнего ответа модели ("stop" — ответ завершён штатно)
+        self.last_finish_reason = None
+
+        self.functions_schemas = [
+            {
+                "name": "create_notification",
+                "description": "Создает новое уведомление для пользователя",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "user_id": {
+                            "type": "string",
+                            "description": "ID пользователя (числовой ID)"
+                        },
+                        "message": {
+                            "type": "string",
+                            "description": "Текст уведомления"
+                        },
+                        "time": {
+                            "type": "string",
+                            "format": "date-time",
+                            "description": "Локальное время (ISO8601), например: 2025-01-18T14:00:00+03:00"
+                        }
+                    },
+                    "required": ["user_id", "message", "time"]
+                }
+            },
+            {
+                "name": "create_recurring_notification",
+                "description": "Создает повторяющееся уведомление (например, каждый пн/ср/пт в 7:00) одним вызовом",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "user_id": {
+                            "type": "string",
+                            "description": "ID пользователя (числовой ID)"
+                        },
+                        "message": {
+                            "type": "string",
+                            "description": "Текст уведомления"
+                        },
+                        "days": {
+                            "type": "array",
+                            "items": {"type": "string", "enum": ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]},
+                            "description": "Дни недели; пустой список — каждый день"
+                        },
+                        "time": {
+                            "type": "string",
+                            "description": "Локальное время пользователя в формате ЧЧ:ММ, например: 07:00"
+                        }
+                    },
+                    "required": ["user_id", "message", "days", "time"]
+                }
+            }]
+#            {
+#                "name": "list_notifications",
+#                "description": "Возвращает список всех уведомлений для пользователя",
+#                "parameters": {
+#                    "type": "object",
+#                    "properties": {
+#                        "user_id": {
+#                            "type": "string",
+#                            "description": "ID пользователя"
+#                        }
+#                    },
+#                    "required": ["user_id"]
+#                }
+#            },
+#            {
+#                "name": "update_notification",
+#                "description": "Изменяет текст или время уведомления по его ID",
+#                "parameters": {
+#                    "type": "object",
+#                    "properties": {
+#                        "user_id": {
+#                            "type": "string",
+#                            "description": "ID пользователя"
+#                        },
+#                        "notification_id": {
+#                            "type": "integer",
+#                            "description": "ID уведомления"
+#                        },
+#                        "message": {
+#                            "type": "string",
+#                            "description": "Новый текст уведомления (необязательно)",
+#                            "nullable": True
+#                        },
+#                        "time": {
+#                            "type": "string",
+#                            "format": "date-time",
+#                            "description": "Новое время (ISO8601) (необязательно)",
+#                            "nullable": True
+#                        }
+#                    },
+#                    "required": ["user_id", "notification_id"]
+#                }
+#            },
+#            {
+#                "name": "delete_notification",
+#                "description": "Удаляет уведомление по его ID",
+#                "parameters": {
+#                    "type": "object",
+#                    "properties": {
+#                        "user_id": {
+#                            "type": "string",
+#                            "description": "ID пользователя"
+#                        },
+#                        "notification_id": {
+#                            "type": "integer",
+#                            "description": "ID уведомления"
+#                        }
+#                    },
+#                    "required": ["user_id", "notification_id"]
+#                }
+#            }
+#        ]
+
+    @classmethod
+    async def create(cls, user_tg_id: int) -> "FitAI":
+        """Создаёт FitAI с профилем пользователя (из кэша профилей или БД)."""
+        user = await profile_cache.get_by_tg_id(user_tg_id)
+        return cls(user_tg_id, user=user)
+
+    async def chat(self, user_message: str, on_partial=None) -> str:
+        """
+        Основной метод диалога с моделью.
+        on_partial — необязательная корутина, получающая накопленный текст ответа
+        по мере генерации (для потоковых ответов). JSON вызова функций в неё не попадает.
+        """
+        try:
+            return await self._chat(user_message, on_partial)
+        finally:
+            # Все сообщения хода пишутся в БД одним коммитом
+            await self._flush_messages()
+
+    async def _chat(self, user_message: str, on_partial=None) -> str:
+        if not self.user:
+            return "Пользователь не найден. Сначала пройдите регистрацию."
+
+        # При каждом новом сообщении «обнуляем» таймер неактивности
+        activity_tracker.touch(self.user.id)
+
+        # Подготовим system prompt:
+        now_utc = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        current_weekday_utc = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')[
+            datetime.datetime.now(datetime.timezone.utc).weekday()]
+        user_info = (
+            f"Имя: {self.user.name}, "
+            f"user_id: {self.user.id}, "
+            f"Возраст: {self.user.age}, "
+            f"Пол: {self.user.sex}, "
+            f"Вес: {self.user.weight}кг, Рост: {self.user.height}см, "
+            f"Цель: {self.user.goal}, Уровень: {self.user.skill}, "
+            f"Часовой пояс: {self.user.timezone}, "
+            f"Текущее время и день недели (UTC): {now_utc, current_weekday_utc} "
+        )
+        current_weekday = ('Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье')[
+            datetime.datetime.now().weekday()]
+        user_message += f'\n Сообщение отправлено в: {datetime.datetime.now().isoformat()} {current_weekday}\n'
+
+        if FUNCTION_CALLING_MODE == "native":
+            # Схемы уходят в API структурно, в промпте они не нужны
+            system_text = (
+                "Вы — FitAI, профессиональный фитнес-тренер и диетолог. "
+                "Отвечайте на русском, кратко и структурировано. "
+                "Составляете планы тренировок и питания, даете советы и отвечаете на вопросы связанные с фитнесом и диетой. "
+                "Для разового напоминания вызывайте функцию create_notification, "
+                "для регулярного (по дням недели или каждый день) — один вызов create_recurring_notification.\n\n"
+                f"Данные о пользователе:\n{user_info}\n"
+                "Обязательно учитывайте timezone пользователя при планировании уведомлений."
+            )
+        else:
+            system_text = (
+                "Вы — FitAI, профессиональный фитнес-тренер и диетолог. "
+                "Отвечайте на русском, кратко и структурировано. "
+                "Составляете планы тренировок и питания, даете советы и отвечаете на вопросы связанные с фитнесом и диетой. "
+                "Умеете вызывать функции create_notification (разовое напоминание) "
+                "и create_recurring_notification (регулярное напоминание одним вызовом). "
+                "Если используете функцию, верните ТОЛЬКО JSON, без дополнительного текста. "
+                "После выполнения функции сможете продолжить ответ.\n\n"
+                f"Данные о пользователе:\n{user_info}\n"
+                f"Схемы функций:\n{self.functions_schemas}"
+                "\n\n"
+                "Примеры использования функции:\n"
+                "   {\n"
+                "       \"name\": \"create_notification\",\n"
+                "       \"parameters\": {\n"
+                "           \"user_id\": \"1\",\n"
+                "           \"message\": \"Напоминание: время тренировки подошло!\",\n"
+                "           \"time\": \"2025-01-17T09:00:00+03:00\"\n"
+                "       }\n"
+                "   }\n\n"
+                "Если нужно вызвать функцию, вы должны вернуть JSON, как в примере."
+                "Обязательно учитывайте timezone пользователя при планировании уведомлений."
+            )
+
+        # Превращаем историю диалога в LangChain-месседжи
+        conversation = await self._load_history_as_langchain_messages(system_text, user_message)
+        conversation.insert(0, SystemMessage(content=system_text))
+        conversation.append(HumanMessage(content=user_message))
+        conversation_tokens = estimate_messages_tokens(conversation)
+        prompt_tokens.observe(conversation_tokens)
+        if debug_mode:
+            print(f"[FitAI] Промпт для user_id={self.user.id}: ~{conversation_tokens} токенов")
+
+        # Вызываем GigaChat
+        assistant_text, function_calls = await self._complete(conversation, on_partial)
+
+        # Сохраняем входящее сообщение пользователя (role="user")
+        user_message += '\n Сообщение отправлено в ' + datetime.datetime.now().isoformat()
+        await self._save_message(role="user", content=user_message)
+
+        final_answer = ""
+        while True:
+            if not function_calls:
+                # Нет функций — обычный ответ от ассистента
+                await self._save_message(role="assistant", content=assistant_text)
+                final_answer = assistant_text
+                break
+
+            # Сохраняем ответ ассистента (как он есть, без отправки юзеру)
+            await self._save_message(role="assistant", content=assistant_text)
+
+            # Выполняем каждую функцию
+            confirmations = []
+            templated = True
+            for fc in function_calls:
+                fname = fc.get("name")
+                fargs = fc.get("parameters", {})
+
+                if FUNCTION_CONFIRMATION_MODE == "template":
+                    # Запись о вызове функции (без просьбы к модели что-то ответить)
+                    await self._save_message(
+                        role="user",
+                        content=f"Функция {fname} вызвана. Текущее время: {datetime.datetime.now().isoformat()}",
+                        function_name=fname,
+                        function_args=json.dumps(fargs, ensure_ascii=False)
+                    )
+                else:
+                    # Сохраняем отдельным сообщением запись о вызове функции
+                    await self._save_message(
+                        role="user",
+                        content=f"Функция была вызвана успешно. Теперь ты сообщишь об этом пользователю! Сказав, что все прошло успешно! Текущее время: {datetime.datetime.now().isoformat()}",
+                        function_name=fname,
+                        function_args=json.dumps(fargs, ensure_ascii=False)
+                    )
+
+                if fname == "create_notification":
+                    local_dt = await create_notification_fn(
+                        user_id_str=fargs.get("user_id", ""),
+                        msg_text=fargs.get("message", ""),
+                        time_str=fargs.get("time", "")
+                    )
+                    confirmations.append(
+                        render_notification_confirmation(fargs.get("message", ""), local_dt)
+                    )
+                elif fname == "create_recurring_notification":
+                    rule, local_dt = await create_recurring_notification_fn(
+                        user_id_str=fargs.get("user_id", ""),
+                        msg_text=fargs.get("message", ""),
+                        days=fargs.get("days", []),
+                        time_str=fargs.get("time", "")
+                    )
+                    confirmations.append(
+                        render_recurring_confirmation(fargs.get("message", ""), rule, local_dt)
+                    )
+                else:
+                    templated = False
+                """
+                Далее функции для работы с уведомлениями (CRUD) в БД,
+                которые убрали из functions_calling и промпта т.к.
+                GigaChat ими все равно не пользуется, но они захламляют его помять.
+                """
+                ### elif fname == "list_notifications":
+                ###     notifs = list_notifications_fn(fargs.get("user_id", ""))
+                ###     # Чтобы модель могла «увидеть» результат,
+                ###     # добавляем новое HumanMessage со списком
+                ###     conversation.append(HumanMessage(
+                ###         content=f"NOTIFICATION_LIST={json.dumps(notifs, ensure_ascii=False)}"
+                ###     ))
+
+                ### elif fname == "update_notification":
+                ###     update_notification_fn(
+                ###         user_id_str=fargs.get("user_id", ""),
+                ###         notification_id=fargs.get("notification_id", None),
+                ###         new_msg=fargs.get("message", None),
+                ###         new_time=fargs.get("time", None)
+                ###     )
+
+                ### elif fname == "delete_notification":
+                ###     delete_notification_fn(
+                ###         user_id_str=fargs.get("user_id", ""),
+                ###         notification_id=fargs.get("notification_id", None)
+                ###     )
+
+            # Для известных функций подтверждение собирается по шаблону,
+            # без второго запроса к модели
+            if FUNCTION_CONFIRMATION_MODE == "template" and templated and confirmations:
+                final_answer = "\n".join(confirmations)
+                await self._save_message(role="assistant", content=final_answer)
+                break
+
+            # Даем модели «переосмыслить» после выполнения функций
+            conversation = await self._load_history_as_langchain_messages()
+            # conversation.append(HumanMessage(content="Функция выполнена успешно."))
+            assistant_text, function_calls = await self._complete(conversation, on_partial)
+
+        response_chars.observe(len(final_answer))
+        return final_answer
+
+    async def generate_plan(self, command: str, user_message: str, on_partial=None) -> str:
+        """
+        Генерация плана (/meal_plan, /workout_plan) с кэшем по «округлённому» профилю.
+        Промпт строится только из нормализованного профиля (без имени и истории),
+        поэтому ответ из кэша одинаково подходит всем пользователям с тем же ключом.
+        """
+        if not self.user:
+            return "Пользователь не найден. Сначала пройдите регистрацию."
+
+        activity_tracker.touch(self.user.id)
+
+        key = profile_cache_key(command, self.user)
+
+        async def produce():
+            p = bucket_profile(self.user)
+            system_text = (
+                "Вы — FitAI, профессиональный фитнес-тренер и диетолог. "
+                "Отвечайте на русском, кратко и структурировано. "
+                "Не обращайтесь к пользователю по имени.\n\n"
+                "Данные о пользователе:\n"
+                f"Возраст: {p['age']}-{p['age'] + 4}, "
+                f"Пол: {p['sex']}, "
+                f"Вес: около {p['weight']}кг, Рост: около {p['height']}см, "
+                f"Цель: {p['goal']}, Уровень: {p['skill']}"
+            )
+            conversation = [SystemMessage(content=system_text), HumanMessage(content=user_message)]
+            text, _ = await self._complete(
+                conversation, on_partial, use_functions=False, priority="plan"
+            )
+            # Пустой, обрезанный по длине или отклонённый модерацией ответ в кэш не кладём:
+            # иначе его неделю получали бы все пользователи с тем же ключом
+            return text, bool(text.strip()) and self.last_finish_reason == "stop"
+
+        reply = await response_cache.get_or_create(key, command, produce)
+
+        # В историю план попадает как обычный обмен сообщениями
+        await self._save_message(role="user", content=user_message)
+        await self._save_message(role="assistant", content=reply)
+        await self._flush_messages()
+        return reply
+
+    async def _complete(self, conversation: list, on_partial=None, use_functions: bool = True,
+                        priority: str = "chat"):
+        """
+        Вызов GigaChat: обычный или потоковый (если передан on_partial) с классом
+        приоритета priority; при переполненной очереди — LLMBusyError.
+        Возвращает (текст ответа, вызовы функций в формате {"name": ..., "parameters": {...}}):
+        нативный вызов функции или, как запасной вариант, JSON в начале текста.
+        Нативный вызов сохраняется в истории тем же JSON, что и в режиме "json".
+        finish_reason ответа сохраняется в self.last_finish_reason.
+        """
+        kwargs = {}
+        if use_functions and FUNCTION_CALLING_MODE == "native":
+            kwargs["functions"] = self.functions_schemas
+
+        if on_partial is None:
+            response = await invoke(conversation, priority=priority, **kwargs)
+            self.last_finish_reason = response.response_metadata.get("finish_reason")
+            native_calls = self._native_function_calls(response)
+            if native_calls:
+                return json.dumps(native_calls, ensure_ascii=False), native_calls
+            return response.content, extract_function_calls(response.content)
+
+        response = None
+        extractor = FunctionCallExtractor()
+        # Если on_partial упадёт, генератор закрывается сразу и возвращает слот допуска к GigaChat
+        async with contextlib.aclosing(stream(conversation, priority=priority, **kwargs)) as chunks:
+            async for chunk in chunks:
+                response = chunk if response is None else response + chunk
+                extractor.feed(chunk.content)
+                # Ответ, начинающийся с JSON, — вызов функции: пользователю его не показываем
+                if not extractor.is_function_call:
+                    await on_partial(response.content)
+        if response is None:
+            self.last_finish_reason = None
+            return "", []
+        self.last_finish_reason = response.response_metadata.get("finish_reason")
+        native_calls = self._native_function_calls(response)
+        if native_calls:
+            return json.dumps(native_calls, ensure_ascii=False), native_calls
+        return response.content, extractor.finish()
+
+    @staticmethod
+    def _native_function_calls(response) -> list:
+        function_call = response.additional_kwargs.get("function_call")
+        if not function_call:
+            return []
+        arguments = function_call.get("arguments") or {}
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments)
+            except json.JSONDecodeError:
+                arguments = {}
+        return [{"name": function_call.get("name"), "parameters": arguments}]
+
+    async def _save_message(self, role: str, content: str,
+                            function_name: str = None, function_args: str = None):
+        """Сообщение попадает в буфер хода; в БД оно уйдёт в _flush_messages."""
+        now_utc = datetime.datetime.now(datetime.timezone.utc)
+        uid = self.user.id if self.user else None
+        msg = MessageLog(
+            user_id=uid,
+            role=role,
+            content=content,
+            function_name=function_name,
+            function_args=function_args,
+            timestamp_utc=to_naive_utc(now_utc)
+        )
+        self._unsaved.append(msg)
+
+    async def _flush_messages(self):
+        """Записывает все сообщения хода одной транзакцией (один коммит на ход)."""
+        if not self._unsaved:
+            return
+        msgs, self._unsaved = self._unsaved, []
+        async with AsyncSessionLocal() as db_session:
+            db_session.add_all(msgs)
+            await db_session.commit()
+        for msg in msgs:
+            if msg.user_id is not None:
+                history_cache.append(msg.user_id, msg)
+
+    async def _load_history_as_langchain_messages(self, *reserved_texts: str):
+        """
+        История в пределах бюджета токенов (за вычетом reserved_texts —
+        system prompt и текущего сообщения). Старая часть заменяется summary.
+        """
+        if not self.user:
+            return []
+
+        # История берётся из процессного кэша, из БД дочитывается только хвост
+        # Ещё не записанные сообщения текущего хода добавляются в конец (read-your-writes)
+        return await summary_manager.build_history(
+            self.user.id, history_budget(*reserved_texts),
+            extra_messages=[to_langchain_message(m) for m in self._unsaved]
+        )
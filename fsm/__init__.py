@@ -0,0 +1 @@
+# fsm/__init__.py
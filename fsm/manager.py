@@ -0,0 +1,104 @@
+import datetime
+import json
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+
+from config import debug_mode, FSM_STATE_TTL_HOURS
+from db import AsyncSessionLocal, FSMStateEntry, to_naive_utc
+
+_EMPTY_DATA = "{}"
+
+
+def _storage_key(key: StorageKey) -> str:
+    return ":".join(str(part) if part is not None else "" for part in (
+        key.bot_id, key.chat_id, key.user_id, key.thread_id,
+        key.business_connection_id, key.destiny
+    ))
+
+
+def _utcnow() -> datetime.datetime:
+    return to_naive_utc(datetime.datetime.now(datetime.timezone.utc))
+
+
+class DBStorage(BaseStorage):
+    """
+    Хранилище FSM aiogram в таблице fsm_states вместо MemoryStorage:
+    состояние переживает перезапуск и одинаково видно всем процессам бота,
+    а в памяти процесса ничего не копится. Пустые состояния (после state.clear())
+    удаляются сразу, брошенные — периодической очисткой по updated_at;
+    просроченное, но ещё не удалённое состояние читается как пустое.
+    """
+
+    def __init__(self, ttl_hours: int):
+        self.ttl = datetime.timedelta(hours=ttl_hours)
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._save(key, state=state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._load(key)
+        return row.state if row is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._save(key, data=json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._load(key)
+        return json.loads(row.data) if row is not None else {}
+
+    async def close(self) -> None:
+        pass
+
+    async def purge(self):
+        """Удаляет брошенные состояния (периодическая задача)."""
+        async with AsyncSessionLocal() as db_session:
+            result = await db_session.execute(
+                delete(FSMStateEntry).where(FSMStateEntry.updated_at < _utcnow() - self.ttl)
+            )
+            await db_session.commit()
+        if debug_mode and result.rowcount:
+            print(f"[FSM] Удалено брошенных состояний: {result.rowcount}")
+
+    async def _load(self, key: StorageKey):
+        async with AsyncSessionLocal() as db_session:
+            return (await db_session.execute(
+                select(FSMStateEntry).where(
+                    FSMStateEntry.key == _storage_key(key),
+                    FSMStateEntry.updated_at >= _utcnow() - self.ttl
+                )
+            )).scalars().first()
+
+    async def _save(self, key: StorageKey, **values):
+        """Upsert одной колонки (state или data); строку без состояния и данных удаляем."""
+        storage_key = _storage_key(key)
+        now = _utcnow()
+        values["updated_at"] = now
+        async with AsyncSessionLocal() as db_session:
+            # Просроченная строка не должна «воскреснуть» вместе со старым состоянием
+            await db_session.execute(
+                delete(FSMStateEntry).where(
+                    FSMStateEntry.key == storage_key,
+                    FSMStateEntry.updated_at < now - self.ttl
+                )
+            )
+            await db_session.execute(
+                insert(FSMStateEntry)
+                .values(**{"key": storage_key, "data": _EMPTY_DATA, **values})
+                .on_conflict_do_update(index_elements=[FSMStateEntry.key], set_=values)
+            )
+            await db_session.execute(
+                delete(FSMStateEntry).where(
+                    FSMStateEntry.key == storage_key,
+                    FSMStateEntry.state.is_(None),
+                    FSMStateEntry.data == _EMPTY_DATA
+                )
+            )
+            await db_session.commit()
+
+
+fsm_storage = DBStorage(ttl_hours=FSM_STATE_TTL_HOURS)
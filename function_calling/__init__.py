@@ -1 +1 @@
-# function_calling/__init__.py
+# function_calling/__init__.py
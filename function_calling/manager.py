@@ -1,54 +1,92 @@
-from notifications.manager import schedule_notification
-
-
-def create_notification_fn(user_id_str: str, msg_text: str, time_str: str):
-    """
-    Обёртка для вызова schedule_notification
-    """
-    try:
-        uid_int = int(user_id_str)
-        schedule_notification(uid_int, time_str, msg_text)
-    except ValueError:
-        pass
-
-"""
-Далее функции для работы с уведомлениями (CRUD) в БД,
-которые убрали из functions_calling и промпта т.к.
-GigaChat ими все равно не пользуется, но они захламляют его помять.
-"""
-# def list_notifications_fn(user_id_str: str) -> list:
-#     """
-#     Обёртка для list_notifications
-#     """
-#     try:
-#         uid_int = int(user_id_str)
-#         return list_notifications(uid_int)
-#     except ValueError:
-#         return []
-#
-#
-# def update_notification_fn(user_id_str: str,
-#                            notification_id: int,
-#                            new_msg: str = None,
-#                            new_time: str = None):
-#     """
-#     Обёртка для update_notification
-#     """
-#     try:
-#         uid_int = int(user_id_str)
-#         update_notification(uid_int, notification_id, new_msg, new_time)
-#     except ValueError:
-#         pass
-#
-#
-# def delete_notification_fn(user_id_str: str,
-#                            notification_id: int):
-#     """
-#     Обёртка для delete_notification
-#     """
-#     try:
-#         uid_int = int(user_id_str)
-#         delete_notification(uid_int, notification_id)
-#     except ValueError:
-#         pass
+from notifications.manager import schedule_notification, schedule_recurring_notification
+from notifications.recurrence import build_rule, describe_rule
+
+
+async def create_notification_fn(user_id_str: str, msg_text: str, time_str: str):
+    """
+    Обёртка для вызова schedule_notification.
+    Возвращает локальное время уведомления или None, если создать его не удалось.
+    """
+    try:
+        uid_int = int(user_id_str)
+        return await schedule_notification(uid_int, time_str, msg_text)
+    except ValueError:
+        return None
+
+
+def render_notification_confirmation(msg_text: str, local_dt) -> str:
+    """
+    Подтверждение для пользователя по шаблону — вместо второго запроса к модели.
+    """
+    if local_dt is None:
+        return f"Не удалось создать напоминание «{msg_text}»: время указано неверно или уже прошло."
+    return f"Готово! Напоминание «{msg_text}» запланировано на {local_dt.strftime('%d.%m.%Y %H:%M')}."
+
+
+async def create_recurring_notification_fn(user_id_str: str, msg_text: str, days, time_str: str):
+    """
+    Обёртка для schedule_recurring_notification: days — дни недели ("MO".."SU",
+    пусто — каждый день), time_str — локальное время "ЧЧ:ММ".
+    Возвращает (правило, локальное время первого срабатывания) или (None, None).
+    """
+    try:
+        uid_int = int(user_id_str)
+        hour, minute = (int(part) for part in time_str.split(":")[:2])
+        if isinstance(days, str):
+            days = [d.strip() for d in days.split(",") if d.strip()]
+        rule = build_rule(days, hour, minute)
+    except (ValueError, TypeError, AttributeError):
+        return None, None
+    local_dt = await schedule_recurring_notification(uid_int, rule, msg_text)
+    return (rule, local_dt) if local_dt is not None else (None, None)
+
+
+def render_recurring_confirmation(msg_text: str, rule, local_dt) -> str:
+    if local_dt is None:
+        return f"Не удалось создать повторяющееся напоминание «{msg_text}»: расписание указано неверно."
+    return (
+        f"Готово! Напоминание «{msg_text}» будет приходить {describe_rule(rule)}. "
+        f"Ближайшее — {local_dt.strftime('%d.%m.%Y %H:%M')}."
+    )
+
+"""
+Далее функции для работы с уведомлениями (CRUD) в БД,
+которые убрали из functions_calling и промпта т.к.
+GigaChat ими все равно не пользуется, но они захламляют его помять.
+"""
+# def list_notifications_fn(user_id_str: str) -> list:
+#     """
+#     Обёртка для list_notifications
+#     """
+#     try:
+#         uid_int = int(user_id_str)
+#         return list_notifications(uid_int)
+#     except ValueError:
+#         return []
+#
+#
+# def update_notification_fn(user_id_str: str,
+#                            notification_id: int,
+#                            new_msg: str = None,
+#                            new_time: str = None):
+#     """
+#     Обёртка для update_notification
+#     """
+#     try:
+#         uid_int = int(user_id_str)
+#         update_notification(uid_int, notification_id, new_msg, new_time)
+#     except ValueError:
+#         pass
+#
+#
+# def delete_notification_fn(user_id_str: str,
+#                            notification_id: int):
+#     """
+#     Обёртка для delete_notification
+#     """
+#     try:
+#         uid_int = int(user_id_str)
+#         delete_notification(uid_int, notification_id)
+#     except ValueError:
+#         pass
 #
\ No newline at end of file
@@ -0,0 +1,133 @@
+import json
+
+_DECODER = json.JSONDecoder()
+_FENCE = "```"
+_FENCE_LANG = "json"
+
+
+class FunctionCallExtractor:
+    """
+    Инкрементальный разбор вызовов функций из ответа модели.
+    Ответ считается вызовом функций, если он начинается с JSON-объекта
+    (или массива объектов), возможно внутри markdown-блока ```json.
+    Текст можно подавать кусками по мере генерации (feed) — каждый символ
+    просматривается один раз, а json.JSONDecoder.raw_decode вызывается только
+    для уже сбалансированного по скобкам фрагмента (скобки внутри строк не считаются).
+    Когда ясно, что дальше вызовов нет, текст больше не накапливается.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._text = ""
+        # Первый непробельный символ ответа (None — пока были только пробелы)
+        self._first = None
+        self._pos = 0
+        # Начало текущего JSON-фрагмента (None — ищем следующий)
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Встретили что-то кроме JSON — дальше вызовов функций нет
+        self._done = False
+
+    @property
+    def is_function_call(self) -> bool:
+        """Ответ начинается как JSON (пока не доказано обратное) — пользователю его не показываем."""
+        return self._first is not None and self._first in "{[`" and (bool(self.calls) or not self._done)
+
+    def feed(self, chunk: str) -> list:
+        """Добавляет кусок текста; возвращает новые полностью разобранные вызовы."""
+        if self._first is None:
+            head = chunk.lstrip()
+            if head:
+                self._first = head[0]
+        if self._done:
+            return []
+        self._text += chunk
+        found = len(self.calls)
+        self._scan()
+        return self.calls[found:]
+
+    def finish(self) -> list:
+        """Конец ответа: недописанный JSON отбрасываем, возвращаем все вызовы."""
+        self._done = True
+        return self.calls
+
+    def _scan(self):
+        text = self._text
+        n = len(text)
+        while not self._done and self._pos < n:
+            if self._start is None:
+                # Пропускаем пробелы и markdown-ограждения ``` / ```json
+                ch = text[self._pos]
+                if ch.isspace():
+                    self._pos += 1
+                    continue
+                if ch == "`":
+                    if not self._skip_fence(text):
+                        return
+                    continue
+                if ch not in "{[":
+                    self._done = True
+                    return
+                self._start = self._pos
+                self._depth = 0
+
+            ch = text[self._pos]
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._decode(text)
+
+    def _skip_fence(self, text: str) -> bool:
+        """
+        Пропускает ``` (и тег json после него). False — нужно дождаться
+        следующего куска текста или это не ограждение (тогда разбор окончен).
+        """
+        fence = text[self._pos:self._pos + len(_FENCE)]
+        if fence != _FENCE:
+            if not _FENCE.startswith(fence) or len(fence) == len(_FENCE):
+                self._done = True
+            return False
+        lang = text[self._pos + len(_FENCE):self._pos + len(_FENCE) + len(_FENCE_LANG)]
+        if len(lang) < len(_FENCE_LANG) and _FENCE_LANG.startswith(lang):
+            # Пока не ясно, ```json это или ``` без тега
+            return False
+        self._pos += len(_FENCE)
+        if lang == _FENCE_LANG:
+            self._pos += len(_FENCE_LANG)
+        return True
+
+    def _decode(self, text: str):
+        try:
+            obj, end = _DECODER.raw_decode(text, self._start)
+        except json.JSONDecodeError:
+            self._done = True
+            return
+        self._start = None
+        self._pos = end
+        if isinstance(obj, dict):
+            self.calls.append(obj)
+        elif isinstance(obj, list):
+            self.calls.extend(item for item in obj if isinstance(item, dict))
+        else:
+            self._done = True
+
+
+def extract_function_calls(text: str) -> list:
+    """Все вызовы функций из готового ответа модели."""
+    extractor = FunctionCallExtractor()
+    extractor.feed(text)
+    return extractor.finish()
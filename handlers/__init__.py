@@ -1 +1 @@
-# handlers/__init__.py
+# handlers/__init__.py
@@ -1,78 +1,166 @@
-from aiogram import Router
-from aiogram.filters.command import Command
-from aiogram.types import Message
-
-from db import SessionLocal, User
-from fit_ai import FitAI
-
-menu_router = Router()
-
-
-async def handle_fitai_request(message: Message, user_text: str):
-    user_tg_id = message.from_user.id
-    db_session = SessionLocal()
-    try:
-        user = db_session.query(User).filter_by(tg_id=user_tg_id).first()
-        if not user:
-            await message.answer("Сначала пройдите регистрацию /start.")
-            return
-    finally:
-        db_session.close()
-
-    fit_ai = FitAI(user_tg_id=user_tg_id)
-    reply = await fit_ai.chat(user_text)
-    await message.answer(reply)
-
-
-@menu_router.message(Command("menu"))
-async def cmd_menu(message: Message):
-    text = (
-        "Меню FitAI:\n"
-        "/meal_plan — Составить рацион\n"
-        "/workout_plan — Составить программу тренировок\n"
-        "/chat <ваш вопрос> — Начать диалог с FitAI (произвольный вопрос)\n"
-    )
-    await message.answer(text)
-
-
-@menu_router.message(Command("meal_plan"))
-async def cmd_meal_plan(message: Message):
-    user_text = (
-        "Составь рацион питания для меня, учитывая мои данные, "
-        "(возраст, пол, вес, рост, цель, уровень подготовки). Я хочу чтобы ты составил сбалансированный план питания на каждый день недели.\n"
-        "Не задавай дополнительных вопросов, напиши подробный план питания. "
-    )
-    await handle_fitai_request(message, user_text)
-
-
-@menu_router.message(Command("workout_plan"))
-async def cmd_workout_plan(message: Message):
-    user_text = (
-        "Составь программу тренировок для меня, учитывая мои данные, "
-        "(возраст, пол, вес, рост, цель, уровень подготовки). Я хочу чтобы ты составил сбалансированную программу тренировок на неделю.\n"
-        "Не задавай дополнительных вопросов, напиши подробную программу тренировок. "
-    )
-    await handle_fitai_request(message, user_text)
-
-
-@menu_router.message(Command("chat"))
-async def cmd_chat(message: Message):
-    """
-    Произвольный диалог с FitAI.
-    Пример: /chat Подскажи, как мне перестать есть сладкое?
-    """
-    parts = message.text.strip().split(maxsplit=1)
-    if len(parts) < 2:
-        await message.answer("Введите вопрос после /chat.")
-        return
-
-    user_text = parts[1]
-    await handle_fitai_request(message, user_text)
-
-@menu_router.message()
-async def chat(message: Message):
-    """
-    Произвольный диалог с FitAI.
-    Пример: /chat Подскажи, как мне перестать есть сладкое?
-    """
-    await message.answer("Введите вопрос после /chat или воспользуйтесь /menu.")
+import time
+
+from aiogram import Router
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.filters.command import Command
+from aiogram.types import Message
+
+from config import STREAM_REPLIES, STREAM_EDIT_INTERVAL, STREAM_MIN_CHARS
+from dialog.manager import dialog_dispatcher
+from fit_ai import FitAI
+from llm.manager import LLMBusyError
+
+menu_router = Router()
+
+# Максимальная длина одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Ответ, когда очередь запросов к GigaChat переполнена
+BUSY_REPLY = "Сейчас слишком много запросов, попробуйте, пожалуйста, через минуту."
+
+
+class ReplyStreamer:
+    """
+    Потоковый ответ в Telegram: как только накопилось немного текста,
+    отправляем сообщение и дальше редактируем его не чаще STREAM_EDIT_INTERVAL.
+    """
+
+    def __init__(self, message: Message):
+        self.message = message
+        self.sent = None
+        self.shown_text = ""
+        self.next_edit_at = 0.0
+
+    async def update(self, text: str):
+        text = text.strip()
+        if self.sent is None:
+            if len(text) < STREAM_MIN_CHARS:
+                return
+            self.sent = await self.message.answer(text[:TELEGRAM_MESSAGE_LIMIT])
+            self.shown_text = text[:TELEGRAM_MESSAGE_LIMIT]
+            self.next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+            return
+
+        if time.monotonic() < self.next_edit_at:
+            return
+        await self._edit(text[:TELEGRAM_MESSAGE_LIMIT])
+
+    async def finish(self, text: str):
+        """Финальный текст: дописываем первое сообщение, остаток — отдельными сообщениями."""
+        parts = [
+            text[i:i + TELEGRAM_MESSAGE_LIMIT]
+            for i in range(0, len(text), TELEGRAM_MESSAGE_LIMIT)
+        ] or [text]
+        if self.sent is None:
+            await self.message.answer(parts[0])
+        else:
+            await self._edit(parts[0], final=True)
+        for part in parts[1:]:
+            await self.message.answer(part)
+
+    async def _edit(self, text: str, final: bool = False):
+        if text == self.shown_text:
+            return
+        try:
+            await self.sent.edit_text(text)
+            self.shown_text = text
+        except TelegramRetryAfter as e:
+            if final:
+                # Финальный текст терять нельзя: отправляем его новым сообщением
+                await self.message.answer(text)
+            self.next_edit_at = time.monotonic() + e.retry_after
+            return
+        except TelegramBadRequest:
+            # Например, "message is not modified"
+            pass
+        self.next_edit_at = time.monotonic() + STREAM_EDIT_INTERVAL
+
+
+async def handle_fitai_request(message: Message, user_text: str, plan_command: str = None):
+    """
+    Ставит запрос в очередь пользователя: ходы одного пользователя выполняются
+    по очереди, а сообщения, пришедшие во время хода, склеиваются в следующий.
+    plan_command — для /meal_plan и /workout_plan: ответ берётся из кэша планов
+    по «округлённому» профилю, а не из обычного диалога.
+    """
+    dialog_dispatcher.submit(
+        message.from_user.id, message, user_text, _run_turn, plan_command=plan_command
+    )
+
+
+async def _run_turn(message: Message, user_text: str, plan_command: str = None):
+    user_tg_id = message.from_user.id
+    # Профиль загружается один раз (асинхронно) и переиспользуется в FitAI
+    fit_ai = await FitAI.create(user_tg_id=user_tg_id)
+    if not fit_ai.user:
+        await message.answer("Сначала пройдите регистрацию /start.")
+        return
+
+    streamer = ReplyStreamer(message) if STREAM_REPLIES else None
+    on_partial = streamer.update if streamer else None
+    try:
+        if plan_command:
+            reply = await fit_ai.generate_plan(plan_command, user_text, on_partial=on_partial)
+        else:
+            reply = await fit_ai.chat(user_text, on_partial=on_partial)
+    except LLMBusyError:
+        # Не копим задержку в очереди — сразу просим повторить позже
+        reply = BUSY_REPLY
+
+    if streamer:
+        await streamer.finish(reply)
+    else:
+        await message.answer(reply)
+
+
+@menu_router.message(Command("menu"))
+async def cmd_menu(message: Message):
+    text = (
+        "Меню FitAI:\n"
+        "/meal_plan — Составить рацион\n"
+        "/workout_plan — Составить программу тренировок\n"
+        "/chat <ваш вопрос> — Начать диалог с FitAI (произвольный вопрос)\n"
+    )
+    await message.answer(text)
+
+
+@menu_router.message(Command("meal_plan"))
+async def cmd_meal_plan(message: Message):
+    user_text = (
+        "Составь рацион питания для меня, учитывая мои данные, "
+        "(возраст, пол, вес, рост, цель, уровень подготовки). Я хочу чтобы ты составил сбалансированный план питания на каждый день недели.\n"
+        "Не задавай дополнительных вопросов, напиши подробный план питания. "
+    )
+    await handle_fitai_request(message, user_text, plan_command="meal_plan")
+
+
+@menu_router.message(Command("workout_plan"))
+async def cmd_workout_plan(message: Message):
+    user_text = (
+        "Составь программу тренировок для меня, учитывая мои данные, "
+        "(возраст, пол, вес, рост, цель, уровень подготовки). Я хочу чтобы ты составил сбалансированную программу тренировок на неделю.\n"
+        "Не задавай дополнительных вопросов, напиши подробную программу тренировок. "
+    )
+    await handle_fitai_request(message, user_text, plan_command="workout_plan")
+
+
+@menu_router.message(Command("chat"))
+async def cmd_chat(message: Message):
+    """
+    Произвольный диалог с FitAI.
+    Пример: /chat Подскажи, как мне перестать есть сладкое?
+    """
+    parts = message.text.strip().split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer("Введите вопрос после /chat.")
+        return
+
+    user_text = parts[1]
+    await handle_fitai_request(message, user_text)
+
+@menu_router.message()
+async def chat(message: Message):
+    """
+    Произвольный диалог с FitAI.
+    Пример: /chat Подскажи, как мне перестать есть сладкое?
+    """
+    await message.answer("Введите вопрос после /chat или воспользуйтесь /menu.")
@@ -0,0 +1 @@
+# history/__init__.py
@@ -0,0 +1,229 @@
+import asyncio
+import datetime
+import time
+from collections import OrderedDict
+
+from langchain.schema import SystemMessage, HumanMessage
+from sqlalchemy import select
+
+from config import (
+    PROMPT_TOKEN_BUDGET, SUMMARY_MAX_TOKENS, SUMMARY_CHUNK_TOKENS,
+    SUMMARY_RETRY_SECONDS, SUMMARY_RETRY_MAX_SECONDS, HISTORY_CACHE_MAX_USERS, debug_mode
+)
+from db import AsyncSessionLocal, ConversationSummary, to_naive_utc
+from history.manager import history_cache
+from llm.manager import invoke
+
+# Грубая оценка для токенизатора GigaChat: ~3 символа кириллицы на токен
+_CHARS_PER_TOKEN = 3
+# Служебные токены на каждое сообщение (роль, разделители)
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+_ROLE_NAMES = {"system": "Система", "ai": "FitAI", "human": "Пользователь"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Быстрая оценка числа токенов без обращения к API."""
+    return len(text) // _CHARS_PER_TOKEN + 1
+
+
+def estimate_messages_tokens(messages) -> int:
+    return sum(estimate_tokens(m.content) + _MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def take_chunk(pending: list, budget_tokens: int) -> tuple:
+    """
+    Делит pending (пары (id, сообщение) по возрастанию id) на самые старые
+    сообщения, влезающие в budget_tokens, и остаток. Хотя бы одно сообщение
+    попадает в часть всегда (слишком длинное обрезается при сборке промпта).
+    """
+    used = 0
+    end = 0
+    while end < len(pending):
+        cost = estimate_messages_tokens([pending[end][1]])
+        if end > 0 and used + cost > budget_tokens:
+            break
+        used += cost
+        end += 1
+    return pending[:end], pending[end:]
+
+
+class SummaryManager:
+    """
+    Rolling summary диалога для каждого пользователя.
+    В промпт попадает только «окно» последних сообщений, влезающее в бюджет,
+    а всё более старое заменяется summary из таблицы conversation_summaries.
+    Summary пересчитывается в фоне и никогда не блокирует ответ пользователю:
+    новые сообщения сворачиваются частями по chunk_tokens, а после ошибки
+    следующая попытка для пользователя откладывается (экспоненциально).
+    """
+
+    def __init__(self, max_users: int, chunk_tokens: int, retry_seconds: float, retry_max_seconds: float):
+        self.max_users = max_users
+        self.chunk_tokens = chunk_tokens
+        self.retry_seconds = retry_seconds
+        self.retry_max_seconds = retry_max_seconds
+        # user_id -> (last_message_id, content); None — summary ещё нет
+        self._summaries = OrderedDict()
+        self._tasks = {}
+        # user_id -> (число ошибок подряд, monotonic-время, раньше которого не повторяем)
+        self._backoff = {}
+        self.refreshes = 0
+        self.failures = 0
+
+    async def build_history(self, user_id: int, budget_tokens: int, extra_messages: list = ()) -> list:
+        """
+        Возвращает историю для промпта: [summary] + последние сообщения,
+        суммарно не больше budget_tokens. Если за окном остались сообщения,
+        ещё не вошедшие в summary, запускает фоновое обновление summary.
+        extra_messages — ещё не сохранённые сообщения текущего хода, всегда идут в конец.
+        """
+        ids, messages = await history_cache.get_with_ids(user_id)
+        summary = await self._get_summary(user_id)
+        summary_last_id, summary_text = summary if summary else (0, None)
+
+        summary_message = None
+        if summary_text:
+            summary_message = SystemMessage(
+                content=f"Краткое содержание предыдущего диалога:\n{summary_text}"
+            )
+            budget_tokens -= estimate_messages_tokens([summary_message])
+        budget_tokens -= estimate_messages_tokens(extra_messages)
+
+        # Набираем окно с конца, пока влезает в бюджет
+        start = len(messages)
+        used = 0
+        while start > 0:
+            cost = estimate_messages_tokens([messages[start - 1]])
+            if used + cost > budget_tokens:
+                break
+            used += cost
+            start -= 1
+
+        # Сообщения за окном, которые summary ещё не покрывает
+        if start > 0 and ids[start - 1] > summary_last_id:
+            pending = [
+                (msg_id, m) for msg_id, m in zip(ids[:start], messages[:start])
+                if msg_id > summary_last_id
+            ]
+            self._schedule_refresh(user_id, summary_text, pending)
+
+        window = messages[start:]
+        if summary_message is not None:
+            window.insert(0, summary_message)
+        window.extend(extra_messages)
+        return window
+
+    async def _get_summary(self, user_id: int):
+        if user_id in self._summaries:
+            self._summaries.move_to_end(user_id)
+            return self._summaries[user_id]
+
+        async with AsyncSessionLocal() as db_session:
+            row = (await db_session.execute(
+                select(ConversationSummary).filter_by(user_id=user_id)
+            )).scalars().first()
+        summary = (row.last_message_id, row.content) if row else None
+        self._remember(user_id, summary)
+        return summary
+
+    def _remember(self, user_id: int, summary):
+        self._summaries[user_id] = summary
+        self._summaries.move_to_end(user_id)
+        while len(self._summaries) > self.max_users:
+            self._summaries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "in_progress": len(self._tasks),
+            "backing_off": len(self._backoff),
+        }
+
+    def _schedule_refresh(self, user_id: int, summary_text, pending: list):
+        # Не больше одного фонового пересчёта на пользователя одновременно
+        if user_id in self._tasks:
+            return
+        backoff = self._backoff.get(user_id)
+        if backoff is not None and time.monotonic() < backoff[1]:
+            return
+        task = asyncio.create_task(self._refresh(user_id, summary_text, pending))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+
+    async def _refresh(self, user_id: int, summary_text, pending: list):
+        """Сворачивает pending в summary частями, от старых сообщений к новым."""
+        while pending:
+            chunk, pending = take_chunk(pending, self.chunk_tokens)
+            try:
+                summary_text = await self._fold(user_id, summary_text, chunk)
+            except Exception as e:
+                self._fail(user_id)
+                print(f"[SUMMARY] Ошибка при обновлении summary для user_id={user_id}: {e}")
+                return
+        self._backoff.pop(user_id, None)
+
+    def _fail(self, user_id: int):
+        self.failures += 1
+        errors = self._backoff.get(user_id, (0, 0))[0] + 1
+        delay = min(self.retry_seconds * 2 ** (errors - 1), self.retry_max_seconds)
+        self._backoff[user_id] = (errors, time.monotonic() + delay)
+        # Словарь не растёт бесконечно: давно истёкшие отсрочки забываем
+        if len(self._backoff) > self.max_users:
+            now = time.monotonic()
+            for uid in [u for u, (_, until) in self._backoff.items() if until <= now]:
+                del self._backoff[uid]
+
+    async def _fold(self, user_id: int, summary_text, chunk: list) -> str:
+        """Один запрос к модели: summary + часть новых сообщений; сохраняет и возвращает новый summary."""
+        # Одно сообщение длиннее части обрезается, чтобы промпт оставался в пределах бюджета
+        limit_chars = self.chunk_tokens * _CHARS_PER_TOKEN
+        dialog = "\n".join(
+            f"{_ROLE_NAMES.get(m.type, 'Пользователь')}: {m.content[:limit_chars]}" for _, m in chunk
+        )
+        prompt = (
+            "Обнови краткое содержание диалога фитнес-тренера FitAI с пользователем. "
+            "Сохрани важные факты о пользователе, его целях, ограничениях, договорённостях "
+            "и созданных напоминаниях. Пиши по-русски, сжато, без приветствий. "
+            f"Не более {SUMMARY_MAX_TOKENS * _CHARS_PER_TOKEN} символов.\n\n"
+            f"Текущее краткое содержание:\n{summary_text or '(пусто)'}\n\n"
+            f"Новые сообщения:\n{dialog}"
+        )
+        # Фоновая задача: уступает слоты ответам пользователям
+        response = await invoke([HumanMessage(content=prompt)], priority="background")
+
+        new_text = response.content.strip()
+        if not new_text:
+            raise ValueError("модель вернула пустое краткое содержание")
+        last_id = chunk[-1][0]
+        async with AsyncSessionLocal() as db_session:
+            row = (await db_session.execute(
+                select(ConversationSummary).filter_by(user_id=user_id)
+            )).scalars().first()
+            if not row:
+                row = ConversationSummary(user_id=user_id)
+                db_session.add(row)
+            row.content = new_text
+            row.last_message_id = last_id
+            row.updated_at = to_naive_utc(datetime.datetime.now(datetime.timezone.utc))
+            await db_session.commit()
+
+        self._remember(user_id, (last_id, new_text))
+        self.refreshes += 1
+        if debug_mode:
+            print(f"[SUMMARY] user_id={user_id}: summary обновлён до message_id={last_id}")
+        return new_text
+
+
+summary_manager = SummaryManager(
+    max_users=HISTORY_CACHE_MAX_USERS,
+    chunk_tokens=SUMMARY_CHUNK_TOKENS,
+    retry_seconds=SUMMARY_RETRY_SECONDS,
+    retry_max_seconds=SUMMARY_RETRY_MAX_SECONDS
+)
+
+
+def history_budget(*texts: str) -> int:
+    """Сколько токенов остаётся на историю после system prompt и текущего сообщения."""
+    return max(PROMPT_TOKEN_BUDGET - sum(estimate_tokens(t) for t in texts), 0)
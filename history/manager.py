@@ -0,0 +1,160 @@
+import bisect
+import sys
+from collections import OrderedDict
+
+from langchain.schema import SystemMessage, HumanMessage, AIMessage
+from sqlalchemy import select
+
+from config import HISTORY_CACHE_MAX_USERS, HISTORY_CACHE_MAX_BYTES
+from db import AsyncSessionLocal, MessageLog
+
+# Примерные накладные расходы на один LangChain-месседж (объект + служебные поля)
+_MESSAGE_OVERHEAD_BYTES = 400
+# Сколько последних известных id перепроверяем при дочитывании: строка другой
+# транзакции с меньшим id может закоммититься позже уже прочитанных
+_OVERLAP_IDS = 50
+
+
+def to_langchain_message(m: MessageLog):
+    """Превращает запись MessageLog в LangChain-месседж."""
+    if m.role == "system":
+        return SystemMessage(content=m.content)
+    elif m.role == "assistant":
+        return AIMessage(content=m.content)
+    else:  # user
+        return HumanMessage(content=m.content)
+
+
+class _UserHistory:
+    """Сконвертированная история одного пользователя, упорядоченная по id."""
+
+    __slots__ = ("ids", "messages", "size")
+
+    def __init__(self):
+        self.ids = []
+        self.messages = []
+        self.size = 0
+
+    def tail_floor(self) -> tuple:
+        """
+        Граница дочитывания: (id, известные id выше неё). Из БД берутся строки
+        с id больше границы, которых ещё нет в кэше, — так подхватываются и новые
+        сообщения, и закоммиченные не по порядку (в пределах последних _OVERLAP_IDS).
+        """
+        if len(self.ids) <= _OVERLAP_IDS:
+            return 0, list(self.ids)
+        return self.ids[-_OVERLAP_IDS - 1], self.ids[-_OVERLAP_IDS:]
+
+    def add(self, msg_id: int, message) -> int:
+        """
+        Вставляет сообщение по его id (если ещё не добавлено).
+        Возвращает прирост размера в байтах.
+        """
+        pos = bisect.bisect_left(self.ids, msg_id)
+        if pos < len(self.ids) and self.ids[pos] == msg_id:
+            return 0
+        self.ids.insert(pos, msg_id)
+        self.messages.insert(pos, message)
+        delta = sys.getsizeof(message.content) + _MESSAGE_OVERHEAD_BYTES
+        self.size += delta
+        return delta
+
+
+class HistoryCache:
+    """
+    Процессный LRU-кэш истории диалогов (уже в виде LangChain-месседжей).
+    Из БД дочитывается только «хвост» — строки с id выше границы, которых ещё
+    нет в кэше (граница отстаёт на _OVERLAP_IDS известных id, см. tail_floor).
+    Ограничен и по числу пользователей, и по суммарному объёму в памяти.
+    """
+
+    def __init__(self, max_users: int, max_bytes: int):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, user_id: int) -> list:
+        """Возвращает копию истории пользователя, дочитав из БД новые сообщения."""
+        _, messages = await self.get_with_ids(user_id)
+        return messages
+
+    async def get_with_ids(self, user_id: int) -> tuple:
+        """То же, что get, но вместе со списком id сообщений в MessageLog."""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            self.misses += 1
+            entry = _UserHistory()
+            self._entries[user_id] = entry
+        else:
+            self.hits += 1
+            self._entries.move_to_end(user_id)
+
+        floor_id, known_ids = entry.tail_floor()
+        query = select(MessageLog).where(MessageLog.user_id == user_id, MessageLog.id > floor_id)
+        if known_ids:
+            query = query.where(MessageLog.id.not_in(known_ids))
+        async with AsyncSessionLocal() as db_session:
+            rows = (await db_session.execute(query.order_by(MessageLog.id.asc()))).scalars().all()
+
+        for m in rows:
+            self._add(user_id, entry, m)
+
+        ids, messages = list(entry.ids), list(entry.messages)
+        self._evict()
+        return ids, messages
+
+    def append(self, user_id: int, m: MessageLog):
+        """
+        Добавляет только что сохранённое сообщение (write-through), чтобы
+        следующая загрузка истории сразу его видела. Если пользователя нет
+        в кэше — ничего не делаем, история подтянется из БД при первом чтении.
+        """
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        self._add(user_id, entry, m)
+        self._evict()
+
+    def invalidate(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._total_bytes -= entry.size
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _add(self, user_id: int, entry: _UserHistory, m: MessageLog):
+        """
+        Добавляет сообщение в историю. Размер учитывается, только если entry всё ещё
+        в кэше: пока шла загрузка из БД, её могли вытеснить или инвалидировать, и тогда
+        её байты уже вычтены — такая история отдаётся вызывающему и забывается.
+        """
+        delta = entry.add(m.id, to_langchain_message(m))
+        if self._entries.get(user_id) is entry:
+            self._total_bytes += delta
+
+    def _evict(self):
+        # Последний использованный пользователь не вытесняется, даже если
+        # его история одна превышает лимит по памяти.
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_users or self._total_bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._total_bytes -= entry.size
+            self.evictions += 1
+
+
+history_cache = HistoryCache(
+    max_users=HISTORY_CACHE_MAX_USERS,
+    max_bytes=HISTORY_CACHE_MAX_BYTES
+)
@@ -1,7 +1,8 @@
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-from config import TELEGRAM_BOT_TOKEN
-
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+from config import TELEGRAM_BOT_TOKEN, FSM_STORAGE
+from fsm.manager import fsm_storage
+
+bot = Bot(token=TELEGRAM_BOT_TOKEN)
+storage = fsm_storage if FSM_STORAGE == "db" else MemoryStorage()
+dp = Dispatcher(storage=storage)
@@ -0,0 +1 @@
+# llm/__init__.py
@@ -0,0 +1,455 @@
+import asyncio
+import contextlib
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from gigachat.client import _get_kwargs as gigachat_http_kwargs
+from langchain_community.chat_models import GigaChat
+
+from config import (
+    GigaChatKey, debug_mode,
+    GIGACHAT_POOL_SIZE, GIGACHAT_TOKEN_REFRESH_MARGIN, GIGACHAT_KEEPALIVE_SECONDS,
+    GIGACHAT_BASE_URL, GIGACHAT_AUTH_URL,
+    LLM_MAX_IN_FLIGHT, LLM_USE_ASYNC, LLM_PRIORITY_LIMITS, LLM_QUEUE_CAPACITY
+)
+from metrics.manager import registry
+
+llm_request_seconds = registry.histogram(
+    "fitai_llm_request_seconds", "Время запроса к GigaChat (без ожидания в очереди)",
+    labelnames=("method",)
+)
+llm_queue_wait_seconds = registry.histogram(
+    "fitai_llm_queue_wait_seconds", "Ожидание свободного слота перед запросом к GigaChat",
+    labelnames=("priority",)
+)
+llm_rejected = registry.counter(
+    "fitai_llm_rejected_total", "Запросов к GigaChat, отклонённых из-за переполнения очереди",
+    labelnames=("priority",)
+)
+
+
+class LLMBusyError(Exception):
+    """Очередь запросов данного приоритета переполнена — пользователю стоит повторить позже."""
+
+    def __init__(self, priority: str):
+        super().__init__(f"Очередь запросов к GigaChat ({priority}) переполнена")
+        self.priority = priority
+
+
+def _build_client() -> GigaChat:
+    kwargs = {}
+    if GIGACHAT_BASE_URL:
+        kwargs["base_url"] = GIGACHAT_BASE_URL
+    if GIGACHAT_AUTH_URL:
+        kwargs["auth_url"] = GIGACHAT_AUTH_URL
+    llm = GigaChat(
+        model="GigaChat",
+        credentials=GigaChatKey,
+        scope="GIGACHAT_API_PERS",
+        verify_ssl_certs=False,
+        streaming=False,
+        temperature=0.5,
+        **kwargs
+    )
+    # HTTP-клиенты SDK создаются лениво с настройками httpx по умолчанию, где простаивающее
+    # соединение закрывается через 5 с; подставляем свои, чтобы прогретые соединения жили дольше
+    sdk = llm._client
+    limits = httpx.Limits(keepalive_expiry=GIGACHAT_KEEPALIVE_SECONDS)
+    sdk.__dict__["_aclient"] = httpx.AsyncClient(**gigachat_http_kwargs(sdk._settings), limits=limits)
+    sdk.__dict__["_client"] = httpx.Client(**gigachat_http_kwargs(sdk._settings), limits=limits)
+    return llm
+
+
+class GigaChatPool:
+    """
+    Процессный пул клиентов GigaChat.
+    Клиенты (а значит и их HTTP-соединения) переиспользуются между сообщениями:
+    при старте каждый клиент открывает соединение лёгким запросом списка моделей.
+    Access token общий для всех клиентов; SDK срок его жизни не проверяет (токен
+    считается действительным, пока API не ответит 401), поэтому пул сам обновляет
+    его по expires_at — в фоне и перед запросом, если фоновое обновление опоздало.
+    Токен, который SDK всё же получил сам после 401, пул раздаёт остальным клиентам.
+    """
+
+    def __init__(self, size: int, refresh_margin: int, use_async: bool):
+        self.size = size
+        self.refresh_margin = refresh_margin
+        self.use_async = use_async
+        self._clients = []
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+        self._token = None
+        self._token_lock = asyncio.Lock()
+        self._refresh_task = None
+        self.token_requests = 0
+        self.waiting = 0
+        self.warmed = 0
+
+    async def start(self):
+        """Прогрев: создаём клиентов, получаем токен, открываем соединения и запускаем обновление токена."""
+        while len(self._clients) < self.size:
+            self._idle.append(self._new_client())
+        await self._refresh_token()
+        results = await asyncio.gather(*(self._warm(llm) for llm in self._clients), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        self.warmed = len(results) - len(errors)
+        if errors:
+            # Не смертельно: такие клиенты откроют соединение при первом запросе
+            print(f"[LLM] Не удалось прогреть {len(errors)} из {len(results)} клиентов GigaChat: {errors[0]}")
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+        if debug_mode:
+            print(f"[LLM] Пул GigaChat прогрет: {self.warmed} из {self.size} клиентов.")
+
+    def resize(self, size: int):
+        """Меняет размер пула; вызывается до start()."""
+        self.size = size
+        self._slots = asyncio.Semaphore(size)
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """Берёт клиента из пула (ждёт, если все size клиентов заняты)."""
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            llm = self._idle.pop() if self._idle else self._new_client()
+            try:
+                await self._ensure_token()
+                yield llm
+            finally:
+                self._adopt_token(llm)
+                self._idle.append(llm)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "clients": len(self._clients),
+            "idle": len(self._idle),
+            "in_use": len(self._clients) - len(self._idle),
+            "waiting": self.waiting,
+            "warmed": self.warmed,
+            "token_requests": self.token_requests,
+            "token_expires_in": self._token_ttl(),
+        }
+
+    async def _warm(self, llm: GigaChat):
+        """Открывает соединение клиента (TCP + TLS) тем же транспортом, что и запросы."""
+        if self.use_async:
+            await llm.aget_models()
+        else:
+            await asyncio.to_thread(llm.get_models)
+
+    def _new_client(self) -> GigaChat:
+        llm = _build_client()
+        if self._token is not None:
+            llm._client._access_token = self._token
+        self._clients.append(llm)
+        return llm
+
+    def _token_ttl(self) -> float:
+        """Сколько секунд осталось жить текущему токену (0, если токена нет)."""
+        if self._token is None:
+            return 0
+        return max(self._token.expires_at / 1000 - time.time(), 0)
+
+    async def _ensure_token(self):
+        if self._token_ttl() > self.refresh_margin:
+            return
+        await self._refresh_token()
+
+    async def _refresh_token(self):
+        async with self._token_lock:
+            # Пока ждали блокировку, токен мог обновить другой запрос
+            if self._token_ttl() > self.refresh_margin:
+                return
+            llm = self._clients[0] if self._clients else self._new_client()
+            token = await llm._client.aget_token()
+            self.token_requests += 1
+            self._set_token(token)
+
+    def _adopt_token(self, llm: GigaChat):
+        """SDK получил новый токен сам (после 401) — он свежее нашего, раздаём его всем клиентам."""
+        token = llm._client._access_token
+        if token is None or token is self._token:
+            return
+        if self._token is None or token.expires_at > self._token.expires_at:
+            self.token_requests += 1
+            self._set_token(token)
+
+    def _set_token(self, token):
+        self._token = token
+        # Остальные клиенты в auth не ходят: используют общий токен, пока пул его не сменит
+        for client in self._clients:
+            client._client._access_token = token
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(max(self._token_ttl() - self.refresh_margin, 1))
+            try:
+                await self._refresh_token()
+            except Exception as e:
+                print(f"[LLM] Ошибка при обновлении токена GigaChat: {e}")
+                await asyncio.sleep(10)
+
+
+gigachat_pool = GigaChatPool(
+    size=GIGACHAT_POOL_SIZE,
+    refresh_margin=GIGACHAT_TOKEN_REFRESH_MARGIN,
+    use_async=LLM_USE_ASYNC
+)
+
+
+class PriorityGate:
+    """
+    Допуск запросов к GigaChat по классам приоритета.
+    Всего одновременно выполняется не больше max_in_flight запросов, каждого класса —
+    не больше limits[класс]. Освободившийся слот достаётся ожидающему запросу самого
+    приоритетного класса, у которого не исчерпан собственный лимит; менее приоритетные
+    классы не обгоняют тех, кто ждёт только общего слота.
+    Очередь каждого класса ограничена capacities[класс]: при переполнении запрос
+    сразу отклоняется с LLMBusyError, а не копит задержку.
+    """
+
+    def __init__(self, max_in_flight: int, limits: dict, capacities: dict):
+        self.max_in_flight = max_in_flight
+        # Порядок ключей limits — порядок приоритета
+        self.priorities = list(limits)
+        self.limits = dict(limits)
+        self.capacities = {p: capacities.get(p, 0) for p in self.priorities}
+        self._waiters = {p: deque() for p in self.priorities}
+        self.in_flight = {p: 0 for p in self.priorities}
+        self.rejected = {p: 0 for p in self.priorities}
+        self.total_in_flight = 0
+        self.max_queued = 0
+
+    async def acquire(self, priority: str):
+        if priority not in self.limits:
+            raise ValueError(f"Неизвестный приоритет запроса к GigaChat: {priority}")
+        waiters = self._waiters[priority]
+        # Свой класс без очереди и есть свободный слот — выполняем сразу
+        if not waiters and self._can_run(priority):
+            self._start(priority)
+            return
+        if len(waiters) >= self.capacities[priority]:
+            self.rejected[priority] += 1
+            llm_rejected.inc(priority=priority)
+            raise LLMBusyError(priority)
+
+        waiter = asyncio.get_running_loop().create_future()
+        waiters.append(waiter)
+        self.max_queued = max(self.max_queued, self.queued())
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже выдан, но запрос отменили — возвращаем его
+                self.release(priority)
+            elif waiter in waiters:
+                waiters.remove(waiter)
+            raise
+
+    def release(self, priority: str):
+        self.in_flight[priority] -= 1
+        self.total_in_flight -= 1
+        self._wake()
+
+    def queued(self, priority: str = None) -> int:
+        if priority is not None:
+            return len(self._waiters[priority])
+        return sum(len(w) for w in self._waiters.values())
+
+    def _can_run(self, priority: str) -> bool:
+        return (
+            self.total_in_flight < self.max_in_flight
+            and self.in_flight[priority] < self.limits[priority]
+        )
+
+    def _start(self, priority: str):
+        self.in_flight[priority] += 1
+        self.total_in_flight += 1
+
+    def _wake(self):
+        for priority in self.priorities:
+            waiters = self._waiters[priority]
+            while waiters and self._can_run(priority):
+                waiter = waiters.popleft()
+                if waiter.done():
+                    # Ожидание отменено, а из очереди его ещё не убрали
+                    continue
+                self._start(priority)
+                waiter.set_result(None)
+            if waiters and self.total_in_flight >= self.max_in_flight:
+                # Общих слотов нет: младшие классы не должны обогнать этот
+                return
+
+
+class LLMExecutor:
+    """
+    Выделенный контур для вызовов GigaChat: допуск по классам приоритета
+    (chat > plan > background) с ограниченной очередью и (если нативный async
+    выключен) собственный пул потоков, не разделяемый с default executor'ом event loop.
+    """
+
+    def __init__(self, max_in_flight: int, use_async: bool,
+                 priority_limits: dict, queue_capacity: dict):
+        self.max_in_flight = max_in_flight
+        self.use_async = use_async
+        self._gate = PriorityGate(max_in_flight, priority_limits, queue_capacity)
+        self._executor = None
+        self.calls = 0
+        self.errors = 0
+
+    def resize(self, max_in_flight: int, priority_limits: dict, queue_capacity: dict):
+        """Меняет лимиты допуска; вызывается до первого запроса."""
+        self.max_in_flight = max_in_flight
+        self._gate = PriorityGate(max_in_flight, priority_limits, queue_capacity)
+
+    @property
+    def queued(self) -> int:
+        return self._gate.queued()
+
+    @property
+    def in_flight(self) -> int:
+        return self._gate.total_in_flight
+
+    @property
+    def max_queued(self) -> int:
+        return self._gate.max_queued
+
+    async def invoke(self, messages: list, priority: str = "chat", **kwargs):
+        await self._enter(priority)
+        started = time.perf_counter()
+        try:
+            async with gigachat_pool.acquire() as llm:
+                if self.use_async:
+                    return await llm.ainvoke(messages, **kwargs)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    self._get_executor(), functools.partial(llm.invoke, messages, **kwargs)
+                )
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            llm_request_seconds.observe(time.perf_counter() - started, method="invoke")
+            self._leave(priority)
+
+    async def stream(self, messages: list, priority: str = "chat", **kwargs):
+        """Потоковый вызов: отдаёт чанки ответа по мере генерации."""
+        await self._enter(priority)
+        started = time.perf_counter()
+        try:
+            async with gigachat_pool.acquire() as llm:
+                async with contextlib.aclosing(llm.astream(messages, **kwargs)) as chunks:
+                    async for chunk in chunks:
+                        yield chunk
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            llm_request_seconds.observe(time.perf_counter() - started, method="stream")
+            self._leave(priority)
+
+    async def _enter(self, priority: str):
+        started = time.perf_counter()
+        await self._gate.acquire(priority)
+        llm_queue_wait_seconds.observe(time.perf_counter() - started, priority=priority)
+
+    def _leave(self, priority: str):
+        self.calls += 1
+        self._gate.release(priority)
+
+    def stats(self) -> dict:
+        gate = self._gate
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "calls": self.calls,
+            "errors": self.errors,
+            "priorities": {
+                p: {
+                    "limit": gate.limits[p],
+                    "in_flight": gate.in_flight[p],
+                    "queued": gate.queued(p),
+                    "rejected": gate.rejected[p],
+                }
+                for p in gate.priorities
+            },
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_in_flight,
+                thread_name_prefix="gigachat"
+            )
+        return self._executor
+
+
+llm_executor = LLMExecutor(
+    max_in_flight=LLM_MAX_IN_FLIGHT,
+    use_async=LLM_USE_ASYNC,
+    priority_limits=LLM_PRIORITY_LIMITS,
+    queue_capacity=LLM_QUEUE_CAPACITY
+)
+
+
+def share_limits(processes: int):
+    """
+    Процесс-воркер (WORKER_PROCESSES > 1) получает 1/processes общих лимитов GigaChat:
+    клиентов пула, одновременных запросов, лимитов и очередей классов приоритета.
+    Так суммарная нагрузка на GigaChat не растёт с числом процессов.
+    """
+    def share(value: int) -> int:
+        return max(1, value // processes) if value else 0
+
+    gigachat_pool.resize(share(GIGACHAT_POOL_SIZE))
+    llm_executor.resize(
+        max_in_flight=share(LLM_MAX_IN_FLIGHT),
+        priority_limits={p: share(limit) for p, limit in LLM_PRIORITY_LIMITS.items()},
+        queue_capacity={p: share(capacity) for p, capacity in LLM_QUEUE_CAPACITY.items()}
+    )
+
+
+registry.gauge("fitai_llm_in_flight", "Запросов к GigaChat в работе", lambda: llm_executor.in_flight)
+registry.gauge("fitai_llm_queued", "Запросов к GigaChat в очереди", lambda: llm_executor.queued)
+registry.counter_from("fitai_llm_errors_total", "Ошибок запросов к GigaChat", lambda: llm_executor.errors)
+registry.counter_from(
+    "fitai_gigachat_token_requests_total", "Запросов access token GigaChat",
+    lambda: gigachat_pool.token_requests
+)
+
+
+async def invoke(messages: list, priority: str = "chat", **kwargs):
+    """
+    Вызов GigaChat клиентом из общего пула с учётом лимитов класса priority
+    ("chat", "plan", "background"); при переполненной очереди — LLMBusyError.
+    kwargs передаются в модель (например, functions=[...] для нативного function calling).
+    """
+    return await llm_executor.invoke(messages, priority=priority, **kwargs)
+
+
+async def stream(messages: list, priority: str = "chat", **kwargs):
+    """
+    Потоковый вызов GigaChat (async-генератор чанков) с теми же лимитами.
+    Потребитель, который может прервать чтение, обязан закрыть генератор
+    (contextlib.aclosing): иначе слот допуска освободится только при сборке мусора.
+    """
+    async with contextlib.aclosing(llm_executor.stream(messages, priority=priority, **kwargs)) as chunks:
+        async for chunk in chunks:
+            yield chunk
@@ -0,0 +1,569 @@
+"""
+Бенчмарки отдельных узлов бота без Telegram и GigaChat.
+Бенчмарки с БД работают с PostgreSQL из config.py (лучше на отдельной базе);
+созданные ими строки удаляются в конце прогона.
+
+    python -m loadtest.benchmarks history --messages 2000 --rounds 200
+    python -m loadtest.benchmarks notifications --rows 1000000
+    python -m loadtest.benchmarks turn-writes --rounds 500
+    python -m loadtest.benchmarks parser --chars 8000 --chunk-chars 8
+    python -m loadtest.benchmarks cluster --workers 1,2,4 --updates 2000
+    python -m loadtest.benchmarks fsm --sessions 100000
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import gc
+import multiprocessing
+import time
+import tracemalloc
+
+from aiogram.methods import SendMessage
+from sqlalchemy import delete, insert, text
+
+import config
+from loadtest.fakes import FakeGigaChat, FakeTelegramSession, parse_latency, percentile
+
+# bot_id ключей FSM бенчмарка fsm (по нему же удаляются его строки)
+_FSM_BOT_ID = 1
+
+# Текст сообщения в синтетической истории (обрезается до --message-chars)
+_SAMPLE_TEXT = "Сделал сегодня три подхода приседаний и планку, что добавить на завтра? " * 40
+
+
+async def _timed(coro) -> float:
+    started = time.perf_counter()
+    await coro
+    return time.perf_counter() - started
+
+
+def _report(title: str, timings: list):
+    ordered = sorted(timings)
+    print(f"{title:<34}{len(ordered):>8}"
+          f"{percentile(ordered, 50) * 1000:>10.2f}{percentile(ordered, 95) * 1000:>10.2f}"
+          f"{percentile(ordered, 99) * 1000:>10.2f}")
+
+
+def _report_header():
+    print(f"{'операция':<34}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+
+
+async def _create_user(tg_id: int):
+    from db import AsyncSessionLocal, User
+    async with AsyncSessionLocal() as db_session:
+        user = User(tg_id=tg_id, name="Бенчмарк", age=30, sex="Мужской", timezone="Europe/Moscow")
+        db_session.add(user)
+        await db_session.commit()
+    return user
+
+
+async def _create_users(first_tg_id: int, count: int) -> list:
+    from db import AsyncSessionLocal, User
+    async with AsyncSessionLocal() as db_session:
+        user_ids = (await db_session.execute(
+            insert(User).returning(User.id),
+            [{"tg_id": first_tg_id + i, "name": "Бенчмарк", "age": 30, "sex": "Мужской",
+              "timezone": "Europe/Moscow"} for i in range(count)]
+        )).scalars().all()
+        await db_session.commit()
+    return list(user_ids)
+
+
+async def _drop_users(user_ids: list):
+    """Удаляет тестовых пользователей вместе с их строками."""
+    from db import AsyncSessionLocal, ConversationSummary, MessageLog, Notification, User
+    async with AsyncSessionLocal() as db_session:
+        for model in (MessageLog, Notification, ConversationSummary):
+            await db_session.execute(delete(model).where(model.user_id.in_(user_ids)))
+        await db_session.execute(delete(User).where(User.id.in_(user_ids)))
+        await db_session.commit()
+
+
+async def bench_history(args):
+    """
+    Загрузка истории диалога на каждом ходе: полная перезагрузка с конвертацией
+    (как до кэша), попадание в кэш с дочитыванием хвоста и промах кэша.
+    """
+    from sqlalchemy import select
+    from config import HISTORY_CACHE_MAX_BYTES
+    from db import AsyncSessionLocal, MessageLog
+    from history.manager import HistoryCache, to_langchain_message
+
+    async def load_uncached(user_id: int):
+        async with AsyncSessionLocal() as db_session:
+            rows = (await db_session.execute(
+                select(MessageLog).where(MessageLog.user_id == user_id).order_by(MessageLog.id.asc())
+            )).scalars().all()
+        return [to_langchain_message(m) for m in rows]
+
+    user = await _create_user(args.tg_id)
+    try:
+        text = _SAMPLE_TEXT[:args.message_chars]
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(insert(MessageLog), [
+                {"user_id": user.id, "role": "user" if i % 2 == 0 else "assistant", "content": text}
+                for i in range(args.messages)
+            ])
+            await db_session.commit()
+
+        cache = HistoryCache(max_users=1, max_bytes=HISTORY_CACHE_MAX_BYTES)
+        await cache.get_with_ids(user.id)
+        uncached, hits, misses = [], [], []
+        for _ in range(args.rounds):
+            # Новый ход: сообщение сохраняется и пишется в кэш (write-through), как в FitAI
+            async with AsyncSessionLocal() as db_session:
+                row = MessageLog(user_id=user.id, role="user", content=text)
+                db_session.add(row)
+                await db_session.commit()
+            cache.append(user.id, row)
+
+            uncached.append(await _timed(load_uncached(user.id)))
+            hits.append(await _timed(cache.get_with_ids(user.id)))
+            cache.invalidate(user.id)
+            misses.append(await _timed(cache.get_with_ids(user.id)))
+
+        print(f"История: {args.messages}+ сообщений по {args.message_chars} символов")
+        _report_header()
+        _report("без кэша (полная загрузка)", uncached)
+        _report("кэш, попадание (хвост)", hits)
+        _report("кэш, промах", misses)
+    finally:
+        await _drop_users([user.id])
+
+
+async def bench_notifications(args):
+    """
+    Старт бота при большой таблице notifications: восстановление задач
+    (режим "apscheduler"), пополнение окна (режим "window") и очистка старых строк.
+    Большая часть строк — давно отправленные уведомления, будущих — доля --future.
+    """
+    from config import NOTIFICATION_RETENTION_DAYS
+    from db import AsyncSessionLocal
+    from notifications.manager import (
+        NotificationDispatcher, purge_old_notifications, schedule_existing_notifications, scheduler
+    )
+
+    user_ids = await _create_users(args.tg_id, args.users)
+    try:
+        started = time.perf_counter()
+        future_per_mille = int(args.future * 1000)
+        async with AsyncSessionLocal() as db_session:
+            # Строки генерирует сама БД: вставка миллиона строк из Python заняла бы минуты
+            await db_session.execute(text("""
+                INSERT INTO notifications (user_id, time_utc, message, kind, sent_at, created_at)
+                SELECT ids[1 + g % cardinality(ids)],
+                       CASE WHEN g % 1000 < :future
+                            THEN now_utc + make_interval(secs => 60 + g * 7919 % (30 * 86400))
+                            ELSE now_utc - make_interval(secs => 3600 + g * 7919 % (90 * 86400)) END,
+                       'Время тренировки!', 'regular',
+                       CASE WHEN g % 1000 < :future THEN NULL
+                            ELSE now_utc - make_interval(secs => 3600 + g * 7919 % (90 * 86400)) END,
+                       now_utc
+                FROM generate_series(1, CAST(:rows AS bigint)) AS g,
+                     (SELECT CAST(:user_ids AS integer[]) AS ids,
+                             timezone('utc', now()) AS now_utc) AS params
+            """), {"rows": args.rows, "future": future_per_mille, "user_ids": user_ids})
+            await db_session.commit()
+            await db_session.execute(text("ANALYZE notifications"))
+        print(f"Уведомления: {args.rows} строк у {args.users} пользователей, "
+              f"будущих ~{args.future:.0%} (вставка {time.perf_counter() - started:.1f} с)")
+
+        restore = []
+        for _ in range(args.rounds):
+            restore.append(await _timed(schedule_existing_notifications()))
+            restored = len(scheduler.get_jobs())
+            scheduler.remove_all_jobs()
+
+        tracemalloc.start()
+        await schedule_existing_notifications()
+        _, restore_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        scheduler.remove_all_jobs()
+
+        dispatcher = NotificationDispatcher(window=300, refill_interval=60, grace=60)
+        refill = [await _timed(dispatcher.refill()) for _ in range(args.rounds)]
+        window_size = dispatcher.stats()["window_size"]
+
+        _report_header()
+        _report("восстановление задач", restore)
+        _report("пополнение окна", refill)
+        purge = await _timed(purge_old_notifications())
+        _report(f"очистка старше {NOTIFICATION_RETENTION_DAYS} дн.", [purge])
+        print(f"Восстановлено задач: {restored}, пик памяти: {restore_peak / 2 ** 20:.1f} МиБ; "
+              f"в окне 5 минут: {window_size}")
+    finally:
+        await _drop_users(user_ids)
+
+
+async def bench_turn_writes(args):
+    """
+    Запись сообщений одного хода с вызовом функции (сообщение пользователя,
+    JSON вызова, запись функции, итоговый ответ): коммит на каждое сообщение
+    (как было) против буфера хода FitAI с одним коммитом.
+    """
+    from sqlalchemy import event
+    from db import AsyncSessionLocal, MessageLog, async_engine
+    from fit_ai import FitAI
+
+    commits = 0
+
+    def count_commit(conn):
+        nonlocal commits
+        commits += 1
+
+    turn = [
+        ("user", "Напомни завтра в 7:00 про тренировку", None, None),
+        ("assistant", '[{"name": "create_notification", "parameters": {}}]', None, None),
+        ("function", "Уведомление создано", "create_notification", "{}"),
+        ("assistant", "Готово, напомню завтра в 7:00.", None, None),
+    ]
+
+    async def per_message(user_id: int):
+        for role, content, function_name, function_args in turn:
+            async with AsyncSessionLocal() as db_session:
+                db_session.add(MessageLog(user_id=user_id, role=role, content=content,
+                                          function_name=function_name, function_args=function_args))
+                await db_session.commit()
+
+    async def unit_of_work(ai: FitAI):
+        for role, content, function_name, function_args in turn:
+            await ai._save_message(role, content, function_name=function_name, function_args=function_args)
+        await ai._flush_messages()
+
+    user = await _create_user(args.tg_id)
+    event.listen(async_engine.sync_engine, "commit", count_commit)
+    try:
+        ai = FitAI(user.tg_id, user=user)
+        results = []
+        for title, make_turn in (("коммит на сообщение", lambda: per_message(user.id)),
+                                 ("один коммит на ход", lambda: unit_of_work(ai))):
+            commits = 0
+            timings = [await _timed(make_turn()) for _ in range(args.rounds)]
+            results.append((title, timings, commits / args.rounds))
+
+        print(f"Запись хода из {len(turn)} сообщений, {args.rounds} ходов")
+        _report_header()
+        for title, timings, _ in results:
+            _report(title, timings)
+        for title, _, per_turn in results:
+            print(f"{title}: коммитов на ход {per_turn:.1f}")
+    finally:
+        event.remove(async_engine.sync_engine, "commit", count_commit)
+        await _drop_users([user.id])
+
+
+async def bench_parser(args):
+    """
+    Разбор потокового ответа FunctionCallExtractor так, как это делает
+    FitAI._complete: feed на каждый кусок и проверка is_function_call.
+    Время на ответ должно расти линейно с его длиной.
+    """
+    from function_calling.parser import FunctionCallExtractor
+
+    call = '{"name": "create_notification", "parameters": {"user_id": "1", "message": "%s"}}'
+    replies = {
+        "обычный текст": (_SAMPLE_TEXT * (args.chars // len(_SAMPLE_TEXT) + 1))[:args.chars],
+        "вызов функции (```json)": "```json\n" + call % ("x" * args.chars) + "\n```",
+    }
+
+    def parse(reply: str):
+        extractor = FunctionCallExtractor()
+        for i in range(0, len(reply), args.chunk_chars):
+            extractor.feed(reply[i:i + args.chunk_chars])
+            extractor.is_function_call
+        return extractor.finish()
+
+    print(f"Потоковый ответ ~{args.chars} символов кусками по {args.chunk_chars}")
+    _report_header()
+    for title, reply in replies.items():
+        timings = []
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            parse(reply)
+            timings.append(time.perf_counter() - started)
+        _report(title, timings)
+
+
+async def _abandon_registrations(storage, first_tg_id: int, count: int, concurrency: int):
+    """count пользователей дошли в регистрации до шага «вес» и ушли."""
+    from aiogram.fsm.storage.base import StorageKey
+
+    async def abandon(tg_id: int):
+        key = StorageKey(bot_id=_FSM_BOT_ID, chat_id=tg_id, user_id=tg_id)
+        await storage.set_state(key, "RegistrationForm:weight")
+        await storage.set_data(key, {"name": "Бенчмарк Тестович", "age": 30, "sex": "Мужской"})
+
+    for start in range(0, count, concurrency):
+        await asyncio.gather(*(
+            abandon(first_tg_id + i) for i in range(start, min(start + concurrency, count))
+        ))
+
+
+async def bench_fsm(args):
+    """
+    Брошенные регистрации: --sessions пользователей дошли до шага «вес» и ушли.
+    MemoryStorage держит их в памяти процесса до перезапуска; DBStorage в памяти
+    не держит ничего, а хранит строки fsm_states (таблица с индексами на диске),
+    которые снимает purge после FSM_STATE_TTL_HOURS.
+    """
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    from config import FSM_STATE_TTL_HOURS
+    from db import AsyncSessionLocal, FSMStateEntry, async_engine
+    from fsm.manager import DBStorage, _storage_key
+
+    async def table_size() -> int:
+        async with AsyncSessionLocal() as db_session:
+            return (await db_session.execute(
+                text("SELECT pg_total_relation_size('fsm_states')")
+            )).scalar_one()
+
+    async def traced(coro) -> int:
+        """Сколько памяти осталось занято после coro."""
+        gc.collect()
+        tracemalloc.start()
+        await coro
+        gc.collect()
+        used, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return used
+
+    sample = min(args.sample, args.sessions)
+    bench_rows = FSMStateEntry.key.like(f"{_FSM_BOT_ID}:%")
+    print(f"Брошенных регистраций: {args.sessions}")
+    print(f"{'хранилище':<14}{'память, МиБ':>13}{'байт/сессию':>13}{'диск, МиБ':>11}{'байт/сессию':>13}")
+
+    memory_storage = MemoryStorage()
+    memory_used = await traced(_abandon_registrations(memory_storage, args.tg_id, args.sessions, args.concurrency))
+    print(f"{'MemoryStorage':<14}{memory_used / 2 ** 20:>13.1f}{memory_used / args.sessions:>13.0f}"
+          f"{'—':>11}{'—':>13}")
+    del memory_storage
+
+    db_storage = DBStorage(ttl_hours=FSM_STATE_TTL_HOURS)
+    # Место от удалённых строк прошлых прогонов исказило бы прирост размера таблицы
+    async with async_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM FULL fsm_states"))
+    size_before = await table_size()
+    try:
+        # Через API пишем --sample сессий; остальные строки того же вида генерирует сама БД
+        # (запись 100 тысяч сессий по одной заняла бы десятки минут)
+        memory_used = await traced(_abandon_registrations(db_storage, args.tg_id, sample, args.concurrency))
+        key_template = _storage_key(StorageKey(bot_id=_FSM_BOT_ID, chat_id=-1, user_id=-1))
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(text("""
+                INSERT INTO fsm_states (key, state, data, updated_at)
+                SELECT replace(:template, '-1', CAST(:first + g AS text)), s.state, s.data, s.updated_at
+                FROM generate_series(CAST(:sample AS bigint), CAST(:sessions AS bigint) - 1) AS g,
+                     (SELECT state, data, updated_at FROM fsm_states WHERE key = :sample_key) AS s
+            """), {
+                "template": key_template, "first": args.tg_id, "sample": sample, "sessions": args.sessions,
+                "sample_key": key_template.replace("-1", str(args.tg_id)),
+            })
+            await db_session.commit()
+        disk_used = await table_size() - size_before
+        print(f"{'DBStorage':<14}{memory_used / 2 ** 20:>13.1f}{'—':>13}"
+              f"{disk_used / 2 ** 20:>11.1f}{disk_used / args.sessions:>13.0f}")
+        print(f"Память DBStorage — остаток после {sample} записей через API (кэши SQLAlchemy и пула, "
+              f"от числа сессий не растёт).")
+
+        # Состояния «устаревают», и их снимает периодическая очистка
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                FSMStateEntry.__table__.update().where(bench_rows).values(
+                    updated_at=FSMStateEntry.updated_at - datetime.timedelta(hours=FSM_STATE_TTL_HOURS + 1)
+                )
+            )
+            await db_session.commit()
+        purge = await _timed(db_storage.purge())
+        print(f"Очистка {args.sessions} просроченных состояний: {purge * 1000:.0f} мс")
+    finally:
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(delete(FSMStateEntry).where(bench_rows))
+            await db_session.commit()
+
+
+class _CountingSession(FakeTelegramSession):
+    """Bot API процесса-воркера: отправленные сообщения считаются в общем для процессов счётчике."""
+
+    def __init__(self, latency, replies):
+        super().__init__(latency)
+        self.replies = replies
+
+    async def make_request(self, bot, method, timeout=None):
+        result = await super().make_request(bot, method, timeout)
+        if isinstance(method, SendMessage):
+            with self.replies.get_lock():
+                self.replies.value += 1
+        return result
+
+
+def _cluster_worker(settings: dict, fakes: dict, ready, replies, index: int, worker_queue):
+    """
+    Процесс-воркер бенчмарка cluster: настоящий main.run_worker, но Bot API
+    и GigaChat подменены заглушками. Настройки применяются до импорта бота.
+    """
+    for name, value in settings.items():
+        setattr(config, name, value)
+    import llm.manager
+    import main
+
+    llm_latency = parse_latency(fakes["llm_latency"])
+    llm.manager._build_client = lambda: FakeGigaChat(llm_latency, reply_chars=fakes["reply_chars"])
+    main.bot.session = _CountingSession(parse_latency(fakes["telegram_latency"]), replies)
+
+    start_services = main.start_services
+
+    async def start_and_report(**kwargs):
+        await start_services(**kwargs)
+        with ready.get_lock():
+            ready.value += 1
+
+    main.start_services = start_and_report
+    main.run_worker(index, worker_queue)
+
+
+def _chat_update(update_id: int, tg_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(datetime.datetime.now(datetime.timezone.utc).timestamp()),
+            "chat": {"id": tg_id, "type": "private"},
+            "from": {"id": tg_id, "is_bot": False, "first_name": "bench"},
+            "text": "/chat Как правильно делать приседания?",
+        },
+    }
+
+
+async def bench_cluster(args):
+    """
+    Пропускная способность (апдейтов в секунду) при 1..N процессах-воркерах:
+    супервизор раздаёт апдейты /chat настоящим воркерам (main.run_worker)
+    с заглушками Bot API и GigaChat. Нагрузка замкнутая: в работе не больше
+    --concurrency апдейтов, следующий уходит после ответа бота. Каждый апдейт —
+    от своего пользователя, чтобы ходы не склеивались очередью диалога.
+    Суммарные лимиты GigaChat от числа воркеров не зависят (share_limits).
+    """
+    from cluster.manager import Supervisor
+
+    settings = {
+        name: getattr(config, name)
+        for name in ("SQLALCHEMY_ASYNC_DATABASE_URI", "TELEGRAM_BOT_TOKEN")
+    }
+    settings.update(debug_mode=False, METRICS_ENABLED=False, STREAM_REPLIES=False, DIALOG_DEBOUNCE_SECONDS=0)
+    fakes = {
+        "llm_latency": args.llm_latency,
+        "telegram_latency": args.telegram_latency,
+        "reply_chars": args.reply_chars,
+    }
+    user_ids = await _create_users(args.tg_id, args.updates)
+    context = multiprocessing.get_context("spawn")
+    print(f"Апдейтов /chat: {args.updates}, в работе одновременно: {args.concurrency}, "
+          f"GigaChat: {args.llm_latency}")
+    print(f"{'воркеров':<10}{'время, с':>10}{'апдейтов/с':>12}{'ускорение':>12}")
+    baseline = None
+    try:
+        for workers in args.workers:
+            ready = context.Value("i", 0)
+            replies = context.Value("i", 0)
+            target = functools.partial(
+                _cluster_worker, dict(settings, WORKER_PROCESSES=workers), fakes, ready, replies
+            )
+            supervisor = Supervisor(workers, config.WORKER_QUEUE_SIZE, target=target)
+            supervisor.start()
+            try:
+                # Запуск воркеров (миграции, прогрев пулов) в замер не входит
+                while ready.value < workers:
+                    await asyncio.sleep(0.05)
+                started = time.perf_counter()
+                for i in range(args.updates):
+                    while i - replies.value >= args.concurrency:
+                        await asyncio.sleep(0.001)
+                    await supervisor.route(_chat_update(i + 1, args.tg_id + i))
+                while replies.value < args.updates:
+                    await asyncio.sleep(0.001)
+                elapsed = time.perf_counter() - started
+            finally:
+                await asyncio.to_thread(supervisor.stop)
+            throughput = args.updates / elapsed
+            baseline = baseline or throughput
+            print(f"{workers:<10}{elapsed:>10.2f}{throughput:>12.1f}{throughput / baseline:>12.2f}")
+            # Следующий прогон — с пустой историей у тех же пользователей
+            await _clear_messages(user_ids)
+    finally:
+        await _drop_users(user_ids)
+
+
+async def _clear_messages(user_ids: list):
+    from db import AsyncSessionLocal, MessageLog
+    async with AsyncSessionLocal() as db_session:
+        await db_session.execute(delete(MessageLog).where(MessageLog.user_id.in_(user_ids)))
+        await db_session.commit()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарки узлов FitAI")
+    parser.add_argument("--tg-id", type=int, default=2_000_000_000 - 2_000_000,
+                        help="tg_id первого тестового пользователя")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    history = commands.add_parser("history", help="загрузка истории диалога (кэш истории)")
+    history.add_argument("--messages", type=int, default=2000, help="сообщений в истории")
+    history.add_argument("--message-chars", type=int, default=300, help="длина сообщения")
+    history.add_argument("--rounds", type=int, default=200, help="число замеров")
+    history.set_defaults(func=bench_history, uses_db=True)
+
+    notifications = commands.add_parser("notifications", help="восстановление уведомлений при старте")
+    notifications.add_argument("--rows", type=int, default=1_000_000, help="строк в notifications")
+    notifications.add_argument("--users", type=int, default=1000, help="пользователей")
+    notifications.add_argument("--future", type=float, default=0.05,
+                               help="доля ещё не наступивших уведомлений")
+    notifications.add_argument("--rounds", type=int, default=5, help="число замеров")
+    notifications.set_defaults(func=bench_notifications, uses_db=True)
+
+    turn_writes = commands.add_parser("turn-writes", help="запись сообщений хода в message_logs")
+    turn_writes.add_argument("--rounds", type=int, default=500, help="число ходов")
+    turn_writes.set_defaults(func=bench_turn_writes, uses_db=True)
+
+    parser_bench = commands.add_parser("parser", help="разбор вызовов функций из потокового ответа")
+    parser_bench.add_argument("--chars", type=int, default=8000, help="длина ответа")
+    parser_bench.add_argument("--chunk-chars", type=int, default=8, help="длина куска потока")
+    parser_bench.add_argument("--rounds", type=int, default=50, help="число замеров")
+    parser_bench.set_defaults(func=bench_parser, uses_db=False)
+
+    fsm = commands.add_parser("fsm", help="память на брошенные регистрации: MemoryStorage и DBStorage")
+    fsm.add_argument("--sessions", type=int, default=100_000, help="брошенных регистраций")
+    fsm.add_argument("--sample", type=int, default=1000, help="сессий, записанных в DBStorage через API")
+    fsm.add_argument("--concurrency", type=int, default=10, help="одновременных записей в хранилище")
+    fsm.set_defaults(func=bench_fsm, uses_db=True)
+
+    cluster = commands.add_parser("cluster", help="масштабирование по процессам-воркерам")
+    cluster.add_argument("--workers", type=lambda v: [int(n) for n in v.split(",")], default=[1, 2, 4],
+                         help="числа процессов через запятую")
+    cluster.add_argument("--updates", type=int, default=2000, help="апдейтов /chat на прогон")
+    cluster.add_argument("--concurrency", type=int, default=64, help="апдейтов в работе одновременно")
+    cluster.add_argument("--llm-latency", default="const:0.02", help="время ответа GigaChat")
+    cluster.add_argument("--telegram-latency", default="const:0.005", help="время запроса к Bot API")
+    cluster.add_argument("--reply-chars", type=int, default=1500, help="длина ответа модели")
+    cluster.set_defaults(func=bench_cluster, uses_db=True)
+
+    return parser.parse_args()
+
+
+async def main():
+    args = _parse_args()
+    if args.uses_db:
+        from db import async_engine, init_db_async
+        await init_db_async()
+    try:
+        await args.func(args)
+    finally:
+        if args.uses_db:
+            await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
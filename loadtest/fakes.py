@@ -0,0 +1,233 @@
+import asyncio
+import contextvars
+import datetime
+import itertools
+import math
+import random
+import re
+import time
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# Текущий измеряемый запрос: стадии (llm, db, telegram) пишут в него своё время.
+# Контекст копируется в задачи, созданные обработчиком (очередь ходов, summary),
+# поэтому время попадает в тот запрос, который его породил.
+_current_trace = contextvars.ContextVar("loadtest_trace", default=None)
+
+
+class RequestTrace:
+    """Время одного запроса по стадиям."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    @property
+    def total(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+
+def start_trace(kind: str) -> RequestTrace:
+    trace = RequestTrace(kind)
+    _current_trace.set(trace)
+    return trace
+
+
+def record_stage(stage: str, seconds: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+def percentile(values: list, p: float) -> float:
+    """Перцентиль по методу ближайшего ранга (values отсортирован)."""
+    if not values:
+        return 0.0
+    rank = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def parse_latency(spec: str):
+    """
+    Распределение задержки (в секундах) из строки:
+      const:0.5            — всегда 0.5
+      uniform:0.5:2        — равномерно от 0.5 до 2
+      exp:1.0              — экспоненциальное со средним 1.0
+      lognormal:1.5:0.5    — логнормальное с медианой 1.5 и sigma 0.5
+    """
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "const":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "exp":
+        return lambda: random.expovariate(1 / args[0]) if args[0] > 0 else 0.0
+    if kind == "lognormal":
+        mu = 0.0 if args[0] <= 0 else math.log(args[0])
+        return lambda: random.lognormvariate(mu, args[1]) if args[0] > 0 else 0.0
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Сессия aiogram вместо HTTP к Bot API: каждый метод «выполняется» с заданной
+    задержкой, отправленные сообщения складываются в очередь своего чата,
+    а скачивание файла возвращает заготовленные байты.
+    """
+
+    def __init__(self, latency, file_content: bytes = b"\x89PNG\r\n\x1a\n" + bytes(64 * 1024)):
+        super().__init__()
+        self.latency = latency
+        # Содержимое любого скачиваемого файла (по умолчанию — 64 КиБ «PNG»)
+        self.file_content = file_content
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+        self._replies = {}
+
+    async def make_request(self, bot, method, timeout=None):
+        delay = self.latency()
+        started = time.perf_counter()
+        await asyncio.sleep(delay)
+        record_stage("telegram", time.perf_counter() - started)
+        self.requests += 1
+
+        if isinstance(method, SendMessage):
+            self._reply_queue(method.chat_id).put_nowait(method.text)
+        if method.__returning__ is Message:
+            chat_id = getattr(method, "chat_id", None) or 0
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.datetime.now(datetime.timezone.utc),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, "text", None)
+            ).as_(bot)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        """Скачивание файла (bot.download_file): отдаёт file_content кусками chunk_size."""
+        delay = self.latency()
+        started = time.perf_counter()
+        await asyncio.sleep(delay)
+        record_stage("telegram", time.perf_counter() - started)
+        self.requests += 1
+        for i in range(0, len(self.file_content), chunk_size):
+            yield self.file_content[i:i + chunk_size]
+
+    async def close(self):
+        pass
+
+    def drain(self, chat_id: int):
+        """Отбрасывает уже полученные, но не прочитанные сообщения чата."""
+        queue = self._reply_queue(chat_id)
+        while not queue.empty():
+            queue.get_nowait()
+
+    async def next_reply(self, chat_id: int) -> str:
+        """Ждёт следующее сообщение, отправленное ботом в чат chat_id."""
+        return await self._reply_queue(chat_id).get()
+
+    def _reply_queue(self, chat_id: int) -> asyncio.Queue:
+        queue = self._replies.get(chat_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._replies[chat_id] = queue
+        return queue
+
+
+class _FakeToken:
+    def __init__(self, ttl: int):
+        self.access_token = "loadtest"
+        self.expires_at = int((time.time() + ttl) * 1000)
+
+
+class _FakeGigaChatClient:
+    """Заглушка SDK-клиента: пул берёт у него токен и подставляет _access_token."""
+
+    def __init__(self):
+        self._access_token = None
+
+    def get_token(self):
+        return _FakeToken(ttl=30 * 60)
+
+    async def aget_token(self):
+        return self.get_token()
+
+
+_USER_ID_RE = re.compile(r"user_id: (\d+)")
+_REMINDER_WORDS = ("напомни", "напоминание")
+
+
+class FakeGigaChat:
+    """
+    Локальная модель с тем же интерфейсом, что использует llm.manager
+    (invoke / ainvoke / astream и _client.get_token). Время ответа берётся
+    из распределения latency; на просьбы о напоминании отвечает нативным
+    вызовом create_notification.
+    """
+
+    def __init__(self, latency, reply_chars: int = 1500, stream_chunks: int = 20):
+        self.latency = latency
+        self.reply_chars = reply_chars
+        self.stream_chunks = stream_chunks
+        self._client = _FakeGigaChatClient()
+
+    async def aget_models(self):
+        """Прогрев соединения в пуле: сети нет, поэтому сразу."""
+        return []
+
+    def get_models(self):
+        return []
+
+    async def ainvoke(self, messages, **kwargs):
+        started = time.perf_counter()
+        await asyncio.sleep(self.latency())
+        record_stage("llm", time.perf_counter() - started)
+        return self._answer(messages, **kwargs)
+
+    def invoke(self, messages, **kwargs):
+        started = time.perf_counter()
+        time.sleep(self.latency())
+        record_stage("llm", time.perf_counter() - started)
+        return self._answer(messages, **kwargs)
+
+    async def astream(self, messages, **kwargs):
+        answer = self._answer(messages, **kwargs)
+        delay = self.latency() / self.stream_chunks
+        step = max(len(answer.content) // self.stream_chunks, 1)
+        for i in range(self.stream_chunks):
+            started = time.perf_counter()
+            await asyncio.sleep(delay)
+            record_stage("llm", time.perf_counter() - started)
+            chunk = answer.content[i * step:(i + 1) * step if i < self.stream_chunks - 1 else None]
+            last = i == self.stream_chunks - 1
+            yield AIMessageChunk(
+                content=chunk,
+                additional_kwargs=answer.additional_kwargs if last else {},
+                response_metadata=answer.response_metadata if last else {}
+            )
+
+    def _answer(self, messages, functions=None, **kwargs) -> AIMessage:
+        last = messages[-1].content if messages else ""
+        if functions and any(word in last.lower() for word in _REMINDER_WORDS):
+            system = messages[0].content if messages else ""
+            match = _USER_ID_RE.search(system)
+            when = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+            return AIMessage(content="", additional_kwargs={"function_call": {
+                "name": "create_notification",
+                "arguments": {
+                    "user_id": match.group(1) if match else "0",
+                    "message": "Время тренировки!",
+                    "time": when.isoformat(),
+                },
+            }}, response_metadata={"finish_reason": "function_call"})
+        text = ("Тренируйтесь регулярно и следите за питанием. " * 64)[:self.reply_chars]
+        return AIMessage(content=text, response_metadata={"finish_reason": "stop"})
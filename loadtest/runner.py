@@ -0,0 +1,225 @@
+"""
+Нагрузочный прогон бота без сети: настоящий dp из init_bot получает
+синтетические апдейты от N пользователей (регистрация, /chat, /meal_plan,
+/workout_plan, просьбы о напоминании), Bot API и GigaChat подменены
+локальными заглушками с настраиваемой задержкой, БД — настоящая (config.py).
+
+Запуск (лучше на отдельной базе — тестовые пользователи остаются в ней):
+    python -m loadtest.runner --users 200 --turns 5 --llm-latency lognormal:2:0.5
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import random
+import time
+
+from aiogram.types import CallbackQuery, Chat, Message, Update, User as TgUser
+from sqlalchemy import event
+
+import handlers.menu
+import llm.manager
+from cache.manager import response_cache
+from db import async_engine, init_db_async
+from dialog.manager import dialog_dispatcher
+from handlers.menu import menu_router
+from handlers.registration import registration_router
+from history.compaction import summary_manager
+from history.manager import history_cache
+from init_bot import bot, dp
+from profiles.manager import profile_cache
+from loadtest.fakes import (
+    FakeGigaChat, FakeTelegramSession, parse_latency, percentile, record_stage, start_trace
+)
+
+STAGES = ("llm", "db", "telegram")
+
+# Шаги диалога после регистрации: (вид запроса, текст, вес в смеси)
+SCENARIO_MIX = (
+    ("chat", "/chat Как правильно делать приседания?", 60),
+    ("reminder", "/chat Напомни мне завтра в 9 утра о тренировке", 15),
+    ("meal_plan", "/meal_plan", 15),
+    ("workout_plan", "/workout_plan", 10),
+)
+
+REGISTRATION = (
+    ("message", "/start"),
+    ("message", "Нагрузочный Тест"),
+    ("message", "30"),
+    ("callback", "sex_Мужской"),
+    ("message", "80"),
+    ("message", "180"),
+    ("callback", "goal_Похудеть"),
+    ("callback", "skill_Новичок"),
+    ("callback", "tz_Europe/Moscow"),
+)
+
+
+def _instrument_db():
+    """Время SQL-запросов записываем в стадию db текущего запроса."""
+
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("loadtest_started", []).append(time.perf_counter())
+
+    @event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["loadtest_started"].pop()
+        record_stage("db", time.perf_counter() - started)
+
+
+class LoadTest:
+    def __init__(self, session: FakeTelegramSession, users: int, turns: int,
+                 tg_id_base: int, ramp: float, think, timeout: float):
+        self.session = session
+        self.users = users
+        self.turns = turns
+        self.tg_id_base = tg_id_base
+        self.ramp = ramp
+        self.think = think
+        self.timeout = timeout
+        self.traces = []
+        self.timeouts = 0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    async def run(self) -> float:
+        started = time.perf_counter()
+        await asyncio.gather(*(self._simulate_user(i) for i in range(self.users)))
+        return time.perf_counter() - started
+
+    async def _simulate_user(self, index: int):
+        tg_id = self.tg_id_base + index
+        await asyncio.sleep(random.uniform(0, self.ramp))
+        for kind, payload in REGISTRATION:
+            if kind == "message":
+                await self._step("registration", tg_id, self._message_update(tg_id, payload))
+            else:
+                await self._step("registration", tg_id, self._callback_update(tg_id, payload))
+
+        kinds = [k for k, _, _ in SCENARIO_MIX]
+        texts = {k: t for k, t, _ in SCENARIO_MIX}
+        weights = [w for _, _, w in SCENARIO_MIX]
+        for _ in range(self.turns):
+            await asyncio.sleep(self.think())
+            kind = random.choices(kinds, weights=weights)[0]
+            await self._step(kind, tg_id, self._message_update(tg_id, texts[kind]))
+
+    async def _step(self, kind: str, tg_id: int, update: Update):
+        self.session.drain(tg_id)
+        trace = start_trace(kind)
+        await dp.feed_update(bot, update)
+        try:
+            await asyncio.wait_for(self.session.next_reply(tg_id), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return
+        trace.finished = time.perf_counter()
+        self.traces.append(trace)
+
+    def _tg_user(self, tg_id: int) -> TgUser:
+        return TgUser(id=tg_id, is_bot=False, first_name=f"load{tg_id}")
+
+    def _message(self, tg_id: int, text: str) -> Message:
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.datetime.now(datetime.timezone.utc),
+            chat=Chat(id=tg_id, type="private"),
+            from_user=self._tg_user(tg_id),
+            text=text
+        )
+
+    def _message_update(self, tg_id: int, text: str) -> Update:
+        return Update(update_id=next(self._update_ids), message=self._message(tg_id, text))
+
+    def _callback_update(self, tg_id: int, data: str) -> Update:
+        callback = CallbackQuery(
+            id=str(next(self._update_ids)),
+            from_user=self._tg_user(tg_id),
+            chat_instance=str(tg_id),
+            data=data,
+            message=self._message(tg_id, "")
+        )
+        return Update(update_id=next(self._update_ids), callback_query=callback)
+
+    def report(self, elapsed: float):
+        print(f"Запросов: {len(self.traces)} за {elapsed:.1f} с, "
+              f"пропускная способность: {len(self.traces) / elapsed:.1f} запросов/с, "
+              f"таймаутов: {self.timeouts}")
+        header = f"{'запрос':<14}{'кол-во':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+        header += "".join(f"{s:>10}" for s in STAGES) + f"{'прочее':>10}"
+        print(header)
+        by_kind = {}
+        for trace in self.traces:
+            by_kind.setdefault(trace.kind, []).append(trace)
+        for kind, traces in sorted(by_kind.items()):
+            totals = sorted(t.total for t in traces)
+            means = {s: sum(t.stages.get(s, 0.0) for t in traces) / len(traces) for s in STAGES}
+            other = sum(totals) / len(totals) - sum(means.values())
+            line = (f"{kind:<14}{len(traces):>8}{percentile(totals, 50):>9.3f}"
+                    f"{percentile(totals, 95):>9.3f}{percentile(totals, 99):>9.3f}")
+            line += "".join(f"{means[s]:>10.3f}" for s in STAGES) + f"{other:>10.3f}"
+            print(line)
+        print("Стадии — среднее время на запрос (с); «прочее» — очередь ходов, debounce, CPU.")
+        print(f"LLM: {llm.manager.llm_executor.stats()}")
+        print(f"Пул GigaChat: {llm.manager.gigachat_pool.stats()}")
+        print(f"Очередь ходов: {dialog_dispatcher.stats()}")
+        print(f"Кэш истории: {history_cache.stats()}")
+        print(f"Summary: {summary_manager.stats()}")
+        print(f"Кэш планов: {response_cache.stats()}")
+        print(f"Кэш профилей: {profile_cache.stats()}")
+        print(f"Запросов к Bot API: {self.session.requests}")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон FitAI с заглушками Telegram и GigaChat")
+    parser.add_argument("--users", type=int, default=100, help="число пользователей")
+    parser.add_argument("--turns", type=int, default=5, help="запросов к FitAI на пользователя после регистрации")
+    parser.add_argument("--ramp", type=float, default=10.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think", default="exp:2", help="пауза пользователя между запросами")
+    parser.add_argument("--llm-latency", default="lognormal:2:0.5", help="время ответа GigaChat")
+    parser.add_argument("--telegram-latency", default="const:0.05", help="время запроса к Bot API")
+    parser.add_argument("--reply-chars", type=int, default=1500, help="длина ответа модели")
+    parser.add_argument("--tg-id-base", type=int, default=2_000_000_000 - 1_000_000,
+                        help="tg_id первого тестового пользователя")
+    parser.add_argument("--timeout", type=float, default=120.0, help="таймаут ожидания ответа бота")
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args()
+
+
+async def main():
+    args = _parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    llm_latency = parse_latency(args.llm_latency)
+    llm.manager._build_client = lambda: FakeGigaChat(llm_latency, reply_chars=args.reply_chars)
+    session = FakeTelegramSession(parse_latency(args.telegram_latency))
+    bot.session = session
+    # Задержку считаем до полного ответа, поэтому ответ отправляется одним сообщением
+    handlers.menu.STREAM_REPLIES = False
+
+    await init_db_async()
+    await llm.manager.gigachat_pool.start()
+    _instrument_db()
+    dp.include_router(registration_router)
+    dp.include_router(menu_router)
+
+    load_test = LoadTest(
+        session=session,
+        users=args.users,
+        turns=args.turns,
+        tg_id_base=args.tg_id_base,
+        ramp=args.ramp,
+        think=parse_latency(args.think),
+        timeout=args.timeout
+    )
+    elapsed = await load_test.run()
+    load_test.report(elapsed)
+
+    await llm.manager.gigachat_pool.stop()
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,36 +1,150 @@
-import asyncio
-from config import debug_mode
-from db import init_db
-from init_bot import bot, dp
-from handlers.registration import registration_router
-from handlers.menu import menu_router
-from notifications.manager import scheduler, schedule_existing_notifications
-
-
-# Для отладки Apscheduler
-if debug_mode:
-    import logging
-    logging.basicConfig()
-    logging.getLogger("apscheduler").setLevel(logging.DEBUG)
-
-async def main():
-    # Инициализация БД
-    init_db()
-
-    # Восстанавливаем уведомления из БД
-    schedule_existing_notifications()
-
-    # Стартуем планировщик
-    scheduler.start()
-    if debug_mode:
-        print("[main] APScheduler запущен.")
-
-    # Подключаем роутеры
-    dp.include_router(registration_router)
-    dp.include_router(menu_router)
-
-    # Запускаем поллинг
-    await dp.start_polling(bot)
-
-if __name__ == "__main__":
-    asyncio.run(main())
+import asyncio
+from config import (
+    debug_mode, METRICS_ENABLED, METRICS_PORT, BOT_MODE, WORKER_PROCESSES, WORKER_QUEUE_SIZE
+)
+from db import init_db_async
+from init_bot import bot, dp, storage
+from handlers.registration import registration_router
+from handlers.menu import menu_router
+from notifications.manager import (
+    scheduler, start_notification_delivery, start_inactivity_jobs, purge_old_notifications
+)
+from llm.manager import gigachat_pool, share_limits
+from cache.manager import response_cache
+from delivery.manager import outbox
+from metrics.manager import start_metrics_server
+from webhook.manager import webhook_server
+from cluster.manager import Supervisor, register_metrics
+from fsm.manager import DBStorage
+
+
+# Для отладки Apscheduler
+if debug_mode:
+    import logging
+    logging.basicConfig()
+    logging.getLogger("apscheduler").setLevel(logging.DEBUG)
+
+async def start_services(metrics_port: int = METRICS_PORT, leader: bool = True):
+    """
+    leader — процесс, который отправляет outbox и выполняет общие периодические задачи
+    (обход неактивных, очистки). При WORKER_PROCESSES > 1 это только воркер 0: лимиты
+    Telegram общие на бота, а N копий outbox слали бы до N × TELEGRAM_GLOBAL_RATE сообщений.
+    Остальные воркеры только кладут сообщения в outbox (его забирает лидер).
+    """
+    # Инициализация БД
+    await init_db_async()
+
+    # Метрики для Prometheus (локальный HTTP-эндпоинт /metrics)
+    if METRICS_ENABLED:
+        await start_metrics_server(port=metrics_port)
+
+    # Воркеры доставки исходящих сообщений (outbox с учётом лимитов Telegram)
+    if leader:
+        await outbox.start()
+
+    # Восстанавливаем уведомления из БД (или запускаем окно ближайших уведомлений)
+    await start_notification_delivery()
+
+    # Напоминания о неактивности: одна периодическая задача на всех пользователей
+    start_inactivity_jobs(sweep=leader)
+
+    if leader:
+        # Раз в сутки удаляем давно отправленные уведомления
+        scheduler.add_job(purge_old_notifications, trigger='interval', hours=24)
+        scheduler.add_job(outbox.purge_delivered, trigger='interval', hours=24)
+
+        # Периодическая очистка кэша ответов (TTL + ограничение размера)
+        scheduler.add_job(response_cache.purge, trigger='interval', hours=1)
+
+        # Брошенные состояния FSM (например, незаконченная регистрация)
+        if isinstance(storage, DBStorage):
+            scheduler.add_job(storage.purge, trigger='interval', hours=1)
+
+    # Стартуем планировщик
+    scheduler.start()
+    if debug_mode:
+        print("[main] APScheduler запущен.")
+
+    # Прогреваем пул клиентов GigaChat (соединения + access token)
+    await gigachat_pool.start()
+
+    # Подключаем роутеры
+    dp.include_router(registration_router)
+    dp.include_router(menu_router)
+
+
+async def main():
+    if WORKER_PROCESSES > 1:
+        await supervisor_main()
+        return
+
+    await start_services()
+
+    if BOT_MODE == "webhook":
+        # Webhook: быстрый ответ Telegram, обработка апдейтов пулом воркеров
+        await dp.emit_startup(bot=bot)
+        await webhook_server.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await webhook_server.stop()
+            await dp.emit_shutdown(bot=bot)
+    else:
+        # Поллинг (для разработки); webhook, если был установлен, снимается
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+
+
+async def supervisor_main():
+    """
+    Несколько процессов: супервизор только принимает апдейты и раздаёт их
+    воркерам по ID пользователя, вся обработка — в процессах-воркерах.
+    """
+    # Миграции один раз до запуска воркеров
+    await init_db_async()
+    # Роутеры нужны супервизору только для списка используемых типов апдейтов
+    dp.include_router(registration_router)
+    dp.include_router(menu_router)
+    if METRICS_ENABLED:
+        await start_metrics_server()
+
+    supervisor = Supervisor(WORKER_PROCESSES, WORKER_QUEUE_SIZE, target=run_worker)
+    register_metrics(supervisor)
+    supervisor.start()
+    try:
+        if BOT_MODE == "webhook":
+            webhook_server.process = supervisor.route
+            await webhook_server.start()
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await webhook_server.stop()
+        else:
+            await bot.delete_webhook()
+            await supervisor.poll(bot, dp.resolve_used_update_types())
+    finally:
+        supervisor.stop()
+
+
+def run_worker(index: int, queue):
+    """Точка входа процесса-воркера (WORKER_PROCESSES > 1)."""
+    asyncio.run(worker_main(index, queue))
+
+
+async def worker_main(index: int, queue):
+    # Лимиты GigaChat общие на бота — делим их между процессами
+    share_limits(WORKER_PROCESSES)
+    # У каждого процесса свой порт метрик: METRICS_PORT + 1 + номер воркера
+    await start_services(metrics_port=METRICS_PORT + 1 + index, leader=index == 0)
+    await dp.emit_startup(bot=bot)
+    webhook_server.start_workers()
+    while True:
+        data = await asyncio.to_thread(queue.get)
+        if data is None:
+            break
+        await webhook_server.accept(data, wait=True)
+    await webhook_server.stop()
+    await dp.emit_shutdown(bot=bot)
+
+if __name__ == "__main__":
+    asyncio.run(main())
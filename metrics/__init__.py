@@ -0,0 +1 @@
+# metrics/__init__.py
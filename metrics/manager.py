@@ -0,0 +1,159 @@
+import bisect
+
+from aiohttp import web
+
+from config import debug_mode, METRICS_HOST, METRICS_PORT
+
+# Границы корзин гистограмм по умолчанию (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: dict = None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.extend(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = labelnames
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            self._series[key] = series
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class _Callback:
+    """Значение читается в момент запроса метрик (обычно из stats() модуля)."""
+
+    def __init__(self, name: str, help_text: str, fn, kind: str):
+        self.name = name
+        self.help_text = help_text
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> list:
+        try:
+            value = self.fn()
+        except Exception as e:
+            print(f"[METRICS] Ошибка при чтении {self.name}: {e}")
+            return []
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+            f"{self.name} {_format_value(value)}",
+        ]
+
+
+class MetricsRegistry:
+    """
+    Минимальный реестр метрик в текстовом формате Prometheus.
+    Гистограммы и счётчики обновляются на горячих путях (без блокировок —
+    всё выполняется в одном event loop), текущие значения очередей и пулов
+    берутся из stats() соответствующих модулей при каждом запросе /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS,
+                  labelnames: tuple = ()) -> Histogram:
+        return self._register(Histogram(name, help_text, buckets, labelnames))
+
+    def gauge(self, name: str, help_text: str, fn):
+        self._register(_Callback(name, help_text, fn, "gauge"))
+
+    def counter_from(self, name: str, help_text: str, fn):
+        """Счётчик, который уже ведёт сам модуль (например, stats()["failed"])."""
+        self._register(_Callback(name, help_text, fn, "counter"))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        # Повторная регистрация (например, при повторном импорте) возвращает существующую метрику
+        return self._metrics.setdefault(metric.name, metric)
+
+
+registry = MetricsRegistry()
+
+
+async def _handle_metrics(request):
+    return web.Response(
+        body=registry.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """Локальный HTTP-эндпоинт /metrics для Prometheus."""
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if debug_mode:
+        print(f"[METRICS] Метрики доступны на http://{host}:{port}/metrics")
+    return runner
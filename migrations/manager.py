@@ -0,0 +1,108 @@
+import datetime
+
+from sqlalchemy import text
+
+from config import debug_mode
+
+# Ключ advisory lock, чтобы миграции не катили одновременно несколько процессов
+_MIGRATIONS_LOCK_KEY = 725_001
+
+# Версионированные миграции схемы. create_all создаёт только отсутствующие таблицы,
+# а изменения уже существующих (колонки, индексы) докатываются отсюда.
+# Выражения идемпотентны; индексы строятся CONCURRENTLY, чтобы не блокировать
+# запись в большие таблицы (поэтому миграции выполняются в режиме AUTOCOMMIT).
+MIGRATIONS = [
+    (1, "users.last_active_at, notifications.sent_at", [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS last_active_at TIMESTAMP",
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS inactivity_notified_at TIMESTAMP",
+        "ALTER TABLE notifications ADD COLUMN IF NOT EXISTS sent_at TIMESTAMP",
+    ]),
+    (2, "составные и частичные индексы для горячих запросов", [
+        # История диалога: WHERE user_id = ? AND id > ? ORDER BY id
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_id_id ON messages (user_id, id)",
+        # Уведомления пользователя по типу: WHERE user_id = ? AND kind = ?
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notifications_user_id_kind "
+        "ON notifications (user_id, kind)",
+        # Окно ближайших неотправленных уведомлений (режим "window")
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_notifications_due "
+        "ON notifications (time_utc) WHERE sent_at IS NULL",
+        # Sweeper неактивности: только ещё не получившие напоминание
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_inactive "
+        "ON users (last_active_at) WHERE inactivity_notified_at IS NULL",
+        # Outbox: выборка готовых к отправке сообщений
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_outbox_pending "
+        "ON outbox (next_attempt_at, id) WHERE status = 'pending'",
+        # Очистка кэша ответов по TTL
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_response_cache_expires_at "
+        "ON response_cache (expires_at)",
+    ]),
+    (3, "индекс для возврата сообщений outbox с истёкшей арендой", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_outbox_sending "
+        "ON outbox (next_attempt_at) WHERE status = 'sending'",
+    ]),
+    (4, "notifications.recurrence для повторяющихся напоминаний", [
+        "ALTER TABLE notifications ADD COLUMN IF NOT EXISTS recurrence VARCHAR",
+    ]),
+    (5, "удаление полных индексов, которые заменили частичные", [
+        # Горячие запросы обслуживают ix_users_inactive и ix_notifications_due,
+        # а полные индексы только замедляли каждую запись в таблицы
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_users_last_active_at",
+        "DROP INDEX CONCURRENTLY IF EXISTS ix_notifications_time_utc",
+    ]),
+    (6, "notifications.time_utc старых строк — в naive UTC", [
+        # Старый синхронный код писал aware-время в колонку без часового пояса, и PostgreSQL
+        # сохранял его в часовом поясе сервера (TimeZone). Строки, созданные до первой миграции
+        # (то есть старым кодом), переводим в UTC одним UPDATE; если колонку когда-то создали
+        # как timestamptz, меняем её тип на timestamp с пересчётом в UTC.
+        """
+        DO $$
+        BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = 'notifications'
+                  AND column_name = 'time_utc') = 'timestamp with time zone' THEN
+                ALTER TABLE notifications ALTER COLUMN time_utc TYPE TIMESTAMP
+                    USING time_utc AT TIME ZONE 'UTC';
+            ELSIF current_setting('TimeZone') NOT IN ('UTC', 'Etc/UTC') THEN
+                UPDATE notifications
+                SET time_utc = (time_utc AT TIME ZONE current_setting('TimeZone')) AT TIME ZONE 'UTC'
+                WHERE created_at < (SELECT applied_at FROM schema_migrations WHERE version = 1);
+            END IF;
+        END $$
+        """,
+    ]),
+]
+
+
+def apply_migrations(conn, metadata):
+    """
+    Создаёт отсутствующие таблицы metadata и применяет ещё не применённые
+    миграции (conn — синхронное соединение в режиме AUTOCOMMIT; из async-кода
+    вызывается через run_sync). Всё, включая create_all, выполняется под
+    advisory lock: одновременно стартующие процессы не создают таблицы наперегонки.
+    """
+    conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _MIGRATIONS_LOCK_KEY})
+    try:
+        metadata.create_all(conn)
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "description VARCHAR NOT NULL, "
+            "applied_at TIMESTAMP NOT NULL)"
+        ))
+        applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+        for version, description, statements in MIGRATIONS:
+            if version in applied:
+                continue
+            for statement in statements:
+                conn.execute(text(statement))
+            conn.execute(
+                text(
+                    "INSERT INTO schema_migrations (version, description, applied_at) "
+                    "VALUES (:version, :description, :applied_at)"
+                ),
+                {"version": version, "description": description, "applied_at": datetime.datetime.utcnow()}
+            )
+            if debug_mode:
+                print(f"[DB] Применена миграция {version}: {description}")
+    finally:
+        conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _MIGRATIONS_LOCK_KEY})
@@ -1 +1 @@
-# notifications/__init__.py
+# notifications/__init__.py
@@ -1,286 +1,678 @@
-import datetime
-import pytz
-
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.executors.asyncio import AsyncIOExecutor
-from db import SessionLocal, User, Notification
-from init_bot import bot
-
-
-scheduler = AsyncIOScheduler(
-    timezone=pytz.utc,
-    executors={"default": AsyncIOExecutor()}
-)
-
-# Внимание: Чтобы планировщик начал работать нужно вызывать в main.py (или аналогичном месте),
-
-async def _notify_user(tg_id: int, text: str):
-    """
-    Асинхронная функция отправки уведомления пользователю Telegram.
-    APScheduler вызовет её напрямую, поскольку мы используем AsyncIOExecutor.
-    """
-    text = text.replace('#', '').replace('*', '') # убираем спецсимволы MD
-    try:
-        await bot.send_message(chat_id=tg_id, text=text, parse_mode="Markdown")
-    except Exception as e:
-        print(f"[NOTIFY] Ошибка при отправке уведомления пользователю tg_id={tg_id}: {e}")
-
-
-async def handle_inactivity(user_id: int):
-    """
-    Вызывается, если 7 дней не было сообщений от пользователя (inactivity).
-    Тоже асинхронная функция.
-    """
-    db_session = SessionLocal()
-    try:
-        user = db_session.query(User).filter_by(id=user_id).first()
-        if not user:
-            return
-        user_tg_id = user.tg_id
-    finally:
-        db_session.close()
-
-    # Простой пример: отправка "Вы не были активны 7 дней! ..."
-    try:
-        await bot.send_message(
-            chat_id=user_tg_id,
-            text="Вы не были активны 7 дней! Пора вернуться к тренировкам и правильному питанию!"
-        )
-    except Exception as e:
-        print(f"[INACTIVITY] Ошибка при отправке сообщения о неактивности: {e}")
-
-
-def schedule_notification(user_id: int, local_dt_str: str, message: str):
-    """
-    Планируем ОДНО уведомление (kind="regular").
-    local_dt_str — локальное время пользователя в формате ISO8601.
-      Пример: "2025-01-17T09:00:00+03:00" или без смещения, тогда добавляем user.timezone.
-    """
-    db_session = SessionLocal()
-    try:
-        user = db_session.query(User).filter_by(id=user_id).first()
-        if not user:
-            return
-
-        # Определяем его часовой пояс или UTC
-        user_tz = pytz.timezone(user.timezone or "UTC")
-
-        # Парсим локальное время
-        try:
-            local_dt = datetime.datetime.fromisoformat(local_dt_str)
-            if local_dt.tzinfo is None:
-                local_dt = user_tz.localize(local_dt)
-        except ValueError:
-            return
-
-        # Конвертируем в UTC
-        dt_utc = local_dt.astimezone(pytz.utc) + datetime.timedelta(seconds=10)
-        now_utc = datetime.datetime.now(pytz.utc)
-        if dt_utc <= now_utc:
-            return
-
-        # Создаём Notification в БД
-        notif = Notification(
-            user_id=user.id,
-            time_utc=dt_utc,
-            message=message,
-            kind="regular"
-        )
-        db_session.add(notif)
-        db_session.commit()
-
-        # Планируем задачу (асинхронную) в Apscheduler
-        scheduler.add_job(
-            _notify_user,
-            trigger='date',
-            run_date=dt_utc,
-            args=[user.tg_id, message],
-            misfire_grace_time=60
-        )
-
-    finally:
-        db_session.close()
-
-
-def schedule_inactivity_job(user_id: int, days: int = 7):
-    """
-    Планируем уведомление о неактивности (kind="inactivity").
-    То есть если пользователь не напишет боту в течение N дней, высылаем предупреждение.
-    """
-    db_session = SessionLocal()
-    try:
-        # Сначала удаляем старые 'inactivity' записи
-        olds = db_session.query(Notification).filter_by(
-            user_id=user_id,
-            kind='inactivity'
-        ).all()
-        for old in olds:
-            db_session.delete(old)
-        db_session.commit()
-
-        # Создаём новую
-        run_date = datetime.datetime.now(tz=pytz.utc) + datetime.timedelta(days=days)
-        new_notif = Notification(
-            user_id=user_id,
-            time_utc=run_date,
-            message="INACTIVITY_REMINDER",
-            kind="inactivity"
-        )
-        db_session.add(new_notif)
-        db_session.commit()
-
-        # Планируем задачу
-        scheduler.add_job(
-            handle_inactivity,
-            trigger='date',
-            run_date=run_date,
-            args=[user_id],
-            misfire_grace_time=60
-        )
-
-    finally:
-        db_session.close()
-
-
-def schedule_existing_notifications():
-    """
-    При старте бота (или перезапуске) восстанавливаем задачи:
-    1. Читаем все уведомления из БД (regular, inactivity).
-    2. Для будущих дат снова добавляем задачи в Apscheduler.
-    """
-    db_session = SessionLocal()
-    try:
-        notifs = db_session.query(Notification).all()
-        now_utc = datetime.datetime.now(tz=pytz.utc)
-
-        for n in notifs:
-            user = db_session.query(User).filter_by(id=n.user_id).first()
-            if not user:
-                continue
-
-            # Приводим время к UTC (aware), если вдруг tzinfo = None
-            if n.time_utc.tzinfo is None:
-                n.time_utc = pytz.utc.localize(n.time_utc)
-                db_session.add(n)
-                db_session.commit()
-
-            if n.time_utc <= now_utc:
-                # Считаем, что время уже прошло — не планируем.
-                continue
-
-            if n.kind == 'inactivity':
-                scheduler.add_job(
-                    handle_inactivity,
-                    trigger='date',
-                    run_date=n.time_utc,
-                    args=[n.user_id],
-                    misfire_grace_time=60
-                )
-            else:
-                # Обычное уведомление
-                scheduler.add_job(
-                    _notify_user,
-                    trigger='date',
-                    run_date=n.time_utc,
-                    args=[user.tg_id, n.message],
-                    misfire_grace_time=60
-                )
-
-    finally:
-        db_session.close()
-
-
-"""
-Далее функции для работы с уведомлениями (CRUD) в БД,
-которые убрали из functions_calling и промпта т.к.
-GigaChat ими все равно не пользуется, но они захламляют его помять.
-"""
-# def list_notifications(user_id: int) -> list:
-#     """
-#     Возвращаем список уведомлений пользователя в локальном времени.
-#     """
-#     db_session = SessionLocal()
-#     try:
-#         user = db_session.query(User).filter_by(id=user_id).first()
-#         if not user:
-#             return []
-#
-#         notifs = db_session.query(Notification).filter_by(user_id=user.id).all()
-#         result = []
-#         for n in notifs:
-#             user_tz_name = user.timezone or "UTC"
-#             user_tz = pytz.timezone(user_tz_name)
-#             local_dt = n.time_utc.astimezone(user_tz)
-#             time_str = local_dt.isoformat()  # в формате 2025-01-17T09:00:00+03:00
-#             result.append({
-#                 "id": n.id,
-#                 "message": n.message,
-#                 "time": time_str
-#             })
-#         return result
-#     finally:
-#         db_session.close()
-#
-# def delete_notification(user_id: int, notification_id: int):
-#     """
-#     Удаляем уведомление из БД.
-#     (В APScheduler старое задание не убираем, но оно всё равно не найдёт этот notif впоследствии.)
-#     """
-#     db_session = SessionLocal()
-#     try:
-#         user = db_session.query(User).filter_by(id=user_id).first()
-#         if not user:
-#             return
-#
-#         notif = db_session.query(Notification).filter_by(
-#             id=notification_id,
-#             user_id=user.id
-#         ).first()
-#         if notif:
-#             db_session.delete(notif)
-#             db_session.commit()
-#     finally:
-#         db_session.close()
-#
-# def update_notification(user_id: int, notification_id: int,
-#                         new_message: str = None,
-#                         new_time_str: str = None):
-#     """Изменяем уведомление и перезапланируем его отправку."""
-#     db_session = SessionLocal()
-#     try:
-#         user = db_session.query(User).filter_by(id=user_id).first()
-#         if not user:
-#             return
-#
-#         notif = db_session.query(Notification).filter_by(
-#             id=notification_id,
-#             user_id=user.id
-#         ).first()
-#         if not notif:
-#             return
-#
-#         if new_message is not None:
-#             notif.message = new_message
-#
-#         if new_time_str is not None:
-#             try:
-#                 user_tz = pytz.timezone(user.timezone or "UTC")
-#                 local_dt = datetime.datetime.fromisoformat(new_time_str)
-#                 if local_dt.tzinfo is None:
-#                     local_dt = user_tz.localize(local_dt)
-#                 dt_utc = local_dt.astimezone(pytz.utc)
-#                 notif.time_utc = dt_utc
-#             except ValueError:
-#                 pass
-#
-#         db_session.commit()
-#
-#         # Перезапланируем (упрощённо, без удаления старой задачи) —
-#         # планируем новую задачу с новыми параметрами
-#         scheduler.add_job(
-#             func=partial(asyncio.create_task, _notify_user(user.tg_id, notif.message)),
-#             trigger='date',
-#             run_date=notif.time_utc
-#         )
-#     finally:
+import asyncio
+import datetime
+import heapq
+import pytz
+
+from apscheduler.events import EVENT_JOB_SUBMITTED
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from sqlalchemy import select, update, delete, or_
+from config import (
+    debug_mode, INACTIVITY_DAYS, INACTIVITY_SWEEP_MINUTES, ACTIVITY_FLUSH_SECONDS,
+    NOTIFICATION_RESTORE_CHUNK, NOTIFICATION_RETENTION_DAYS,
+    NOTIFICATION_SCHEDULER_MODE, NOTIFICATION_WINDOW_SECONDS,
+    NOTIFICATION_REFILL_SECONDS, NOTIFICATION_MISFIRE_GRACE_SECONDS
+)
+from db import AsyncSessionLocal, User, Notification, to_naive_utc
+from delivery.manager import outbox
+from profiles.manager import profile_cache
+from notifications.recurrence import next_occurrence
+from metrics.manager import registry
+
+
+scheduler = AsyncIOScheduler(
+    timezone=pytz.utc,
+    executors={"default": AsyncIOExecutor()}
+)
+
+# Внимание: Чтобы планировщик начал работать нужно вызывать в main.py (или аналогичном месте),
+
+scheduler_lag_seconds = registry.histogram(
+    "fitai_scheduler_lag_seconds", "Опоздание запуска задачи относительно запланированного времени",
+    labelnames=("source",)
+)
+notify_errors = registry.counter(
+    "fitai_notification_enqueue_errors_total", "Ошибок постановки уведомления в outbox"
+)
+
+
+def _observe_job_lag(event):
+    now = datetime.datetime.now(tz=pytz.utc)
+    for run_time in event.scheduled_run_times:
+        scheduler_lag_seconds.observe(max((now - run_time).total_seconds(), 0), source="apscheduler")
+
+
+scheduler.add_listener(_observe_job_lag, EVENT_JOB_SUBMITTED)
+
+def _notification_text(text: str) -> str:
+    return text.replace('#', '').replace('*', '') # убираем спецсимволы MD
+
+
+async def deliver_notifications(notification_ids: list) -> int:
+    """
+    Отправка наступивших уведомлений пользователям Telegram.
+    В одной транзакции строки забираются (FOR UPDATE SKIP LOCKED), помечаются
+    sent_at и кладутся в outbox, откуда их с учётом лимитов Telegram и повторных
+    попыток отправят воркеры доставки. Уведомление, которое уже забрал или
+    отправил другой процесс бота, пропускается — при нескольких экземплярах
+    бота на одной БД каждое напоминание уходит ровно один раз.
+    У повторяющегося уведомления вместо sent_at переносится time_utc
+    на следующее срабатывание правила, и оно планируется заново.
+    Возвращает число поставленных в outbox уведомлений.
+    """
+    now_utc = datetime.datetime.now(tz=pytz.utc)
+    now = to_naive_utc(now_utc)
+    rescheduled = []
+    try:
+        async with AsyncSessionLocal() as db_session:
+            rows = (await db_session.execute(
+                select(
+                    Notification.id, Notification.message, Notification.recurrence,
+                    User.tg_id, User.timezone
+                )
+                .join(User, User.id == Notification.user_id)
+                .where(
+                    Notification.id.in_(notification_ids),
+                    Notification.sent_at.is_(None),
+                    # Повторяющееся уведомление, уже перенесённое на следующий раз, не трогаем
+                    Notification.time_utc <= now
+                )
+                .with_for_update(of=Notification, skip_locked=True)
+            )).all()
+            if not rows:
+                return 0
+
+            finished = []
+            for notification_id, message, recurrence, tg_id, timezone in rows:
+                next_utc = _next_time(notification_id, recurrence, now_utc, timezone) if recurrence else None
+                if next_utc is None:
+                    finished.append(notification_id)
+                else:
+                    rescheduled.append((notification_id, to_naive_utc(next_utc), tg_id, message))
+            if finished:
+                await db_session.execute(
+                    update(Notification)
+                    .where(Notification.id.in_(finished))
+                    .values(sent_at=now)
+                )
+            if rescheduled:
+                await db_session.execute(
+                    update(Notification),
+                    [{"id": notification_id, "time_utc": time_utc} for notification_id, time_utc, _, _ in rescheduled]
+                )
+            outbox.stage(
+                db_session,
+                [(tg_id, _notification_text(message)) for _, message, _, tg_id, _ in rows],
+                parse_mode="Markdown"
+            )
+            await db_session.commit()
+    except Exception as e:
+        notify_errors.inc()
+        print(f"[NOTIFY] Ошибка при постановке уведомлений {notification_ids} в очередь: {e}")
+        return 0
+    outbox.wakeup()
+    for item in rescheduled:
+        _plan_delivery(*item)
+    return len(rows)
+
+
+def _next_time(notification_id: int, rule: str, after: datetime.datetime, timezone: str):
+    """
+    next_occurrence для одной строки: испорченное правило (или часовой пояс)
+    завершает только это уведомление, а не всю пачку.
+    """
+    try:
+        return next_occurrence(rule, after, timezone)
+    except Exception as e:
+        notify_errors.inc()
+        print(f"[NOTIFY] Уведомление {notification_id}: не удалось вычислить следующее срабатывание "
+              f"по правилу {rule!r}: {e}")
+        return None
+
+
+async def advance_stale_recurring(before: datetime.datetime, batch_size: int = 500) -> int:
+    """
+    Повторяющиеся уведомления, срабатывание которых (time_utc < before, naive UTC)
+    прошло, пока бот не работал, переносятся на ближайшее будущее срабатывание
+    правила — иначе ни восстановление задач, ни пополнение окна их больше не выберут.
+    Пропущенные срабатывания не отправляются. Закончившиеся правила помечаются sent_at.
+    Возвращает число перенесённых уведомлений.
+    """
+    now_utc = datetime.datetime.now(tz=pytz.utc)
+    now = to_naive_utc(now_utc)
+    advanced = 0
+    while True:
+        async with AsyncSessionLocal() as db_session:
+            rows = (await db_session.execute(
+                select(Notification.id, Notification.recurrence, User.timezone)
+                .join(User, User.id == Notification.user_id)
+                .where(
+                    Notification.time_utc < before,
+                    Notification.sent_at.is_(None),
+                    Notification.recurrence.is_not(None)
+                )
+                .order_by(Notification.time_utc.asc())
+                .limit(batch_size)
+                .with_for_update(of=Notification, skip_locked=True)
+            )).all()
+            if not rows:
+                break
+
+            finished, moved = [], []
+            for notification_id, recurrence, timezone in rows:
+                next_utc = _next_time(notification_id, recurrence, now_utc, timezone)
+                if next_utc is None:
+                    finished.append(notification_id)
+                else:
+                    moved.append({"id": notification_id, "time_utc": to_naive_utc(next_utc)})
+            if finished:
+                await db_session.execute(
+                    update(Notification)
+                    .where(Notification.id.in_(finished))
+                    .values(sent_at=now)
+                )
+            if moved:
+                await db_session.execute(update(Notification), moved)
+            await db_session.commit()
+        advanced += len(moved)
+        if len(rows) < batch_size:
+            break
+
+    if debug_mode and advanced:
+        print(f"[NOTIFY] Перенесено пропущенных повторяющихся уведомлений: {advanced}")
+    return advanced
+
+
+def _plan_delivery(notification_id: int, time_utc: datetime.datetime, tg_id: int, message: str):
+    """Ставит сохранённое уведомление на отправку (time_utc — naive UTC)."""
+    if NOTIFICATION_SCHEDULER_MODE == "window":
+        # Если уведомление попадает в текущее окно — сразу кладём его в кучу,
+        # иначе его подхватит очередное пополнение окна из БД.
+        notification_dispatcher.add(notification_id, time_utc, tg_id, message)
+        return
+
+    # Планируем задачу (асинхронную) в Apscheduler
+    scheduler.add_job(
+        _notify_scheduled,
+        trigger='date',
+        run_date=time_utc.replace(tzinfo=pytz.utc),
+        args=[notification_id],
+        misfire_grace_time=60
+    )
+
+
+async def _notify_scheduled(notification_id: int):
+    """Задача APScheduler (режим "apscheduler"); вызывается напрямую благодаря AsyncIOExecutor."""
+    await deliver_notifications([notification_id])
+
+
+class ActivityTracker:
+    """
+    Отметки активности пользователей копятся в памяти и раз в
+    ACTIVITY_FLUSH_SECONDS сбрасываются в users.last_active_at одним bulk UPDATE,
+    вместо пары коммитов и новой задачи планировщика на каждое сообщение.
+    """
+
+    def __init__(self):
+        self._pending = {}
+
+    def touch(self, user_id: int):
+        self._pending[user_id] = datetime.datetime.now(tz=pytz.utc)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(
+                update(User),
+                [
+                    {"id": uid, "last_active_at": to_naive_utc(ts), "inactivity_notified_at": None}
+                    for uid, ts in pending.items()
+                ]
+            )
+            await db_session.commit()
+
+
+activity_tracker = ActivityTracker()
+
+
+async def sweep_inactive_users(batch_size: int = 500):
+    """
+    Периодическая задача: находит (по индексу last_active_at) пользователей,
+    которые не писали боту INACTIVITY_DAYS дней и ещё не получили напоминание,
+    и рассылает им напоминание пачкой.
+    """
+    # Сначала сбрасываем свежие отметки, чтобы не напомнить только что активному
+    await activity_tracker.flush()
+
+    now_utc = datetime.datetime.now(tz=pytz.utc)
+    threshold = to_naive_utc(now_utc - datetime.timedelta(days=INACTIVITY_DAYS))
+    while True:
+        async with AsyncSessionLocal() as db_session:
+            # Пользователей, которых сейчас обрабатывает другой процесс бота, пропускаем;
+            # напоминание и отметка о нём фиксируются одним коммитом
+            rows = (await db_session.execute(
+                select(User.id, User.tg_id)
+                .where(
+                    User.last_active_at <= threshold,
+                    User.inactivity_notified_at.is_(None)
+                )
+                .order_by(User.last_active_at.asc())
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not rows:
+                return
+
+            text = f"Вы не были активны {INACTIVITY_DAYS} дней! Пора вернуться к тренировкам и правильному питанию!"
+            outbox.stage(db_session, [(tg_id, text) for _, tg_id in rows])
+
+            await db_session.execute(
+                update(User),
+                [{"id": uid, "inactivity_notified_at": to_naive_utc(now_utc)} for uid, _ in rows]
+            )
+            await db_session.commit()
+        outbox.wakeup()
+
+
+def start_inactivity_jobs(sweep: bool = True):
+    """
+    Две периодические задачи вместо отдельной задачи на каждое сообщение.
+    Активность сбрасывает в БД каждый процесс, обход неактивных (sweep) нужен только одному.
+    """
+    scheduler.add_job(
+        activity_tracker.flush,
+        trigger='interval',
+        seconds=ACTIVITY_FLUSH_SECONDS,
+        id="activity_flush",
+        replace_existing=True
+    )
+    if not sweep:
+        return
+    scheduler.add_job(
+        sweep_inactive_users,
+        trigger='interval',
+        minutes=INACTIVITY_SWEEP_MINUTES,
+        id="inactivity_sweeper",
+        replace_existing=True,
+        max_instances=1
+    )
+
+
+async def schedule_notification(user_id: int, local_dt_str: str, message: str):
+    """
+    Планируем ОДНО уведомление (kind="regular").
+    local_dt_str — локальное время пользователя в формате ISO8601.
+      Пример: "2025-01-17T09:00:00+03:00" или без смещения, тогда добавляем user.timezone.
+    Возвращает локальное время уведомления или None, если создать его не удалось.
+    """
+    user = await profile_cache.get_by_id(user_id)
+    if not user:
+        return
+
+    # Определяем его часовой пояс или UTC
+    user_tz = pytz.timezone(user.timezone or "UTC")
+
+    # Парсим локальное время
+    try:
+        local_dt = datetime.datetime.fromisoformat(local_dt_str)
+        if local_dt.tzinfo is None:
+            local_dt = user_tz.localize(local_dt)
+    except ValueError:
+        return
+
+    # Конвертируем в UTC
+    dt_utc = local_dt.astimezone(pytz.utc) + datetime.timedelta(seconds=10)
+    now_utc = datetime.datetime.now(pytz.utc)
+    if dt_utc <= now_utc:
+        return
+
+    async with AsyncSessionLocal() as db_session:
+        # Создаём Notification в БД
+        notif = Notification(
+            user_id=user.id,
+            time_utc=to_naive_utc(dt_utc),
+            message=message,
+            kind="regular"
+        )
+        db_session.add(notif)
+        await db_session.commit()
+
+    _plan_delivery(notif.id, notif.time_utc, user.tg_id, message)
+    return local_dt
+
+
+async def schedule_recurring_notification(user_id: int, rule: str, message: str):
+    """
+    Планируем повторяющееся уведомление (kind="recurring") одной строкой:
+    rule — правило в локальном времени пользователя (см. notifications/recurrence.py),
+    в time_utc хранится только ближайшее срабатывание.
+    Возвращает локальное время первого срабатывания или None.
+    """
+    user = await profile_cache.get_by_id(user_id)
+    if not user:
+        return
+
+    try:
+        first_utc = next_occurrence(rule, datetime.datetime.now(pytz.utc), user.timezone)
+    except ValueError:
+        return
+    if first_utc is None:
+        return
+
+    async with AsyncSessionLocal() as db_session:
+        notif = Notification(
+            user_id=user.id,
+            time_utc=to_naive_utc(first_utc),
+            message=message,
+            kind="recurring",
+            recurrence=rule
+        )
+        db_session.add(notif)
+        await db_session.commit()
+
+    _plan_delivery(notif.id, notif.time_utc, user.tg_id, message)
+    return first_utc.astimezone(pytz.timezone(user.timezone or "UTC"))
+
+
+async def schedule_existing_notifications():
+    """
+    При старте бота (или перезапуске) восстанавливаем задачи:
+    1. Одним запросом (с JOIN на users) читаем только будущие уведомления —
+       по индексу на time_utc, порциями через server-side cursor.
+    2. Для каждого снова добавляем задачу в Apscheduler.
+    Устаревшие записи kind="inactivity" пропускаем — их заменил sweep_inactive_users.
+    Повторяющиеся уведомления, пропущенные за время простоя, сначала переносятся на будущее.
+    """
+    now_utc = datetime.datetime.now(tz=pytz.utc)
+    await advance_stale_recurring(to_naive_utc(now_utc))
+    restored = 0
+    async with AsyncSessionLocal() as db_session:
+        result = await db_session.stream(
+            select(Notification.id, Notification.time_utc)
+            .where(
+                Notification.time_utc > to_naive_utc(now_utc),
+                Notification.sent_at.is_(None),
+                Notification.kind != 'inactivity'
+            )
+            .order_by(Notification.time_utc.asc())
+            .execution_options(yield_per=NOTIFICATION_RESTORE_CHUNK)
+        )
+        async for chunk in result.partitions():
+            for notification_id, time_utc in chunk:
+                # В БД время хранится как naive UTC — просто помечаем его как UTC
+                scheduler.add_job(
+                    _notify_scheduled,
+                    trigger='date',
+                    run_date=time_utc.replace(tzinfo=pytz.utc),
+                    args=[notification_id],
+                    misfire_grace_time=60
+                )
+            restored += len(chunk)
+
+    if debug_mode:
+        print(f"[NOTIFY] Восстановлено уведомлений: {restored}")
+
+
+class NotificationDispatcher:
+    """
+    Режим "window": таблица notifications — источник истины, а в памяти
+    (в куче по времени) лежат только уведомления ближайших window секунд.
+    Окно периодически пополняется индексным запросом по time_utc, поэтому
+    память не зависит от общего числа запланированных уведомлений,
+    а старт не требует восстанавливать все задачи.
+    """
+
+    def __init__(self, window: int, refill_interval: int, grace: int):
+        self.window = datetime.timedelta(seconds=window)
+        self.refill_interval = refill_interval
+        self.grace = datetime.timedelta(seconds=grace)
+        # (time_utc, notification_id, tg_id, message); время — naive UTC
+        self._heap = []
+        # id, которые уже в куче или отправляются (чтобы пополнение их не дублировало)
+        self._loaded_ids = set()
+        self._horizon = None
+        self._wakeup = asyncio.Event()
+        self._tasks = set()
+        self.sent = 0
+
+    async def start(self):
+        await self.refill()
+        self._spawn(self._refill_loop())
+        self._spawn(self._run())
+
+    def add(self, notification_id: int, time_utc: datetime.datetime, tg_id: int, message: str):
+        """Добавляет только что созданное уведомление, если оно попадает в текущее окно."""
+        time_utc = to_naive_utc(time_utc)
+        if self._horizon is None or time_utc >= self._horizon:
+            return
+        if notification_id in self._loaded_ids:
+            return
+        self._loaded_ids.add(notification_id)
+        heapq.heappush(self._heap, (time_utc, notification_id, tg_id, message))
+        self._wakeup.set()
+
+    async def refill(self):
+        now = self._now()
+        horizon = now + self.window
+        # Повторяющиеся уведомления, опоздавшие больше чем на grace, переносим на следующее срабатывание
+        await advance_stale_recurring(now - self.grace)
+        async with AsyncSessionLocal() as db_session:
+            rows = (await db_session.execute(
+                select(Notification.id, Notification.time_utc, Notification.message, User.tg_id)
+                .join(User, User.id == Notification.user_id)
+                .where(
+                    Notification.time_utc >= now - self.grace,
+                    Notification.time_utc < horizon,
+                    Notification.sent_at.is_(None),
+                    Notification.kind != 'inactivity'
+                )
+                .order_by(Notification.time_utc.asc())
+            )).all()
+        self._horizon = horizon
+        for notification_id, time_utc, message, tg_id in rows:
+            self.add(notification_id, time_utc, tg_id, message)
+
+    def stats(self) -> dict:
+        return {"window_size": len(self._heap), "in_progress": len(self._loaded_ids), "sent": self.sent}
+
+    async def _refill_loop(self):
+        while True:
+            await asyncio.sleep(self.refill_interval)
+            try:
+                await self.refill()
+            except Exception as e:
+                print(f"[NOTIFY] Ошибка при пополнении окна уведомлений: {e}")
+
+    async def _run(self):
+        while True:
+            now = self._now()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+            if due:
+                self._spawn(self._deliver(due))
+
+            timeout = self.refill_interval
+            if self._heap:
+                timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, due: list):
+        """
+        Наступившие уведомления забираются одной транзакцией; при нескольких
+        процессах бота каждое окно содержит одни и те же уведомления, но
+        отправит их только тот процесс, который заберёт строку первым.
+        """
+        now = self._now()
+        ids = []
+        for time_utc, notification_id, _, _ in due:
+            scheduler_lag_seconds.observe(max((now - time_utc).total_seconds(), 0), source="window")
+            ids.append(notification_id)
+        try:
+            self.sent += await deliver_notifications(ids)
+        finally:
+            self._loaded_ids.difference_update(ids)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    def _now() -> datetime.datetime:
+        return to_naive_utc(datetime.datetime.now(tz=pytz.utc))
+
+
+notification_dispatcher = NotificationDispatcher(
+    window=NOTIFICATION_WINDOW_SECONDS,
+    refill_interval=NOTIFICATION_REFILL_SECONDS,
+    grace=NOTIFICATION_MISFIRE_GRACE_SECONDS
+)
+
+registry.gauge(
+    "fitai_notification_window_size", "Уведомлений в текущем окне (режим window)",
+    lambda: len(notification_dispatcher._heap)
+)
+registry.counter_from(
+    "fitai_notifications_sent_total", "Отправленных уведомлений (режим window)",
+    lambda: notification_dispatcher.sent
+)
+
+
+async def start_notification_delivery():
+    """Запуск доставки уведомлений в режиме NOTIFICATION_SCHEDULER_MODE."""
+    if NOTIFICATION_SCHEDULER_MODE == "window":
+        await notification_dispatcher.start()
+    else:
+        await schedule_existing_notifications()
+
+
+async def purge_old_notifications(batch_size: int = 10000):
+    """
+    Периодическая задача: удаляем уведомления, время которых прошло
+    больше NOTIFICATION_RETENTION_DAYS назад (пачками по batch_size строк).
+    Действующие повторяющиеся уведомления не трогаем, даже если их time_utc
+    давно прошло (срабатывание пропущено за время простоя).
+    """
+    threshold = to_naive_utc(
+        datetime.datetime.now(tz=pytz.utc) - datetime.timedelta(days=NOTIFICATION_RETENTION_DAYS)
+    )
+    while True:
+        async with AsyncSessionLocal() as db_session:
+            ids = (
+                select(Notification.id)
+                .where(
+                    Notification.time_utc < threshold,
+                    or_(Notification.recurrence.is_(None), Notification.sent_at.is_not(None))
+                )
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            result = await db_session.execute(
+                delete(Notification).where(Notification.id.in_(ids))
+            )
+            await db_session.commit()
+        if result.rowcount < batch_size:
+            return
+
+
+"""
+Далее функции для работы с уведомлениями (CRUD) в БД,
+которые убрали из functions_calling и промпта т.к.
+GigaChat ими все равно не пользуется, но они захламляют его помять.
+"""
+# def list_notifications(user_id: int) -> list:
+#     """
+#     Возвращаем список уведомлений пользователя в локальном времени.
+#     """
+#     db_session = SessionLocal()
+#     try:
+#         user = db_session.query(User).filter_by(id=user_id).first()
+#         if not user:
+#             return []
+#
+#         notifs = db_session.query(Notification).filter_by(user_id=user.id).all()
+#         result = []
+#         for n in notifs:
+#             user_tz_name = user.timezone or "UTC"
+#             user_tz = pytz.timezone(user_tz_name)
+#             local_dt = n.time_utc.astimezone(user_tz)
+#             time_str = local_dt.isoformat()  # в формате 2025-01-17T09:00:00+03:00
+#             result.append({
+#                 "id": n.id,
+#                 "message": n.message,
+#                 "time": time_str
+#             })
+#         return result
+#     finally:
+#         db_session.close()
+#
+# def delete_notification(user_id: int, notification_id: int):
+#     """
+#     Удаляем уведомление из БД.
+#     (В APScheduler старое задание не убираем, но оно всё равно не найдёт этот notif впоследствии.)
+#     """
+#     db_session = SessionLocal()
+#     try:
+#         user = db_session.query(User).filter_by(id=user_id).first()
+#         if not user:
+#             return
+#
+#         notif = db_session.query(Notification).filter_by(
+#             id=notification_id,
+#             user_id=user.id
+#         ).first()
+#         if notif:
+#             db_session.delete(notif)
+#             db_session.commit()
+#     finally:
+#         db_session.close()
+#
+# def update_notification(user_id: int, notification_id: int,
+#                         new_message: str = None,
+#                         new_time_str: str = None):
+#     """Изменяем уведомление и перезапланируем его отправку."""
+#     db_session = SessionLocal()
+#     try:
+#         user = db_session.query(User).filter_by(id=user_id).first()
+#         if not user:
+#             return
+#
+#         notif = db_session.query(Notification).filter_by(
+#             id=notification_id,
+#             user_id=user.id
+#         ).first()
+#         if not notif:
+#             return
+#
+#         if new_message is not None:
+#             notif.message = new_message
+#
+#         if new_time_str is not None:
+#             try:
+#                 user_tz = pytz.timezone(user.timezone or "UTC")
+#                 local_dt = datetime.datetime.fromisoformat(new_time_str)
+#                 if local_dt.tzinfo is None:
+#                     local_dt = user_tz.localize(local_dt)
+#                 dt_utc = local_dt.astimezone(pytz.utc)
+#                 notif.time_utc = dt_utc
+#             except ValueError:
+#                 pass
+#
+#         db_session.commit()
+#
+#         # Перезапланируем (упрощённо, без удаления старой задачи) —
+#         # планируем новую задачу с новыми параметрами
+#         scheduler.add_job(
+#             func=partial(asyncio.create_task, _notify_user(user.tg_id, notif.message)),
+#             trigger='date',
+#             run_date=notif.time_utc
+#         )
+#     finally:
 #         db_session.close()
\ No newline at end of file
@@ -0,0 +1,93 @@
+import datetime
+
+import pytz
+
+# Подмножество RRULE (RFC 5545), которого хватает для напоминаний:
+#   FREQ=DAILY|WEEKLY; BYDAY=MO,WE,FR (только WEEKLY); BYHOUR=7,19; BYMINUTE=0,30; UNTIL=20250301T000000Z
+# Время правила — локальное время пользователя (его timezone), поэтому
+# напоминание «в 7:00» остаётся в 7:00 и после перехода на летнее время.
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+_FREQS = ("DAILY", "WEEKLY")
+
+
+def _int_list(value: str, low: int, high: int) -> list:
+    numbers = sorted({int(v) for v in value.split(",")})
+    if not numbers or numbers[0] < low or numbers[-1] > high:
+        raise ValueError(f"Значение вне диапазона {low}..{high}: {value}")
+    return numbers
+
+
+def parse_rule(rule: str) -> dict:
+    """Разбирает правило; ValueError, если оно не из поддерживаемого подмножества."""
+    parts = dict(part.split("=", 1) for part in rule.upper().split(";") if part)
+    freq = parts.pop("FREQ", None)
+    if freq not in _FREQS:
+        raise ValueError(f"Неподдерживаемая частота: {freq}")
+
+    days = list(range(7))
+    if "BYDAY" in parts:
+        if freq != "WEEKLY":
+            raise ValueError("BYDAY допустим только для FREQ=WEEKLY")
+        days = sorted({WEEKDAYS.index(d) for d in parts.pop("BYDAY").split(",")})
+
+    until = None
+    if "UNTIL" in parts:
+        value = parts.pop("UNTIL").rstrip("Z")
+        fmt = "%Y%m%dT%H%M%S" if "T" in value else "%Y%m%d"
+        until = pytz.utc.localize(datetime.datetime.strptime(value, fmt))
+
+    parsed = {
+        "days": days,
+        "hours": _int_list(parts.pop("BYHOUR", "9"), 0, 23),
+        "minutes": _int_list(parts.pop("BYMINUTE", "0"), 0, 59),
+        "until": until,
+    }
+    if parts:
+        raise ValueError(f"Неподдерживаемые части правила: {', '.join(parts)}")
+    return parsed
+
+
+def build_rule(days: list, hour: int, minute: int) -> str:
+    """Правило из дней недели (MO..SU; пусто — каждый день) и локального времени."""
+    days = [d.upper() for d in days or []]
+    for day in days:
+        if day not in WEEKDAYS:
+            raise ValueError(f"Неизвестный день недели: {day}")
+    rule = f"FREQ=WEEKLY;BYDAY={','.join(days)}" if days and len(set(days)) < 7 else "FREQ=DAILY"
+    rule += f";BYHOUR={hour};BYMINUTE={minute}"
+    parse_rule(rule)
+    return rule
+
+
+def next_occurrence(rule: str, after: datetime.datetime, timezone: str):
+    """
+    Ближайшее срабатывание правила строго после after (aware-datetime) в UTC,
+    или None, если правило закончилось (UNTIL).
+    Перебирается не больше 8 локальных дней — это покрывает любое недельное правило.
+    """
+    parsed = parse_rule(rule)
+    tz = pytz.timezone(timezone or "UTC")
+    local_after = after.astimezone(tz)
+    times = [(h, m) for h in parsed["hours"] for m in parsed["minutes"]]
+    for offset in range(8):
+        day = local_after.date() + datetime.timedelta(days=offset)
+        if day.weekday() not in parsed["days"]:
+            continue
+        for hour, minute in times:
+            candidate = tz.normalize(tz.localize(datetime.datetime.combine(day, datetime.time(hour, minute))))
+            if candidate <= local_after:
+                continue
+            candidate = candidate.astimezone(pytz.utc)
+            if parsed["until"] is not None and candidate > parsed["until"]:
+                return None
+            return candidate
+    return None
+
+
+def describe_rule(rule: str) -> str:
+    """Человекочитаемое описание для подтверждения пользователю."""
+    names = ("пн", "вт", "ср", "чт", "пт", "сб", "вс")
+    parsed = parse_rule(rule)
+    days = "каждый день" if len(parsed["days"]) == 7 else "по " + ", ".join(names[d] for d in parsed["days"])
+    times = ", ".join(f"{h:02d}:{m:02d}" for h in parsed["hours"] for m in parsed["minutes"])
+    return f"{days} в {times}"
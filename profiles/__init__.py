@@ -0,0 +1 @@
+# profiles/__init__.py
@@ -0,0 +1,94 @@
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from config import PROFILE_CACHE_MAX_USERS, PROFILE_CACHE_TTL_SECONDS
+from db import AsyncSessionLocal, User
+from metrics.manager import registry
+
+
+class ProfileCache:
+    """
+    Процессный LRU-кэш профилей пользователей (строк users) с поиском
+    и по tg_id, и по внутреннему id. Объекты User отсоединены от сессии
+    (expire_on_commit=False), читаются только их колонки.
+    Профиль меняется только при регистрации — handle_timezone обновляет кэш
+    явно; TTL ограничивает устаревание, если профиль изменил другой процесс.
+    """
+
+    def __init__(self, max_users: int, ttl_seconds: int):
+        self.max_users = max_users
+        self.ttl = ttl_seconds
+        # tg_id -> (expires_at, User)
+        self._by_tg_id = OrderedDict()
+        # id -> tg_id
+        self._tg_ids = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_by_tg_id(self, tg_id: int):
+        user = self._lookup(tg_id)
+        if user is not None:
+            self.hits += 1
+            return user
+        self.misses += 1
+        return await self._load(User.tg_id == tg_id)
+
+    async def get_by_id(self, user_id: int):
+        tg_id = self._tg_ids.get(user_id)
+        user = self._lookup(tg_id) if tg_id is not None else None
+        if user is not None:
+            self.hits += 1
+            return user
+        self.misses += 1
+        return await self._load(User.id == user_id)
+
+    def put(self, user: User):
+        """Кладёт свежий профиль (например, сразу после сохранения регистрации)."""
+        self.invalidate(user.tg_id)
+        self._by_tg_id[user.tg_id] = (time.monotonic() + self.ttl, user)
+        self._tg_ids[user.id] = user.tg_id
+        while len(self._by_tg_id) > self.max_users:
+            _, (_, evicted) = self._by_tg_id.popitem(last=False)
+            self._tg_ids.pop(evicted.id, None)
+
+    def invalidate(self, tg_id: int):
+        cached = self._by_tg_id.pop(tg_id, None)
+        if cached is not None:
+            self._tg_ids.pop(cached[1].id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "users": len(self._by_tg_id),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _lookup(self, tg_id: int):
+        cached = self._by_tg_id.get(tg_id)
+        if cached is None:
+            return None
+        expires_at, user = cached
+        if expires_at <= time.monotonic():
+            self.invalidate(tg_id)
+            return None
+        self._by_tg_id.move_to_end(tg_id)
+        return user
+
+    async def _load(self, condition):
+        async with AsyncSessionLocal() as db_session:
+            user = (await db_session.execute(select(User).where(condition))).scalars().first()
+        # Незарегистрированных не кэшируем: после регистрации профиль появится сразу
+        if user is not None:
+            self.put(user)
+        return user
+
+
+profile_cache = ProfileCache(max_users=PROFILE_CACHE_MAX_USERS, ttl_seconds=PROFILE_CACHE_TTL_SECONDS)
+
+registry.gauge("fitai_profile_cache_users", "Профилей в кэше", lambda: len(profile_cache._by_tg_id))
+registry.counter_from("fitai_profile_cache_hits_total", "Попаданий в кэш профилей", lambda: profile_cache.hits)
+registry.counter_from("fitai_profile_cache_misses_total", "Промахов кэша профилей", lambda: profile_cache.misses)
@@ -0,0 +1,47 @@
+import datetime
+
+from sqlalchemy import event, select
+
+from db import AsyncSessionLocal, User, async_engine
+from notifications.manager import ActivityTracker
+
+
+def test_flush_writes_all_touches_in_one_update(run, make_user):
+    async def scenario():
+        long_ago = datetime.datetime(2020, 1, 1)
+        users = [
+            await make_user(tg_id=1000 + i, last_active_at=long_ago, inactivity_notified_at=long_ago)
+            for i in range(3)
+        ]
+        tracker = ActivityTracker()
+        for user in users[:2]:
+            tracker.touch(user.id)
+            # Повторная активность того же пользователя — всё ещё одна строка в UPDATE
+            tracker.touch(user.id)
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(async_engine.sync_engine, "before_cursor_execute", count)
+        try:
+            await tracker.flush()
+            # Без новых отметок flush в БД не ходит
+            await tracker.flush()
+        finally:
+            event.remove(async_engine.sync_engine, "before_cursor_execute", count)
+
+        async with AsyncSessionLocal() as db_session:
+            rows = (await db_session.execute(
+                select(User.id, User.last_active_at, User.inactivity_notified_at).order_by(User.id)
+            )).all()
+        return statements, rows
+
+    statements, rows = run(scenario())
+    assert [s.split()[0] for s in statements] == ["UPDATE"]
+    for _, last_active_at, notified_at in rows[:2]:
+        assert last_active_at > datetime.datetime(2020, 1, 1)
+        # Пользователь вернулся — напоминание о неактивности снова возможно
+        assert notified_at is None
+    assert rows[2][1:] == (datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 1))
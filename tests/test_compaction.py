@@ -0,0 +1,77 @@
+import asyncio
+
+from langchain.schema import AIMessage, HumanMessage
+from sqlalchemy import select
+
+import history.compaction
+from db import AsyncSessionLocal, ConversationSummary
+from history.compaction import SummaryManager, estimate_tokens, take_chunk
+
+
+def _pending(count: int, chars: int = 300) -> list:
+    return [
+        (msg_id, HumanMessage(content="ж" * chars) if msg_id % 2 else AIMessage(content="о" * chars))
+        for msg_id in range(1, count + 1)
+    ]
+
+
+def test_take_chunk_respects_budget_and_keeps_order():
+    pending = _pending(10, chars=300)
+    chunk, rest = take_chunk(pending, budget_tokens=350)
+    assert [i for i, _ in chunk] == [1, 2, 3]
+    assert [i for i, _ in rest] == list(range(4, 11))
+
+    # Сообщение длиннее бюджета всё равно уходит отдельной частью
+    chunk, rest = take_chunk(_pending(2, chars=3000), budget_tokens=100)
+    assert len(chunk) == 1 and len(rest) == 1
+
+
+def test_long_history_is_folded_in_bounded_chunks(run, make_user, monkeypatch):
+    prompts = []
+
+    async def fake_invoke(messages, priority="chat", **kwargs):
+        prompts.append(messages[0].content)
+        return AIMessage(content=f"summary {len(prompts)}")
+
+    monkeypatch.setattr(history.compaction, "invoke", fake_invoke)
+
+    async def scenario():
+        user = await make_user()
+        manager = SummaryManager(max_users=10, chunk_tokens=1000, retry_seconds=60, retry_max_seconds=600)
+        await manager._refresh(user.id, None, _pending(2000))
+        async with AsyncSessionLocal() as db_session:
+            return (await db_session.execute(
+                select(ConversationSummary).filter_by(user_id=user.id)
+            )).scalars().one()
+
+    row = run(scenario())
+    assert len(prompts) > 1
+    # Каждый запрос: часть сообщений (<= 1000 токенов) + инструкция и прежний summary
+    assert max(estimate_tokens(p) for p in prompts) < 1300
+    assert row.last_message_id == 2000
+    assert row.content == f"summary {len(prompts)}"
+    # Следующая часть строится на summary предыдущей
+    assert "summary 1" in prompts[1]
+
+
+def test_failed_refresh_backs_off(run, make_user, monkeypatch):
+    calls = []
+
+    async def failing_invoke(messages, priority="chat", **kwargs):
+        calls.append(priority)
+        raise RuntimeError("context length exceeded")
+
+    monkeypatch.setattr(history.compaction, "invoke", failing_invoke)
+
+    async def scenario():
+        user = await make_user()
+        manager = SummaryManager(max_users=10, chunk_tokens=1000, retry_seconds=60, retry_max_seconds=600)
+        for _ in range(5):
+            manager._schedule_refresh(user.id, None, _pending(10))
+            await asyncio.gather(*manager._tasks.values())
+        return manager
+
+    manager = run(scenario())
+    assert calls == ["background"]
+    assert manager.stats()["failures"] == 1
+    assert manager.stats()["backing_off"] == 1
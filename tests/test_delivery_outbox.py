@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import time
+
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import Chat, Message
+
+from delivery.manager import DeliveryOutbox, TokenBucket
+from init_bot import bot
+
+
+class LimitedBotAPI(BaseSession):
+    """
+    Bot API с лимитом «не чаще chat_rate сообщений в секунду в один чат»:
+    на нарушение, как и Telegram, отвечает 429 с retry_after.
+    Чаты из flood_chats получают 429 на первый запрос.
+    """
+
+    def __init__(self, chat_rate: float, flood_chats=(), retry_after: int = 1):
+        super().__init__()
+        self.chat_interval = 1 / chat_rate
+        self.flood_chats = set(flood_chats)
+        self.retry_after = retry_after
+        # (monotonic, chat_id)
+        self.sent = []
+        self.rejected = []
+
+    async def make_request(self, bot, method, timeout=None):
+        now = time.monotonic()
+        last = [t for t, chat_id in self.sent if chat_id == method.chat_id]
+        # Небольшой допуск на неточность таймеров event loop
+        if method.chat_id in self.flood_chats or (last and now - last[-1] < self.chat_interval * 0.9):
+            self.flood_chats.discard(method.chat_id)
+            self.rejected.append((now, method.chat_id))
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=self.retry_after)
+        self.sent.append((now, method.chat_id))
+        return Message(
+            message_id=len(self.sent),
+            date=datetime.datetime.now(datetime.timezone.utc),
+            chat=Chat(id=method.chat_id, type="private"),
+            text=method.text
+        ).as_(bot)
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+async def _deliver_all(outbox: DeliveryOutbox, messages: list, timeout: float = 10):
+    await outbox.enqueue_many(messages)
+    started = time.monotonic()
+    await outbox.start()
+    try:
+        while outbox.delivered < len(messages):
+            assert time.monotonic() - started < timeout, outbox.stats()
+            await asyncio.sleep(0.02)
+    finally:
+        for task in outbox._tasks:
+            task.cancel()
+        await asyncio.gather(*outbox._tasks, return_exceptions=True)
+    return started
+
+
+def _outbox(chat_rate: float) -> DeliveryOutbox:
+    return DeliveryOutbox(workers=8, global_rate=1000, chat_rate=chat_rate, max_attempts=5,
+                          batch_size=100, poll_interval=0.05, lease=300)
+
+
+def test_busy_chat_does_not_block_other_chats(run, database, monkeypatch):
+    api = LimitedBotAPI(chat_rate=10)
+    monkeypatch.setattr(bot, "session", api)
+    busy = [(1, f"сообщение {i}") for i in range(20)]
+    others = [(100 + i, "напоминание") for i in range(20)]
+
+    async def scenario():
+        outbox = _outbox(chat_rate=10)
+        started = await _deliver_all(outbox, busy + others)
+        assert outbox.deferred > 0
+        return started
+
+    started = run(scenario())
+    assert api.rejected == []
+    busy_times = [t for t, chat_id in api.sent if chat_id == 1]
+    assert len(busy_times) == 20
+    # Двадцать сообщений в один чат идут ~2 с, остальные чаты не ждут за ними
+    assert busy_times[-1] - busy_times[0] >= 19 * 0.1 * 0.9
+    assert max(t for t, chat_id in api.sent if chat_id != 1) - started < 0.5
+
+
+def test_retry_after_pauses_every_chat(run, database, monkeypatch):
+    api = LimitedBotAPI(chat_rate=10, flood_chats=[100], retry_after=1)
+    monkeypatch.setattr(bot, "session", api)
+    # Первым в очереди стоит сообщение, на которое Telegram ответит 429
+    messages = [(100 + i, "напоминание") for i in range(10)]
+
+    async def scenario():
+        outbox = _outbox(chat_rate=10)
+        await _deliver_all(outbox, messages)
+        assert outbox.retried == 1
+
+    run(scenario())
+    (flood_at, _), = api.rejected
+    assert sorted(chat_id for _, chat_id in api.sent) == [chat_id for chat_id, _ in messages]
+    assert all(t < flood_at or t >= flood_at + 1 for t, _ in api.sent)
+    assert any(t >= flood_at + 1 for t, _ in api.sent)
+
+
+def test_token_bucket_reserves_consecutive_slots():
+    bucket = TokenBucket(rate=10, capacity=1)
+    waits = [bucket.reserve() for _ in range(3)]
+    assert waits[0] == 0
+    assert abs(waits[1] - 0.1) < 0.01 and abs(waits[2] - 0.2) < 0.01
+
+    bucket.block(1)
+    # После retry_after слоты идут от конца паузы, а не все сразу
+    after_block = [bucket.reserve() for _ in range(2)]
+    assert 0.99 < after_block[0] < after_block[1]
+    assert abs(after_block[1] - after_block[0] - 0.1) < 0.01
@@ -0,0 +1,122 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+from sqlalchemy import select
+
+import fit_ai
+from db import AsyncSessionLocal, MessageLog
+from dialog.manager import DialogDispatcher
+
+
+class FakeLLM:
+    """GigaChat-заглушка: считает вызовы и одновременные запросы, запоминает промпты."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.prompts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def invoke(self, messages, priority="chat", **kwargs):
+        self.prompts.append([m.content for m in messages])
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return AIMessage(content=f"ответ {len(self.prompts)}", response_metadata={"finish_reason": "stop"})
+
+
+async def _history(user_id: int) -> list:
+    async with AsyncSessionLocal() as db_session:
+        rows = (await db_session.execute(
+            select(MessageLog.role, MessageLog.content)
+            .where(MessageLog.user_id == user_id)
+            .order_by(MessageLog.id.asc())
+        )).all()
+    return [(role, content.split("\n Сообщение отправлено в:")[0]) for role, content in rows]
+
+
+async def _wait_idle(dispatcher: DialogDispatcher):
+    while dispatcher.stats()["active_users"]:
+        await asyncio.sleep(0.01)
+
+
+def _dispatch(dispatcher: DialogDispatcher, user, text: str):
+    async def handler(message, merged_text, plan_command):
+        await fit_ai.FitAI(user.tg_id, user=user).chat(merged_text)
+    dispatcher.submit(user.id, None, text, handler)
+
+
+def test_burst_is_two_llm_calls(run, make_user, monkeypatch):
+    llm = FakeLLM(latency=0.05)
+    monkeypatch.setattr(fit_ai, "invoke", llm.invoke)
+
+    async def scenario():
+        user = await make_user()
+        dispatcher = DialogDispatcher(debounce=0.1, debounce_max=1.0)
+        for text in ("Привет", "хочу похудеть", "что есть на ужин?"):
+            _dispatch(dispatcher, user, text)
+            await asyncio.sleep(0.02)
+        await _wait_idle(dispatcher)
+        assert dispatcher.stats()["turns"] == 2
+        return await _history(user.id)
+
+    history = run(scenario())
+    # Первое сообщение — сразу, остальные пришли во время хода и склеены в следующий
+    assert len(llm.prompts) == 2
+    assert history == [
+        ("user", "Привет"), ("assistant", "ответ 1"),
+        ("user", "хочу похудеть\nчто есть на ужин?"), ("assistant", "ответ 2"),
+    ]
+
+
+def test_idle_chat_and_plan_commands_do_not_wait(run):
+    async def scenario():
+        dispatcher = DialogDispatcher(debounce=10.0, debounce_max=30.0)
+        started = []
+
+        async def handler(message, text, plan_command):
+            started.append((text, plan_command))
+            if text == "первое":
+                # Пока идёт ход, приходят команда плана и ещё одно сообщение
+                dispatcher.submit(1, None, "/meal_plan", handler, plan_command="meal_plan")
+                dispatcher.submit(1, None, "второе", handler)
+
+        dispatcher.submit(1, None, "первое", handler)
+        await asyncio.sleep(0.05)
+        task = dispatcher._queues[1].task
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return started
+
+    # Свободный пользователь и команда плана не ждут debounce,
+    # обычное сообщение после хода ждёт паузу
+    assert run(scenario()) == [("первое", None), ("/meal_plan", "meal_plan")]
+
+
+def test_messages_during_turn_wait_for_it(run, make_user, monkeypatch):
+    llm = FakeLLM(latency=0.3)
+    monkeypatch.setattr(fit_ai, "invoke", llm.invoke)
+
+    async def scenario():
+        user = await make_user()
+        dispatcher = DialogDispatcher(debounce=0.05, debounce_max=1.0)
+        _dispatch(dispatcher, user, "первое")
+        await asyncio.sleep(0.15)
+        # Ход уже ждёт модель: эти сообщения станут следующим ходом, а не параллельным
+        _dispatch(dispatcher, user, "второе")
+        _dispatch(dispatcher, user, "третье")
+        await _wait_idle(dispatcher)
+        return await _history(user.id)
+
+    history = run(scenario())
+    assert len(llm.prompts) == 2
+    assert llm.max_in_flight == 1
+    assert history == [
+        ("user", "первое"), ("assistant", "ответ 1"),
+        ("user", "второе\nтретье"), ("assistant", "ответ 2"),
+    ]
+    # Второй ход видит первый целиком
+    assert "ответ 1" in llm.prompts[1]
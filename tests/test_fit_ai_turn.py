@@ -0,0 +1,95 @@
+import datetime
+import json
+
+from langchain_core.messages import AIMessage
+from sqlalchemy import event, select
+
+import fit_ai
+from db import AsyncSessionLocal, MessageLog, Notification, async_engine
+
+
+class ScriptedLLM:
+    """GigaChat-заглушка: отдаёт заранее заданные ответы и запоминает запросы."""
+
+    def __init__(self, *replies: AIMessage):
+        self.replies = list(replies)
+        self.calls = []
+
+    async def invoke(self, messages, priority="chat", **kwargs):
+        self.calls.append((list(messages), kwargs))
+        return self.replies.pop(0)
+
+
+def _function_call(name: str, arguments: dict) -> AIMessage:
+    return AIMessage(
+        content="",
+        additional_kwargs={"function_call": {"name": name, "arguments": arguments}},
+        response_metadata={"finish_reason": "function_call"}
+    )
+
+
+async def _chat_counting_commits(user, text: str):
+    commits = []
+
+    def count(conn):
+        commits.append(conn)
+
+    event.listen(async_engine.sync_engine, "commit", count)
+    try:
+        reply = await fit_ai.FitAI(user.tg_id, user=user).chat(text)
+    finally:
+        event.remove(async_engine.sync_engine, "commit", count)
+    async with AsyncSessionLocal() as db_session:
+        messages = (await db_session.execute(
+            select(MessageLog.role, MessageLog.function_name).order_by(MessageLog.id)
+        )).all()
+    return reply, len(commits), messages
+
+
+def test_native_call_is_confirmed_by_template(run, make_user, monkeypatch):
+    async def scenario():
+        user = await make_user()
+        when = (datetime.datetime.now() + datetime.timedelta(days=1)).replace(microsecond=0)
+        llm = ScriptedLLM(_function_call("create_notification", {
+            "user_id": str(user.id), "message": "Тренировка", "time": when.isoformat(),
+        }))
+        monkeypatch.setattr(fit_ai, "invoke", llm.invoke)
+        reply, commits, messages = await _chat_counting_commits(user, "Напомни завтра о тренировке")
+        async with AsyncSessionLocal() as db_session:
+            notifications = (await db_session.execute(select(Notification.message))).scalars().all()
+        return llm, reply, commits, messages, notifications
+
+    llm, reply, commits, messages, notifications = run(scenario())
+    # Один запрос к модели: схемы функций переданы структурно, подтверждение — по шаблону
+    (_, kwargs), = llm.calls
+    assert [f["name"] for f in kwargs["functions"]] == ["create_notification", "create_recurring_notification"]
+    assert reply.startswith("Готово! Напоминание «Тренировка» запланировано")
+    assert notifications == ["Тренировка"]
+    assert messages == [
+        ("user", None), ("assistant", None), ("user", "create_notification"), ("assistant", None),
+    ]
+    # Коммит уведомления и один коммит всех сообщений хода
+    assert commits == 2
+
+
+def test_unknown_function_gets_second_round_with_unsaved_messages(run, make_user, monkeypatch):
+    async def scenario():
+        user = await make_user()
+        llm = ScriptedLLM(
+            _function_call("list_notifications", {"user_id": str(user.id)}),
+            AIMessage(content="Напоминаний пока нет.", response_metadata={"finish_reason": "stop"}),
+        )
+        monkeypatch.setattr(fit_ai, "invoke", llm.invoke)
+        reply, commits, messages = await _chat_counting_commits(user, "Какие у меня напоминания?")
+        return llm, reply, commits, messages, user.id
+
+    llm, reply, commits, messages, user_id = run(scenario())
+    assert reply == "Напоминаний пока нет."
+    assert len(llm.calls) == 2
+    # Второй запрос видит ещё не записанные сообщения хода, включая вызов функции
+    second_prompt = [m.content for m in llm.calls[1][0]]
+    assert any("Какие у меня напоминания?" in text for text in second_prompt)
+    assert json.dumps([{"name": "list_notifications", "parameters": {"user_id": str(user_id)}}],
+                      ensure_ascii=False) in second_prompt
+    assert [role for role, _ in messages] == ["user", "assistant", "user", "assistant"]
+    assert commits == 1
@@ -0,0 +1,33 @@
+from function_calling.parser import FunctionCallExtractor, extract_function_calls
+
+
+def _stream(text: str, chunk_chars: int = 1) -> FunctionCallExtractor:
+    extractor = FunctionCallExtractor()
+    for i in range(0, len(text), chunk_chars):
+        extractor.feed(text[i:i + chunk_chars])
+    return extractor
+
+
+def test_fenced_call_streamed_by_characters():
+    reply = '\n ```json\n{"name": "create_notification", "parameters": {"message": "a } \\" ["}}\n```'
+    extractor = _stream(reply)
+    assert extractor.is_function_call
+    assert extractor.finish() == [{"name": "create_notification", "parameters": {"message": 'a } " ['}}]
+
+
+def test_plain_text_is_not_buffered():
+    extractor = FunctionCallExtractor()
+    extractor.feed("  \n")
+    assert not extractor.is_function_call
+    extractor.feed("Тренируйтесь регулярно")
+    for _ in range(1000):
+        extractor.feed(" и следите за питанием")
+    assert not extractor.is_function_call
+    assert len(extractor._text) < 100
+    assert extractor.finish() == []
+
+
+def test_text_after_calls_keeps_calls():
+    assert extract_function_calls('[{"name": "a"}, 1, {"name": "b"}] Готово') == [{"name": "a"}, {"name": "b"}]
+    extractor = _stream('{"name": "a"} Готово', chunk_chars=3)
+    assert extractor.is_function_call
@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+from langchain_core.messages import HumanMessage
+
+import llm.manager
+from llm.manager import GigaChatPool, LLMExecutor
+
+
+class FakeGigaChatServer:
+    """
+    Локальный HTTP-сервер с API GigaChat: считает запросы токена и соединения
+    к API (каждое новое соединение — это то, что в бою стоило бы TLS-рукопожатия).
+    """
+
+    def __init__(self, token_ttl: float):
+        self.token_ttl = token_ttl
+        self.token_requests = 0
+        self.api_connections = set()
+        self.unauthorized = 0
+        self.tokens = []
+        self.revoked = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/api/v2/oauth", self._oauth)
+        app.router.add_get("/api/v1/models", self._models)
+        app.router.add_post("/api/v1/chat/completions", self._chat)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def _authorized(self, request) -> bool:
+        self.api_connections.add(request.transport.get_extra_info("peername"))
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if token not in self.tokens or token in self.revoked:
+            self.unauthorized += 1
+            return False
+        return True
+
+    async def _oauth(self, request):
+        self.token_requests += 1
+        token = f"token-{self.token_requests}"
+        self.tokens.append(token)
+        return web.json_response({
+            "access_token": token,
+            "expires_at": int((time.time() + self.token_ttl) * 1000),
+        })
+
+    async def _models(self, request):
+        if not self._authorized(request):
+            return web.Response(status=401)
+        return web.json_response({"data": [], "object": "list"})
+
+    async def _chat(self, request):
+        if not self._authorized(request):
+            return web.Response(status=401)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        return web.json_response({
+            "choices": [{"message": {"role": "assistant", "content": "Ок"}, "index": 0, "finish_reason": "stop"}],
+            "created": int(time.time()),
+            "model": "GigaChat",
+            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            "object": "chat.completion",
+        })
+
+
+async def _started(monkeypatch, token_ttl: float, size: int = 4, refresh_margin: int = 120):
+    server = FakeGigaChatServer(token_ttl=token_ttl)
+    await server.start()
+    monkeypatch.setattr(llm.manager, "GIGACHAT_BASE_URL", f"{server.url}/api/v1")
+    monkeypatch.setattr(llm.manager, "GIGACHAT_AUTH_URL", f"{server.url}/api/v2/oauth")
+    pool = GigaChatPool(size=size, refresh_margin=refresh_margin, use_async=True)
+    await pool.start()
+    return server, pool
+
+
+async def _ask(pool: GigaChatPool):
+    async with pool.acquire() as client:
+        return await client.ainvoke([HumanMessage(content="Привет")])
+
+
+def test_start_warms_connections_and_requests_are_reused(run, monkeypatch):
+    async def scenario():
+        server, pool = await _started(monkeypatch, token_ttl=3600)
+        try:
+            warmed = (server.token_requests, len(server.api_connections), pool.warmed)
+            replies = await asyncio.gather(*(_ask(pool) for _ in range(40)))
+            return warmed, replies, server
+        finally:
+            await pool.stop()
+            await server.stop()
+
+    warmed, replies, server = run(scenario())
+    # Один токен на весь пул и по соединению на клиента уже при старте
+    assert warmed == (1, 4, 4)
+    assert all(r.content == "Ок" for r in replies)
+    # 40 запросов не открыли ни одного нового соединения и не запросили токен
+    assert len(server.api_connections) == 4
+    assert server.token_requests == 1
+    assert server.unauthorized == 0
+
+
+def test_token_is_refreshed_by_expires_at_before_api_rejects_it(run, monkeypatch):
+    async def scenario():
+        # Токен живёт на секунду дольше запаса обновления — пул обязан сменить его сам
+        server, pool = await _started(monkeypatch, token_ttl=121, refresh_margin=120)
+        try:
+            await asyncio.sleep(1.5)
+            server.revoked.add(server.tokens[0])
+            await asyncio.gather(*(_ask(pool) for _ in range(8)))
+            return server
+        finally:
+            await pool.stop()
+            await server.stop()
+
+    server = run(scenario())
+    assert server.token_requests >= 2
+    assert server.unauthorized == 0
+
+
+def test_token_obtained_by_sdk_after_401_is_shared(run, monkeypatch):
+    async def scenario():
+        server, pool = await _started(monkeypatch, token_ttl=3600, size=4)
+        try:
+            # API досрочно отозвал токен: первый запрос получит 401 и SDK возьмёт новый
+            server.revoked.add(server.tokens[0])
+            await _ask(pool)
+            await asyncio.gather(*(_ask(pool) for _ in range(8)))
+            return server, pool.stats()
+        finally:
+            await pool.stop()
+            await server.stop()
+
+    server, stats = run(scenario())
+    assert server.unauthorized == 1
+    assert server.token_requests == 2
+    assert stats["token_requests"] == 2
+
+
+@pytest.mark.parametrize("use_async", [True, False])
+def test_executor_bounds_requests_in_flight(run, monkeypatch, use_async):
+    async def scenario():
+        server, pool = await _started(monkeypatch, token_ttl=3600, size=8)
+        monkeypatch.setattr(llm.manager, "gigachat_pool", pool)
+        executor = LLMExecutor(max_in_flight=3, use_async=use_async,
+                               priority_limits={"chat": 3}, queue_capacity={"chat": 100})
+        try:
+            replies = await asyncio.gather(*(
+                executor.invoke([HumanMessage(content="Привет")]) for _ in range(20)
+            ))
+            return server, replies, executor
+        finally:
+            await pool.stop()
+            await server.stop()
+
+    server, replies, executor = run(scenario())
+    assert all(r.content == "Ок" for r in replies)
+    # Клиентов в пуле больше, но к API одновременно идут не больше max_in_flight запросов
+    assert server.max_in_flight == 3
+    assert executor.stats()["calls"] == 20
+    if use_async:
+        assert executor._executor is None
+    else:
+        # Синхронный путь — в собственном пуле потоков, а не в default executor'е event loop
+        assert executor._executor._max_workers == 3
+        executor._executor.shutdown()
@@ -0,0 +1,91 @@
+from sqlalchemy import insert
+
+from config import HISTORY_CACHE_MAX_BYTES
+from db import AsyncSessionLocal, MessageLog
+from history.manager import HistoryCache
+
+
+async def _insert(user_id: int, msg_id: int, content: str):
+    async with AsyncSessionLocal() as db_session:
+        await db_session.execute(insert(MessageLog).values(
+            id=msg_id, user_id=user_id, role="user", content=content
+        ))
+        await db_session.commit()
+
+
+def test_tail_reload_picks_up_rows_committed_out_of_order(run, make_user):
+    async def scenario():
+        user = await make_user()
+        cache = HistoryCache(max_users=10, max_bytes=HISTORY_CACHE_MAX_BYTES)
+        await _insert(user.id, 10, "первое")
+        await _insert(user.id, 30, "третье")
+        assert (await cache.get_with_ids(user.id))[0] == [10, 30]
+
+        # Строка с меньшим id закоммичена после того, как кэш уже видел id=30
+        await _insert(user.id, 20, "второе")
+        ids, messages = await cache.get_with_ids(user.id)
+        assert ids == [10, 20, 30]
+        assert [m.content for m in messages] == ["первое", "второе", "третье"]
+
+    run(scenario())
+
+
+def test_write_through_does_not_hide_earlier_rows(run, make_user):
+    async def scenario():
+        user = await make_user()
+        cache = HistoryCache(max_users=10, max_bytes=HISTORY_CACHE_MAX_BYTES)
+        await _insert(user.id, 10, "первое")
+        await cache.get_with_ids(user.id)
+
+        await _insert(user.id, 20, "другой процесс")
+        await _insert(user.id, 30, "свой ход")
+        async with AsyncSessionLocal() as db_session:
+            cache.append(user.id, await db_session.get(MessageLog, 30))
+
+        ids, _ = await cache.get_with_ids(user.id)
+        assert ids == [10, 20, 30]
+        assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+    run(scenario())
+
+
+class _InvalidatingSession:
+    """Сессия, во время запроса которой кэш инвалидирует пользователя (как параллельный ход)."""
+
+    def __init__(self, cache: HistoryCache, user_id: int):
+        self.cache = cache
+        self.user_id = user_id
+        self._session = AsyncSessionLocal()
+
+    async def __aenter__(self):
+        await self._session.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self._session.__aexit__(*exc)
+
+    async def execute(self, query):
+        self.cache.invalidate(self.user_id)
+        return await self._session.execute(query)
+
+
+def test_invalidate_during_load_keeps_byte_count(run, make_user, monkeypatch):
+    import history.manager
+
+    async def scenario():
+        user = await make_user()
+        cache = HistoryCache(max_users=10, max_bytes=HISTORY_CACHE_MAX_BYTES)
+        await _insert(user.id, 10, "первое")
+        await _insert(user.id, 20, "второе")
+        monkeypatch.setattr(history.manager, "AsyncSessionLocal", lambda: _InvalidatingSession(cache, user.id))
+        ids, _ = await cache.get_with_ids(user.id)
+        # Загруженная история отдаётся, но в кэше её нет — и байты за неё не числятся
+        assert ids == [10, 20]
+        assert cache.stats()["users"] == 0 and cache.stats()["bytes"] == 0
+
+        monkeypatch.setattr(history.manager, "AsyncSessionLocal", AsyncSessionLocal)
+        await cache.get_with_ids(user.id)
+        entry = cache._entries[user.id]
+        assert cache.stats()["bytes"] == entry.size
+
+    run(scenario())
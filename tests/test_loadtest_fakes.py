@@ -0,0 +1,15 @@
+from aiogram import Bot
+
+from loadtest.fakes import FakeTelegramSession
+
+
+def test_fake_session_downloads_canned_file(run):
+    session = FakeTelegramSession(lambda: 0.0, file_content=b"0123456789")
+
+    async def scenario():
+        bot = Bot("123456:fitai-test-token", session=session)
+        downloaded = await bot.download_file("photos/file_0.jpg", chunk_size=4)
+        return downloaded.read()
+
+    assert run(scenario()) == b"0123456789"
+    assert session.requests == 1
@@ -0,0 +1,76 @@
+import aiohttp
+
+from metrics.manager import MetricsRegistry, registry, start_metrics_server
+
+
+def test_counter_and_gauge_text_format():
+    metrics = MetricsRegistry()
+    sent = metrics.counter("fitai_sent_total", "Отправлено", labelnames=("kind",))
+    sent.inc(kind="regular")
+    sent.inc(2, kind='say "hi"\n')
+    metrics.gauge("fitai_queue", "Очередь", lambda: 7)
+    metrics.counter_from("fitai_errors_total", "Ошибки", lambda: 1.5)
+    # Упавший callback не ломает остальной вывод
+    metrics.gauge("fitai_broken", "Сломан", lambda: 1 / 0)
+
+    assert metrics.render().splitlines() == [
+        "# HELP fitai_sent_total Отправлено",
+        "# TYPE fitai_sent_total counter",
+        'fitai_sent_total{kind="regular"} 1',
+        'fitai_sent_total{kind="say \\"hi\\"\\n"} 2',
+        "# HELP fitai_queue Очередь",
+        "# TYPE fitai_queue gauge",
+        "fitai_queue 7",
+        "# HELP fitai_errors_total Ошибки",
+        "# TYPE fitai_errors_total counter",
+        "fitai_errors_total 1.5",
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = MetricsRegistry()
+    latency = metrics.histogram("fitai_latency_seconds", "Время", buckets=(1, 0.1), labelnames=("method",))
+    # Граница корзины включается в неё (le — «меньше или равно»)
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, method="invoke")
+
+    assert latency.render() == [
+        "# HELP fitai_latency_seconds Время",
+        "# TYPE fitai_latency_seconds histogram",
+        'fitai_latency_seconds_bucket{method="invoke",le="0.1"} 2',
+        'fitai_latency_seconds_bucket{method="invoke",le="1"} 3',
+        'fitai_latency_seconds_bucket{method="invoke",le="+Inf"} 4',
+        'fitai_latency_seconds_sum{method="invoke"} 3.65',
+        'fitai_latency_seconds_count{method="invoke"} 4',
+    ]
+
+
+def test_repeated_registration_returns_same_metric():
+    metrics = MetricsRegistry()
+    first = metrics.counter("fitai_total", "Всего")
+    assert metrics.counter("fitai_total", "Всего") is first
+
+
+def test_endpoint_serves_bot_metrics(run):
+    # Импорт модулей бота регистрирует их метрики в общем реестре
+    import delivery.manager  # noqa: F401
+    import llm.manager  # noqa: F401
+
+    async def scenario():
+        runner = await start_metrics_server(host="127.0.0.1", port=0)
+        try:
+            port = runner.addresses[0][1]
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    return response.headers["Content-Type"], await response.text()
+        finally:
+            await runner.cleanup()
+
+    content_type, body = run(scenario())
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert body == registry.render()
+    assert "# TYPE fitai_llm_in_flight gauge" in body
+    # Каждая строка — комментарий или «имя{метки} число»
+    for line in body.splitlines():
+        if not line.startswith("# "):
+            float(line.rsplit(" ", 1)[1])
@@ -0,0 +1,151 @@
+"""
+Несколько процессов бота на одной БД: каждое уведомление, напоминание
+о неактивности и сообщение outbox должно достаться ровно одному процессу.
+"""
+import asyncio
+import datetime
+import multiprocessing
+import random
+
+from sqlalchemy import func, insert, select
+
+import config
+
+INSTANCES = 4
+NOTIFICATIONS = 300
+INACTIVE_USERS = 100
+
+
+def _instance(database_url: str, notification_ids: list, barrier, results):
+    """Процесс «экземпляра бота»: настройки те же, что в conftest, но в новом интерпретаторе."""
+    config.debug_mode = False
+    config.TELEGRAM_BOT_TOKEN = "123456:fitai-test-token"
+    config.SQLALCHEMY_ASYNC_DATABASE_URI = database_url
+
+    async def main():
+        from db import async_engine
+        from delivery.manager import outbox
+        from notifications.manager import deliver_notifications, sweep_inactive_users
+
+        async def phase():
+            await asyncio.to_thread(barrier.wait)
+
+        try:
+            # Все экземпляры одновременно видят одни и те же наступившие уведомления
+            ids = list(notification_ids)
+            random.shuffle(ids)
+            await phase()
+            delivered = 0
+            for i in range(0, len(ids), 25):
+                delivered += await deliver_notifications(ids[i:i + 25])
+
+            await phase()
+            await sweep_inactive_users(batch_size=10)
+
+            await phase()
+            claimed = []
+            while True:
+                rows = await outbox._claim(20)
+                if not rows:
+                    break
+                claimed.extend(row.id for row in rows)
+            return delivered, claimed
+        finally:
+            await async_engine.dispose()
+
+    results.put(asyncio.run(main()))
+
+
+def test_instances_split_work_without_duplicates(run, make_user):
+    from db import AsyncSessionLocal, Notification, OutboxMessage, User
+
+    async def prepare():
+        now = datetime.datetime.utcnow()
+        user = await make_user()
+        async with AsyncSessionLocal() as db_session:
+            notification_ids = (await db_session.execute(
+                insert(Notification).returning(Notification.id),
+                [{"user_id": user.id, "time_utc": now - datetime.timedelta(seconds=5),
+                  "message": f"напоминание {i}", "kind": "regular"} for i in range(NOTIFICATIONS)]
+            )).scalars().all()
+            await db_session.execute(insert(User), [
+                {"tg_id": 5000 + i, "name": "Тест", "age": 30, "sex": "Мужской", "timezone": "UTC",
+                 "last_active_at": now - datetime.timedelta(days=30)}
+                for i in range(INACTIVE_USERS)
+            ])
+            await db_session.commit()
+        return list(notification_ids)
+
+    notification_ids = run(prepare())
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(INSTANCES)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_instance,
+                        args=(config.SQLALCHEMY_ASYNC_DATABASE_URI, notification_ids, barrier, results))
+        for _ in range(INSTANCES)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    delivered = [count for count, _ in outcomes]
+    claimed = [row_id for _, ids in outcomes for row_id in ids]
+    assert sum(delivered) == NOTIFICATIONS
+    # Работу действительно делили, а не выполнил один процесс
+    assert sum(1 for count in delivered if count) > 1
+    assert len(claimed) == len(set(claimed)) == NOTIFICATIONS + INACTIVE_USERS
+
+    async def check():
+        async with AsyncSessionLocal() as db_session:
+            unsent = (await db_session.execute(
+                select(func.count()).select_from(Notification).where(Notification.sent_at.is_(None))
+            )).scalar_one()
+            per_chat = (await db_session.execute(
+                select(OutboxMessage.chat_id, OutboxMessage.text, func.count())
+                .group_by(OutboxMessage.chat_id, OutboxMessage.text)
+                .having(func.count() > 1)
+            )).all()
+        return unsent, per_chat
+
+    unsent, duplicates = run(check())
+    assert unsent == 0
+    assert duplicates == []
+
+
+def test_restarted_worker_gets_fresh_queue():
+    from cluster.manager import Supervisor
+
+    supervisor = Supervisor(1, queue_size=10, target=None)
+    old = supervisor._context.Queue(maxsize=10)
+    supervisor._queues.append(old)
+    for update_id in range(3):
+        old.put({"update_id": update_id})
+    # Дожидаемся, пока фоновый поток очереди запишет апдейты в канал
+    while old.empty():
+        pass
+
+    supervisor._replace_queue(0)
+    fresh = supervisor._queues[0]
+    assert fresh is not old
+    assert [fresh.get(timeout=5)["update_id"] for _ in range(3)] == [0, 1, 2]
+
+
+def test_workers_share_llm_limits(monkeypatch):
+    from llm.manager import gigachat_pool, llm_executor, share_limits
+
+    for name in ("size", "_slots"):
+        monkeypatch.setattr(gigachat_pool, name, getattr(gigachat_pool, name))
+    for name in ("max_in_flight", "_gate"):
+        monkeypatch.setattr(llm_executor, name, getattr(llm_executor, name))
+
+    share_limits(INSTANCES)
+    assert gigachat_pool.size == config.GIGACHAT_POOL_SIZE // INSTANCES
+    assert llm_executor.max_in_flight == config.LLM_MAX_IN_FLIGHT // INSTANCES
+    assert llm_executor._gate.limits == {
+        p: max(1, limit // INSTANCES) for p, limit in config.LLM_PRIORITY_LIMITS.items()
+    }
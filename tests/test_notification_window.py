@@ -0,0 +1,75 @@
+import asyncio
+import datetime
+
+import pytz
+from sqlalchemy import select
+
+from db import AsyncSessionLocal, Notification, OutboxMessage, to_naive_utc
+from notifications.manager import NotificationDispatcher
+
+
+def _now() -> datetime.datetime:
+    return to_naive_utc(datetime.datetime.now(tz=pytz.utc))
+
+
+async def _add(user, time_utc: datetime.datetime, message: str, **fields) -> int:
+    async with AsyncSessionLocal() as db_session:
+        notification = Notification(user_id=user.id, time_utc=time_utc, message=message, **fields)
+        db_session.add(notification)
+        await db_session.commit()
+    return notification.id
+
+
+def test_refill_loads_only_the_window(run, make_user):
+    async def scenario():
+        user = await make_user()
+        now = _now()
+        soon = await _add(user, now + datetime.timedelta(minutes=2), "скоро")
+        late = await _add(user, now - datetime.timedelta(seconds=30), "в пределах grace")
+        await _add(user, now - datetime.timedelta(minutes=10), "давно прошло")
+        await _add(user, now + datetime.timedelta(hours=2), "за окном")
+        await _add(user, now + datetime.timedelta(minutes=1), "уже отправлено", sent_at=now)
+        await _add(user, now + datetime.timedelta(minutes=1), "устаревший тип", kind="inactivity")
+
+        dispatcher = NotificationDispatcher(window=300, refill_interval=60, grace=60)
+        await dispatcher.refill()
+        loaded = sorted(notification_id for _, notification_id, _, _ in dispatcher._heap)
+
+        # Новое уведомление попадает в кучу, только если оно внутри окна
+        dispatcher.add(1001, now + datetime.timedelta(minutes=3), user.tg_id, "внутри")
+        dispatcher.add(1002, now + datetime.timedelta(hours=1), user.tg_id, "снаружи")
+        # Повторное пополнение не дублирует уже загруженные
+        await dispatcher.refill()
+        return loaded, [soon, late], dispatcher.stats()
+
+    loaded, expected, stats = run(scenario())
+    assert loaded == sorted(expected)
+    assert stats["window_size"] == 3
+
+
+def test_due_notification_is_delivered_once(run, make_user):
+    async def scenario():
+        user = await make_user()
+        notification_id = await _add(user, _now() + datetime.timedelta(seconds=0.3), "Время тренировки!")
+        dispatcher = NotificationDispatcher(window=300, refill_interval=60, grace=60)
+        await dispatcher.start()
+        try:
+            while dispatcher.sent < 1:
+                await asyncio.sleep(0.05)
+            # Отправленное уведомление новое пополнение окна не возвращает
+            await dispatcher.refill()
+            stats = dispatcher.stats()
+        finally:
+            for task in list(dispatcher._tasks):
+                task.cancel()
+            await asyncio.gather(*dispatcher._tasks, return_exceptions=True)
+
+        async with AsyncSessionLocal() as db_session:
+            notification = await db_session.get(Notification, notification_id)
+            staged = (await db_session.execute(select(OutboxMessage.chat_id, OutboxMessage.text))).all()
+        return stats, notification.sent_at, staged, user.tg_id
+
+    stats, sent_at, staged, tg_id = run(scenario())
+    assert (stats["sent"], stats["window_size"], stats["in_progress"]) == (1, 0, 0)
+    assert sent_at is not None
+    assert staged == [(tg_id, "Время тренировки!")]
@@ -0,0 +1,148 @@
+import asyncio
+import contextlib
+
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+import fit_ai
+import llm.manager
+from llm.manager import LLMBusyError, LLMExecutor, PriorityGate
+
+LIMITS = {"chat": 4, "plan": 2, "background": 1}
+
+
+async def _queue(gate: PriorityGate, priority: str, granted: list) -> asyncio.Task:
+    """Запрос, который после допуска записывает свой класс в granted и держит слот до release."""
+    async def request():
+        await gate.acquire(priority)
+        granted.append(priority)
+
+    task = asyncio.create_task(request())
+    # Даём запросу встать в очередь в порядке вызова
+    await asyncio.sleep(0)
+    return task
+
+
+def test_freed_slot_goes_to_highest_priority(run):
+    async def scenario():
+        gate = PriorityGate(max_in_flight=1, limits=LIMITS, capacities={p: 10 for p in LIMITS})
+        await gate.acquire("background")
+        granted = []
+        # Пришли в порядке, обратном приоритету
+        tasks = [await _queue(gate, p, granted) for p in ("background", "plan", "plan", "chat")]
+        for _ in tasks:
+            gate.release(granted[-1] if granted else "background")
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return granted
+
+    assert run(scenario()) == ["chat", "plan", "plan", "background"]
+
+
+def test_class_at_its_limit_does_not_block_others(run):
+    async def scenario():
+        gate = PriorityGate(max_in_flight=3, limits=LIMITS, capacities={p: 10 for p in LIMITS})
+        granted = []
+        await gate.acquire("plan")
+        await gate.acquire("plan")
+        # Третий plan ждёт своего лимита, а не общего слота — background его обходит
+        waiting_plan = await _queue(gate, "plan", granted)
+        background = await _queue(gate, "background", granted)
+        assert granted == ["background"]
+        assert gate.queued("plan") == 1
+        gate.release("plan")
+        await asyncio.gather(waiting_plan, background)
+        return granted, gate.in_flight
+
+    granted, in_flight = run(scenario())
+    assert granted == ["background", "plan"]
+    assert in_flight == {"chat": 0, "plan": 2, "background": 1}
+
+
+def test_full_queue_rejects_immediately(run):
+    async def scenario():
+        gate = PriorityGate(max_in_flight=1, limits=LIMITS, capacities={"chat": 1, "plan": 0})
+        await gate.acquire("chat")
+        granted = []
+        queued = await _queue(gate, "chat", granted)
+        with pytest.raises(LLMBusyError) as busy:
+            await gate.acquire("chat")
+        assert busy.value.priority == "chat"
+        # Класс без очереди отклоняется сразу, как только нет свободного слота
+        with pytest.raises(LLMBusyError):
+            await gate.acquire("plan")
+        gate.release("chat")
+        await queued
+        return granted, gate.rejected, gate.queued()
+
+    granted, rejected, queued = run(scenario())
+    assert granted == ["chat"]
+    assert rejected == {"chat": 1, "plan": 1, "background": 0}
+    assert queued == 0
+
+
+def test_cancelled_waiter_does_not_leak_slot(run):
+    async def scenario():
+        gate = PriorityGate(max_in_flight=1, limits=LIMITS, capacities={p: 10 for p in LIMITS})
+        await gate.acquire("chat")
+        cancelled = await _queue(gate, "chat", [])
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        gate.release("chat")
+        return gate.total_in_flight, gate.queued()
+
+    assert run(scenario()) == (0, 0)
+
+
+def test_busy_executor_rejects_before_taking_client(run):
+    async def scenario():
+        executor = LLMExecutor(max_in_flight=1, use_async=True,
+                               priority_limits={"chat": 1}, queue_capacity={"chat": 0})
+        await executor._gate.acquire("chat")
+        with pytest.raises(LLMBusyError):
+            await executor.invoke([], priority="chat")
+        return executor.stats()
+
+    stats = run(scenario())
+    assert stats["priorities"]["chat"]["rejected"] == 1
+    assert stats["calls"] == 0 and stats["errors"] == 0
+
+
+class _EndlessStreamPool:
+    """Пул из одного клиента, поток которого не кончается; считает занятых клиентов."""
+
+    def __init__(self):
+        self.busy = 0
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        self.busy += 1
+        try:
+            yield self
+        finally:
+            self.busy -= 1
+
+    async def astream(self, messages, **kwargs):
+        while True:
+            await asyncio.sleep(0)
+            yield AIMessageChunk(content="Тренируйтесь ")
+
+
+def test_stream_slot_returns_when_consumer_fails(run, monkeypatch):
+    pool = _EndlessStreamPool()
+    executor = LLMExecutor(max_in_flight=1, use_async=True,
+                           priority_limits={"chat": 1}, queue_capacity={"chat": 0})
+    monkeypatch.setattr(llm.manager, "gigachat_pool", pool)
+    monkeypatch.setattr(llm.manager, "llm_executor", executor)
+
+    async def on_partial(text):
+        # Например, правка сообщения в Telegram упала
+        raise RuntimeError("edit failed")
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await fit_ai.FitAI(1)._complete([HumanMessage(content="Привет")], on_partial=on_partial)
+        # Слот и клиент возвращены сразу, а не когда сборщик мусора доберётся до генератора
+        return executor.in_flight, pool.busy
+
+    assert run(scenario()) == (0, 0)
@@ -0,0 +1,69 @@
+import time
+
+from sqlalchemy import update
+
+import profiles.manager
+from db import AsyncSessionLocal, User
+from profiles.manager import ProfileCache
+
+
+def _user(user_id: int) -> User:
+    return User(id=user_id, tg_id=1000 + user_id, name=f"Пользователь {user_id}")
+
+
+def test_tg_id_and_id_lookups_share_one_entry(run, make_user):
+    async def scenario():
+        user = await make_user()
+        cache = ProfileCache(max_users=10, ttl_seconds=60)
+        by_tg_id = await cache.get_by_tg_id(user.tg_id)
+        by_id = await cache.get_by_id(user.id)
+        assert by_id is by_tg_id
+        assert cache._tg_ids == {user.id: user.tg_id}
+        return cache.stats()
+
+    stats = run(scenario())
+    assert (stats["hits"], stats["misses"], stats["users"]) == (1, 1, 1)
+
+
+def test_expired_profile_is_reloaded(run, make_user, monkeypatch):
+    offset = 0
+    monotonic = time.monotonic
+    monkeypatch.setattr(profiles.manager.time, "monotonic", lambda: monotonic() + offset)
+
+    async def scenario():
+        nonlocal offset
+        user = await make_user()
+        cache = ProfileCache(max_users=10, ttl_seconds=60)
+        await cache.get_by_id(user.id)
+        # Профиль изменил другой процесс: до истечения TTL виден старый
+        async with AsyncSessionLocal() as db_session:
+            await db_session.execute(update(User).where(User.id == user.id).values(name="Новое имя"))
+            await db_session.commit()
+        assert (await cache.get_by_id(user.id)).name == "Тест"
+
+        offset = 61
+        reloaded = await cache.get_by_id(user.id)
+        return reloaded.name, cache.stats()
+
+    name, stats = run(scenario())
+    assert name == "Новое имя"
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_lru_eviction_drops_id_mapping(run):
+    async def scenario():
+        cache = ProfileCache(max_users=2, ttl_seconds=60)
+        first, second, third = _user(1), _user(2), _user(3)
+        cache.put(first)
+        cache.put(second)
+        # first использован недавно — вытесняется second
+        assert await cache.get_by_id(first.id) is first
+        cache.put(third)
+        assert list(cache._by_tg_id) == [first.tg_id, third.tg_id]
+        assert cache._tg_ids == {first.id: first.tg_id, third.id: third.tg_id}
+
+        cache.invalidate(first.tg_id)
+        assert cache._tg_ids == {third.id: third.tg_id}
+        assert cache.stats()["users"] == 1
+
+    run(scenario())
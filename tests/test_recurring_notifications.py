@@ -0,0 +1,106 @@
+import datetime
+
+import pytz
+from sqlalchemy import func, select
+
+from db import AsyncSessionLocal, Notification, OutboxMessage, to_naive_utc
+from notifications.manager import (
+    NotificationDispatcher, deliver_notifications, purge_old_notifications,
+    schedule_existing_notifications, scheduler
+)
+from notifications.recurrence import next_occurrence
+
+RULE = "FREQ=DAILY;BYHOUR=9;BYMINUTE=0"
+
+
+def _now() -> datetime.datetime:
+    return to_naive_utc(datetime.datetime.now(tz=pytz.utc))
+
+
+async def _add(user, time_utc: datetime.datetime, recurrence: str = None, sent_at=None) -> int:
+    async with AsyncSessionLocal() as db_session:
+        notification = Notification(
+            user_id=user.id, time_utc=time_utc, message="Время тренировки!",
+            kind="recurring" if recurrence else "regular", recurrence=recurrence, sent_at=sent_at
+        )
+        db_session.add(notification)
+        await db_session.commit()
+    return notification.id
+
+
+async def _get(notification_id: int):
+    async with AsyncSessionLocal() as db_session:
+        return await db_session.get(Notification, notification_id)
+
+
+def test_refill_advances_recurring_missed_during_downtime(run, make_user):
+    async def scenario():
+        user = await make_user()
+        # Бот не работал двое суток: срабатывание давно прошло, строка осталась с sent_at NULL
+        notification_id = await _add(user, _now() - datetime.timedelta(days=2), recurrence=RULE)
+        dispatcher = NotificationDispatcher(window=2 * 86400, refill_interval=60, grace=60)
+        await dispatcher.refill()
+        return user, await _get(notification_id), dispatcher.stats()
+
+    user, notification, stats = run(scenario())
+    assert notification.sent_at is None
+    assert notification.time_utc > _now()
+    expected = next_occurrence(RULE, datetime.datetime.now(tz=pytz.utc), user.timezone)
+    assert notification.time_utc == to_naive_utc(expected)
+    # Перенесённое срабатывание попало в окно
+    assert stats["window_size"] == 1
+
+
+def test_restore_advances_recurring_missed_during_downtime(run, make_user):
+    async def scenario():
+        user = await make_user()
+        notification_id = await _add(user, _now() - datetime.timedelta(hours=3), recurrence=RULE)
+        finished_id = await _add(user, _now() - datetime.timedelta(hours=3),
+                                 recurrence="FREQ=DAILY;BYHOUR=9;UNTIL=20200101T000000Z")
+        try:
+            await schedule_existing_notifications()
+            jobs = [job.args[0] for job in scheduler.get_jobs()]
+        finally:
+            scheduler.remove_all_jobs()
+        return notification_id, jobs, await _get(notification_id), await _get(finished_id)
+
+    notification_id, jobs, notification, finished = run(scenario())
+    assert notification.time_utc > _now()
+    assert jobs == [notification_id]
+    # Закончившееся правило больше не планируется
+    assert finished.sent_at is not None
+
+
+def test_purge_keeps_active_recurring(run, make_user):
+    async def scenario():
+        user = await make_user()
+        old = _now() - datetime.timedelta(days=365)
+        sent_id = await _add(user, old, sent_at=old)
+        finished_id = await _add(user, old, recurrence=RULE, sent_at=old)
+        active_id = await _add(user, old, recurrence=RULE)
+        await purge_old_notifications()
+        return [await _get(i) is not None for i in (sent_id, finished_id, active_id)]
+
+    assert run(scenario()) == [False, False, True]
+
+
+def test_bad_rule_does_not_drop_the_batch(run, make_user):
+    async def scenario():
+        user = await make_user()
+        due = _now() - datetime.timedelta(seconds=5)
+        ids = [
+            await _add(user, due),
+            await _add(user, due, recurrence="FREQ=HOURLY"),
+            await _add(user, due, recurrence=RULE),
+        ]
+        delivered = await deliver_notifications(ids)
+        async with AsyncSessionLocal() as db_session:
+            staged = (await db_session.execute(select(func.count()).select_from(OutboxMessage))).scalar_one()
+        return delivered, staged, [await _get(i) for i in ids]
+
+    delivered, staged, (regular, broken, recurring) = run(scenario())
+    assert delivered == staged == 3
+    assert regular.sent_at is not None
+    # Испорченное правило завершает только своё уведомление
+    assert broken.sent_at is not None
+    assert recurring.sent_at is None and recurring.time_utc > _now()
@@ -0,0 +1,108 @@
+import asyncio
+
+from langchain_core.messages import AIMessage
+
+import fit_ai
+from cache.manager import ResponseCache, profile_cache_key
+from config import RESPONSE_CACHE_MAX_ENTRIES
+
+
+def _cache() -> ResponseCache:
+    return ResponseCache(ttl_hours=1, max_entries=RESPONSE_CACHE_MAX_ENTRIES, memory_entries=10)
+
+
+def test_concurrent_misses_share_one_generation(run, database):
+    async def scenario():
+        cache = _cache()
+        calls = 0
+
+        async def produce():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "план", True
+
+        replies = await asyncio.gather(*(
+            cache.get_or_create("key", "/meal_plan", produce) for _ in range(10)
+        ))
+        assert replies == ["план"] * 10
+        assert calls == 1
+        assert cache.coalesced == 9
+        assert await _cache().get("key") == "план"
+
+    run(scenario())
+
+
+def test_uncacheable_reply_is_not_stored_and_not_shared(run, database):
+    async def scenario():
+        cache = _cache()
+        calls = 0
+
+        async def produce():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "", False
+
+        replies = await asyncio.gather(*(
+            cache.get_or_create("key", "/meal_plan", produce) for _ in range(3)
+        ))
+        assert replies == [""] * 3
+        # Ожидавшие не получают чужой неудачный ответ, а пробуют сами
+        assert calls == 3
+        assert await _cache().get("key") is None
+        assert cache.stats()["inflight"] == 0
+
+    run(scenario())
+
+
+def test_failed_leader_lets_followers_generate(run, database):
+    async def scenario():
+        cache = _cache()
+        calls = 0
+
+        async def produce():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            if calls == 1:
+                raise RuntimeError("GigaChat недоступен")
+            return "план", True
+
+        results = await asyncio.gather(
+            *(cache.get_or_create("key", "/meal_plan", produce) for _ in range(2)),
+            return_exceptions=True
+        )
+        assert isinstance(results[0], RuntimeError)
+        assert results[1] == "план"
+
+    run(scenario())
+
+
+def test_generate_plan_caches_only_completed_replies(run, make_user, monkeypatch):
+    replies = [
+        AIMessage(content="План, обрезанный на полусл", response_metadata={"finish_reason": "length"}),
+        AIMessage(content="", response_metadata={"finish_reason": "stop"}),
+        AIMessage(content="Полный план", response_metadata={"finish_reason": "stop"}),
+    ]
+
+    async def fake_invoke(messages, priority="chat", **kwargs):
+        return replies.pop(0)
+
+    async def scenario():
+        user = await make_user()
+        cache = _cache()
+        monkeypatch.setattr(fit_ai, "response_cache", cache)
+        monkeypatch.setattr(fit_ai, "invoke", fake_invoke)
+        key = profile_cache_key("/meal_plan", user)
+        ai = fit_ai.FitAI(user.tg_id, user=user)
+
+        assert await ai.generate_plan("/meal_plan", "План питания") == "План, обрезанный на полусл"
+        assert await cache.get(key) is None
+        assert await ai.generate_plan("/meal_plan", "План питания") == ""
+        assert await cache.get(key) is None
+        assert await ai.generate_plan("/meal_plan", "План питания") == "Полный план"
+        assert await ai.generate_plan("/meal_plan", "План питания") == "Полный план"
+        assert replies == []
+
+    run(scenario())
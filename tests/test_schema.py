@@ -0,0 +1,140 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy import text
+
+from db import async_engine, init_db_async
+from migrations.manager import _MIGRATIONS_LOCK_KEY
+
+# Горячие запросы (в том виде, в каком их строит код бота) и индексы, которые должны их обслуживать
+HOT_QUERIES = {
+    "ix_users_inactive": """
+        SELECT id, tg_id FROM users
+        WHERE last_active_at <= timezone('utc', now()) - interval '3 days'
+          AND inactivity_notified_at IS NULL
+        ORDER BY last_active_at LIMIT 500
+    """,
+    "ix_notifications_due": """
+        SELECT id, time_utc FROM notifications
+        WHERE time_utc >= timezone('utc', now()) - interval '1 minute'
+          AND time_utc < timezone('utc', now()) + interval '5 minutes'
+          AND sent_at IS NULL AND kind != 'inactivity'
+        ORDER BY time_utc
+    """,
+    "ix_outbox_pending": """
+        SELECT id FROM outbox
+        WHERE status = 'pending' AND next_attempt_at <= timezone('utc', now())
+        ORDER BY next_attempt_at, id LIMIT 100
+    """,
+    "ix_outbox_sending": """
+        SELECT id FROM outbox
+        WHERE status = 'sending' AND next_attempt_at <= timezone('utc', now())
+    """,
+    "ix_messages_user_id_id": """
+        SELECT id, role, content FROM messages WHERE user_id = 1 AND id > 100 ORDER BY id
+    """,
+}
+
+
+async def _explain(sql: str) -> str:
+    async with async_engine.connect() as conn:
+        # На пустых таблицах планировщику дешевле seq scan; проверяем, что индекс вообще применим
+        await conn.execute(text("SET enable_seqscan = off"))
+        rows = (await conn.execute(text("EXPLAIN " + sql))).scalars().all()
+    return "\n".join(rows)
+
+
+async def _index_names() -> set:
+    async with async_engine.connect() as conn:
+        return set((await conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()")
+        )).scalars())
+
+
+@pytest.mark.parametrize("index_name", sorted(HOT_QUERIES))
+def test_hot_query_uses_partial_index(run, database, index_name):
+    plan = run(_explain(HOT_QUERIES[index_name]))
+    assert index_name in plan, plan
+
+
+def test_redundant_full_indexes_are_absent(run, database):
+    names = run(_index_names())
+    assert "ix_users_last_active_at" not in names
+    assert "ix_notifications_time_utc" not in names
+    assert {"ix_users_inactive", "ix_notifications_due"} <= names
+
+
+def test_migration_drops_indexes_left_by_old_schema(run, database):
+    async def scenario():
+        async with async_engine.begin() as conn:
+            await conn.execute(text("CREATE INDEX ix_users_last_active_at ON users (last_active_at)"))
+            await conn.execute(text("CREATE INDEX ix_notifications_time_utc ON notifications (time_utc)"))
+            await conn.execute(text("DELETE FROM schema_migrations WHERE version = 5"))
+        await init_db_async()
+        return await _index_names()
+
+    names = run(scenario())
+    assert "ix_users_last_active_at" not in names
+    assert "ix_notifications_time_utc" not in names
+
+
+def test_create_all_waits_for_migrations_lock(run, database):
+    async def table_exists(conn) -> bool:
+        return (await conn.execute(text("SELECT to_regclass('response_cache') IS NOT NULL"))).scalar()
+
+    async def scenario():
+        async with async_engine.begin() as conn:
+            await conn.execute(text("DROP TABLE response_cache"))
+        async with async_engine.connect() as holder:
+            holder = await holder.execution_options(isolation_level="AUTOCOMMIT")
+            await holder.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _MIGRATIONS_LOCK_KEY})
+            init = asyncio.create_task(init_db_async())
+            await asyncio.sleep(0.3)
+            # Пока замок у другого процесса, create_all не выполняется
+            assert not init.done()
+            assert not await table_exists(holder)
+            await holder.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _MIGRATIONS_LOCK_KEY})
+            await init
+            assert await table_exists(holder)
+
+    run(scenario())
+
+
+async def _set_database_timezone(timezone: str = None):
+    """TimeZone по умолчанию для новых соединений с тестовой базой (None — настройка сервера)."""
+    async with async_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        database = (await conn.execute(text("SELECT current_database()"))).scalar()
+        setting = f"SET timezone = '{timezone}'" if timezone else "RESET timezone"
+        await conn.execute(text(f'ALTER DATABASE "{database}" {setting}'))
+    # Новая настройка действует только в новых соединениях
+    await async_engine.dispose()
+
+
+def test_migration_moves_legacy_notification_times_to_utc(run, make_user):
+    from db import AsyncSessionLocal, Notification
+
+    async def scenario():
+        user = await make_user()
+        async with AsyncSessionLocal() as db_session:
+            # Старый код на сервере с TimeZone=Europe/Moscow: 09:00 UTC сохранилось как 12:00
+            legacy = Notification(user_id=user.id, time_utc=datetime.datetime(2025, 1, 17, 12, 0),
+                                   message="старое", created_at=datetime.datetime(2000, 1, 1))
+            # Новый код пишет naive UTC
+            current = Notification(user_id=user.id, time_utc=datetime.datetime(2025, 1, 17, 9, 0),
+                                   message="новое")
+            db_session.add_all([legacy, current])
+            await db_session.commit()
+        async with async_engine.begin() as conn:
+            await conn.execute(text("DELETE FROM schema_migrations WHERE version = 6"))
+
+        await _set_database_timezone("Europe/Moscow")
+        try:
+            await init_db_async()
+        finally:
+            await _set_database_timezone()
+        async with AsyncSessionLocal() as db_session:
+            return [(await db_session.get(Notification, n.id)).time_utc for n in (legacy, current)]
+
+    assert run(scenario()) == [datetime.datetime(2025, 1, 17, 9, 0)] * 2
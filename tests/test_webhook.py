@@ -0,0 +1,60 @@
+import asyncio
+
+from webhook.manager import WebhookServer
+
+
+def _update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "from": {"id": user_id}, "text": str(update_id)},
+    }
+
+
+def test_updates_of_one_user_are_processed_in_order(run):
+    async def scenario():
+        processed = []
+
+        async def process(data):
+            # Первый апдейт пользователя обрабатывается дольше следующих
+            await asyncio.sleep(0.05 if data["update_id"] % 10 == 0 else 0)
+            processed.append((data["message"]["from"]["id"], data["update_id"]))
+
+        server = WebhookServer(workers=8, queue_size=100, dedup_size=100, process=process)
+        server.start_workers()
+        for user_id in (1, 2):
+            for i in range(5):
+                assert await server.accept(_update(user_id * 10 + i, user_id))
+        await server.stop()
+        return processed
+
+    processed = run(scenario())
+    for user_id in (1, 2):
+        assert [u for uid, u in processed if uid == user_id] == [user_id * 10 + i for i in range(5)]
+
+
+def test_duplicate_is_dropped_while_waiting_for_room(run):
+    async def scenario():
+        release = asyncio.Event()
+        processed = []
+
+        async def process(data):
+            await release.wait()
+            processed.append(data["update_id"])
+
+        server = WebhookServer(workers=2, queue_size=1, dedup_size=100, process=process)
+        server.start_workers()
+        assert await server.accept(_update(1, 1))
+        # Места нет: без ожидания апдейт отклоняется и не запоминается
+        assert not await server.accept(_update(2, 2))
+        waiting = asyncio.create_task(server.accept(_update(2, 2), wait=True))
+        await asyncio.sleep(0)
+        # Повторная доставка, пока первая ждёт места в очереди, — дубликат
+        assert await server.accept(_update(2, 2))
+        release.set()
+        assert await waiting
+        await server.stop()
+        return processed, server.stats()
+
+    processed, stats = run(scenario())
+    assert processed == [1, 2]
+    assert (stats["received"], stats["duplicates"], stats["rejected"], stats["queue_depth"]) == (2, 1, 1, 0)
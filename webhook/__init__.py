@@ -0,0 +1 @@
+# webhook/__init__.py
@@ -0,0 +1,171 @@
+import asyncio
+from collections import OrderedDict
+
+from aiogram.types import Update
+from aiohttp import web
+
+from config import (
+    debug_mode, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DEDUP_SIZE
+)
+from cluster.manager import update_user_id
+from init_bot import bot, dp
+from metrics.manager import registry
+
+_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Приём апдейтов по webhook: обработчик HTTP только проверяет секрет,
+    отбрасывает повторы по update_id и кладёт апдейт в очередь — Telegram
+    сразу получает 200. Сами апдейты разбирает пул из workers фоновых задач;
+    у каждой своя очередь, апдейты одного пользователя всегда попадают в одну
+    и ту же и обрабатываются в порядке поступления. Если принято queue_size
+    ещё не обработанных апдейтов, отвечаем 503: Telegram повторит доставку позже.
+    process — что воркер делает с апдейтом (по умолчанию передаёт его в dp;
+    супервизор с несколькими процессами подменяет его маршрутизацией).
+    """
+
+    def __init__(self, workers: int, queue_size: int, dedup_size: int, process=None):
+        self.workers = workers
+        self.dedup_size = dedup_size
+        self.process = process or _feed_dispatcher
+        self._queues = [asyncio.Queue() for _ in range(workers)]
+        # Места в очередях — общие на все очереди, освобождаются после обработки
+        self._slots = asyncio.Semaphore(queue_size)
+        # Последние принятые update_id (OrderedDict как множество с порядком вставки)
+        self._seen = OrderedDict()
+        self._tasks = []
+        self._runner = None
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.errors = 0
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+        self.start_workers()
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+        await bot.set_webhook(
+            url=WEBHOOK_URL + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        if debug_mode:
+            print(f"[WEBHOOK] Принимаем апдейты на {host}:{port}{WEBHOOK_PATH}, воркеров: {self.workers}")
+
+    def start_workers(self):
+        """Только пул воркеров — апдейты передаются через accept() без HTTP-сервера."""
+        for queue in self._queues:
+            self._tasks.append(asyncio.create_task(self._worker(queue)))
+
+    async def accept(self, data: dict, wait: bool = False) -> bool:
+        """
+        Принимает апдейт (повторы по update_id отбрасываются). При переполненной
+        очереди возвращает False, а с wait=True ждёт свободного места.
+        """
+        update_id = data["update_id"]
+        if update_id in self._seen:
+            # Повторная доставка того же апдейта — ещё раз не обрабатываем
+            self.duplicates += 1
+            return True
+        # Запоминаем до постановки в очередь: повтор, пришедший, пока ждём места, — уже дубликат
+        self._remember(update_id)
+        if not wait and self._slots.locked():
+            # Апдейт не принят — его повторная доставка должна обработаться
+            self._seen.pop(update_id, None)
+            self.rejected += 1
+            return False
+        try:
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            self._seen.pop(update_id, None)
+            raise
+
+        self._shard(data).put_nowait(data)
+        self.received += 1
+        return True
+
+    async def stop(self):
+        """Перестаём принимать апдейты и дожидаемся обработки уже принятых."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        for queue in self._queues:
+            await queue.join()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": sum(queue.qsize() for queue in self._queues),
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(_SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+            accepted = await self.accept(data)
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        return web.Response(status=200 if accepted else 503)
+
+    def _shard(self, data: dict) -> asyncio.Queue:
+        """Очередь по ID пользователя; апдейты без пользователя распределяются по update_id."""
+        key = update_user_id(data) or data["update_id"]
+        return self._queues[key % len(self._queues)]
+
+    def _remember(self, update_id: int):
+        self._seen[update_id] = None
+        while len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            data = await queue.get()
+            try:
+                await self.process(data)
+            except Exception as e:
+                self.errors += 1
+                print(f"[WEBHOOK] Ошибка при обработке апдейта {data.get('update_id')}: {e}")
+            finally:
+                queue.task_done()
+                self._slots.release()
+
+
+async def _feed_dispatcher(data: dict):
+    update = Update.model_validate(data, context={"bot": bot})
+    await dp.feed_update(bot, update)
+
+
+webhook_server = WebhookServer(
+    workers=WEBHOOK_WORKERS,
+    queue_size=WEBHOOK_QUEUE_SIZE,
+    dedup_size=WEBHOOK_DEDUP_SIZE
+)
+
+registry.gauge(
+    "fitai_webhook_queue_depth", "Принятых апдейтов, ожидающих воркера",
+    lambda: webhook_server.stats()["queue_depth"]
+)
+registry.counter_from("fitai_webhook_updates_total", "Принятых апдейтов", lambda: webhook_server.received)
+registry.counter_from(
+    "fitai_webhook_duplicates_total", "Повторных доставок, отброшенных по update_id",
+    lambda: webhook_server.duplicates
+)
+registry.counter_from(
+    "fitai_webhook_rejected_total", "Апдейтов, отклонённых из-за переполненной очереди",
+    lambda: webhook_server.rejected
+)